@@ -0,0 +1,72 @@
+import logging
+import math
+
+import numpy as np
+
+# steering values splitting data into left, center and right turns
+DEFAULT_BUCKET_EDGES = (-0.05, 0.05)
+
+
+def bucket_edges_for_count(steerings, buckets_count):
+	"""
+	Returns edges of equally wide steering buckets spanning range of given steering values
+	"""
+	return np.linspace(np.min(steerings), np.max(steerings), buckets_count + 1)[1:-1]
+
+
+def parse_bucket_edges(s):
+	return check_bucket_edges([float(value) for value in s.split(',')])
+
+
+def check_bucket_edges(bucket_edges):
+	if np.any(np.diff(bucket_edges) <= 0):
+		raise ValueError("Bucket edges have to be increasing: {}".format(list(bucket_edges)))
+	return bucket_edges
+
+
+def get_bucket_ids(steerings, bucket_edges):
+	"""
+	Returns bucket of every steering, steering equal to an edge belongs to the bucket farther from zero
+	(with default edges -0.05 is a left and 0.05 a right turn)
+	"""
+	edges = np.asarray(bucket_edges, dtype=float)
+	steerings = np.asarray(steerings, dtype=float)[:, np.newaxis]
+	return np.sum(np.where(edges < 0, steerings > edges, steerings >= edges), axis=1)
+
+
+class BalancedBatchSampler:
+	"""
+	Draws batches (as indices of data rows) with the same number of samples from every steering bucket.
+	Bucket i contains steerings between edges[i - 1] and edges[i] (see get_bucket_ids). Within an epoch every bucket
+	is sampled without replacement; buckets smaller than needed for an epoch are repeated in the same order.
+	"""
+
+	def __init__(self, steerings, batch_size, bucket_edges=DEFAULT_BUCKET_EDGES, seed=None):
+		bucket_ids = get_bucket_ids(steerings, check_bucket_edges(bucket_edges))
+		buckets = [np.flatnonzero(bucket_ids == bucket) for bucket in range(len(bucket_edges) + 1)]
+		self.buckets = [bucket for bucket in buckets if len(bucket) > 0]
+		if len(self.buckets) < len(buckets):
+			logging.warning("{} of {} steering buckets are empty, skip them".format(
+				len(buckets) - len(self.buckets),
+				len(buckets)))
+
+		if batch_size < len(self.buckets):
+			raise ValueError("Batch size {} is smaller than number of steering buckets {}".format(
+				batch_size, len(self.buckets)))
+		self.bucket_batch_size = int(batch_size / len(self.buckets))
+		self.batch_size = self.bucket_batch_size * len(self.buckets)
+		self.steps = math.ceil(len(bucket_ids) / batch_size)
+		self.seed = seed if seed is not None else np.random.randint(2 ** 31 - 1)
+		self._permutations = None
+		self.set_epoch(0)
+
+	def __len__(self):
+		return self.steps
+
+	def set_epoch(self, epoch):
+		random_state = np.random.RandomState([self.seed, epoch])
+		self._permutations = [random_state.permutation(bucket) for bucket in self.buckets]
+
+	def batch_indices(self, batch):
+		offsets = np.arange(batch * self.bucket_batch_size, (batch + 1) * self.bucket_batch_size)
+		return np.concatenate([permutation[offsets % len(permutation)] for permutation in self._permutations])
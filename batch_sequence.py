@@ -0,0 +1,81 @@
+import time
+
+import numpy as np
+import tensorflow as tf
+
+from batch_sampler import BalancedBatchSampler, DEFAULT_BUCKET_EDGES
+from data_augmentation import fill_batch, augment_batch
+from feature_cache import fill_feature_batch
+
+# stages of producing a batch (seconds), measured when the sequence is given a timings queue
+INPUT_STAGES = ['load', 'choice', 'augment', 'produce']
+
+
+class BalancedBatchSequence(tf.keras.utils.Sequence):
+	"""
+	Balanced batches as a keras Sequence, so they can be produced by many worker processes at once.
+	Content of a batch depends only on the seed, epoch and batch number (not on the number of workers).
+	With timings_queue (shared by workers, e.g. multiprocessing.Manager().Queue()) times of INPUT_STAGES of every
+	batch are put into it as (epoch, batch, timings).
+	"""
+
+	def __init__(self, data, batch_size, is_training, use_packed=False, bucket_edges=DEFAULT_BUCKET_EDGES, seed=None,
+	             augment=False, use_cache=False, timings_queue=None):
+		self._rows = data.values
+		self._sampler = BalancedBatchSampler(data['steering'].values, batch_size, bucket_edges, seed)
+		self._is_training = is_training
+		self._use_packed = use_packed
+		self._augment = augment and is_training
+		self._use_cache = use_cache
+		self._timings_queue = timings_queue
+		self._epoch = 0
+
+	@property
+	def seed(self):
+		return self._sampler.seed
+
+	def __len__(self):
+		return len(self._sampler)
+
+	def __getitem__(self, batch):
+		start = time.time()
+		timings = dict.fromkeys(INPUT_STAGES, 0.0) if self._timings_queue is not None else None
+		random_state = np.random.RandomState([self._sampler.seed, self._epoch, batch])
+		rows = self._rows[self._sampler.batch_indices(batch)]
+		inputs, steers = self._fill_batch(rows, random_state, timings)
+		if timings is not None:
+			timings['produce'] = time.time() - start
+			self._timings_queue.put((self._epoch, batch, timings))
+		return inputs, steers
+
+	def _fill_batch(self, rows, random_state, timings=None):
+		images, steers = fill_batch(rows, self._is_training, self._use_packed, random_state, self._use_cache, timings)
+		if self._augment:
+			start = time.time()
+			images, steers = augment_batch(images, steers, random_state)
+			if timings is not None:
+				timings['augment'] = time.time() - start
+		return images, steers
+
+	def on_epoch_end(self):
+		self._epoch += 1
+		self._sampler.set_epoch(self._epoch)
+
+
+class FeatureBatchSequence(BalancedBatchSequence):
+	"""
+	Balanced batches of cached features of frozen layers of the model (see feature_cache.py)
+	"""
+
+	def __init__(self, data, batch_size, is_training, feature_key, bucket_edges=DEFAULT_BUCKET_EDGES, seed=None,
+	             timings_queue=None):
+		super(FeatureBatchSequence, self).__init__(data, batch_size, is_training, bucket_edges=bucket_edges, seed=seed,
+		                                           timings_queue=timings_queue)
+		self._feature_key = feature_key
+
+	def _fill_batch(self, rows, random_state, timings=None):
+		start = time.time()
+		features, steers = fill_feature_batch(rows, self._is_training, self._feature_key, random_state)
+		if timings is not None:
+			timings['load'] = time.time() - start
+		return features, steers
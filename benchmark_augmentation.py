@@ -0,0 +1,60 @@
+import argparse
+import time
+
+import numpy as np
+
+from data_augmentation import augment, augment_batch, fill_batch, INPUT_SHAPE
+from dataset_index import load_dataset
+
+
+# run: python benchmark_augmentation.py -b 150 -n 20 -d .\out\data
+
+def per_image_augmentation(images, steers):
+	"""
+	Augmentation used before augment_batch: brightness (HSV round trip) and noise for every image separately
+	"""
+	augmented = np.empty_like(images)
+	for i in range(len(images)):
+		augmented[i], steers[i, 0] = augment(images[i], steers[i, 0])
+	return augmented, steers
+
+
+def load_batch(args):
+	if args.data:
+		data = load_dataset(args.data)
+		rows = data.values[np.random.RandomState(0).randint(0, len(data), args.batch_size)]
+		return fill_batch(rows, True, random_state=np.random.RandomState(0))
+	random_state = np.random.RandomState(0)
+	images = random_state.randint(0, 256, (args.batch_size,) + INPUT_SHAPE).astype(np.uint8)
+	steers = random_state.uniform(-1, 1, (args.batch_size, 2)).astype(np.float32)
+	return images, steers
+
+
+def measure(function, images, steers, batches):
+	start = time.time()
+	for batch in range(batches):
+		function(images, steers.copy(), batch)
+	return batches * len(images) / (time.time() - start)
+
+
+def main():
+	parser = argparse.ArgumentParser(description='Measures throughput of batch augmentation')
+	parser.add_argument('-b', '--batch-size', type=int, default=150)
+	parser.add_argument('-n', '--batches', type=int, default=20)
+	parser.add_argument('-d', '--data', default=None, help='data directory (random images if not given)')
+	args = parser.parse_args()
+
+	images, steers = load_batch(args)
+	before = measure(lambda i, s, batch: per_image_augmentation(i, s), images, steers, args.batches)
+	after = measure(lambda i, s, batch: augment_batch(i, s, np.random.RandomState(batch)), images, steers, args.batches)
+
+	print('-' * 30)
+	print('Batch: {}, batches: {}'.format(images.shape, args.batches))
+	print('{:<48} {:>10.1f} images/s'.format('per image (brightness, noise)', before))
+	print('{:<48} {:>10.1f} images/s'.format('augment_batch (translation, brightness, shadow, noise)', after))
+	print('Speedup: {:.1f}x'.format(after / before))
+	print('-' * 30)
+
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,125 @@
+import argparse
+import logging
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+from drive import CarlaGame, PipelinedCarlaGame, FUSION_WEIGHTS
+from neural_networks.neural_networks_common import add_model_cmd_arg, load_model, get_empty_model, \
+	get_inference_function, load_exported_model
+from replay_client import make_replay_client
+
+
+# run: python benchmark_drive.py -m nvidia -c 18 -d out\data\20181113184752 -n 500
+
+def timed(function, times):
+	def wrapper(*args, **kwargs):
+		start = time.time()
+		result = function(*args, **kwargs)
+		times.append(time.time() - start)
+		return result
+
+	return wrapper
+
+
+def timed_read(client, read_times, replay_times):
+	read_data = client.read_data
+
+	def wrapper():
+		start = time.time()
+		result = read_data()
+		elapsed = time.time() - start
+		# replayed images are resized to simulator frames by the replay client only, it is not a cost of the loop
+		replay_times.append(client.replay_seconds)
+		read_times.append(elapsed - client.replay_seconds)
+		return result
+
+	return wrapper
+
+
+def instrument(game, client):
+	"""
+	Replaces methods of every stage of the control loop with ones measuring their time
+	"""
+	stage_times = OrderedDict((stage, []) for stage in ['read', 'decode', 'preprocess', 'inference', 'send', 'replay'])
+	client.read_data = timed_read(client, stage_times['read'], stage_times['replay'])
+	client.send_control = timed(client.send_control, stage_times['send'])
+	game._decode = timed(game._decode, stage_times['decode'])
+	game._preprocess = timed(game._preprocess, stage_times['preprocess'])
+	game._infer = timed(game._infer, stage_times['inference'])
+	return stage_times
+
+
+def run_benchmark(args, predict):
+	with make_replay_client(args.data, args.rate, args.synthetic_frames) as client:
+		game = PipelinedCarlaGame(client, args, predict) if args.pipelined else CarlaGame(client, args, predict)
+		stage_times = instrument(game, client)
+		game._initialize_game()
+		try:
+			for frame in range(1, args.warmup + 1):
+				game._on_loop(frame)
+			for times in stage_times.values():
+				del times[:]
+
+			start = time.time()
+			for frame in range(args.warmup + 1, args.warmup + args.frames + 1):
+				game._on_loop(frame)
+			elapsed = time.time() - start
+		finally:
+			if args.pipelined:
+				game._stop.set()
+
+	return stage_times, elapsed
+
+
+def print_report(args, stage_times, elapsed):
+	print('-' * 30)
+	print('Model: {} (checkpoint: {}), fusion: {}, pipelined: {}'.format(
+		args.model, args.checkpoint, args.fusion, args.pipelined))
+	print('{:<12} {:>10} {:>10} {:>10}'.format('stage', 'mean [ms]', 'p50 [ms]', 'p95 [ms]'))
+	for stage, times in stage_times.items():
+		if len(times) == 0:
+			continue
+		times = np.array(times) * 1000
+		print('{:<12} {:>10.3f} {:>10.3f} {:>10.3f}'.format(
+			stage, np.mean(times), np.percentile(times, 50), np.percentile(times, 95)))
+	print('(replay - resizing of replayed images to simulator frames, not a part of the control loop)')
+	print('Sustained: {:.1f} FPS ({} frames in {:.2f}s)'.format(args.frames / elapsed, args.frames, elapsed))
+	print('-' * 30)
+
+
+def main():
+	argparser = argparse.ArgumentParser(description='Benchmarks drive.py control loop on replayed frames')
+	add_model_cmd_arg(argparser)
+	argparser.add_argument('-c', '--checkpoint', type=int, default=0,
+	                       help='number of model\'s checkpoint to load (0 - untrained model)')
+	argparser.add_argument('-e', '--exported', default=None, help='benchmark a model exported by export_model.py')
+	argparser.add_argument('-d', '--data', default=None,
+	                       help='data directory to replay (synthetic frames if not given)')
+	argparser.add_argument('-r', '--rate', type=float, default=0.0, help='replay rate in frames/s (0 - unlimited)')
+	argparser.add_argument('-s', '--synthetic-frames', type=int, default=100, help='number of synthetic frames')
+	argparser.add_argument('-n', '--frames', type=int, default=500, help='number of measured frames')
+	argparser.add_argument('--warmup', type=int, default=20, help='number of frames before measuring')
+	argparser.add_argument('-f', '--fusion', default='center', choices=sorted(FUSION_WEIGHTS.keys()))
+	argparser.add_argument('--pipelined', action='store_true')
+	argparser.add_argument('--control-latency', type=int, default=1)
+	argparser.add_argument('-q', '--quality-level', default='Epic')
+	argparser.add_argument('-w', '--weather', type=int, default=0)
+	argparser.add_argument('-t', '--map_name', default='TestTown')
+	args = argparser.parse_args()
+	logging.basicConfig(format='%(levelname)s: %(message)s', level=logging.WARNING)
+
+	if args.exported:
+		predict = load_exported_model(args.exported)
+	elif args.checkpoint == 0:
+		predict = get_inference_function(get_empty_model(args.model, False))
+	else:
+		predict = get_inference_function(load_model(args.model, args.checkpoint, False))
+
+	stage_times, elapsed = run_benchmark(args, predict)
+	print_report(args, stage_times, elapsed)
+
+
+if __name__ == '__main__':
+	main()
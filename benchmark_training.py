@@ -0,0 +1,112 @@
+import argparse
+import csv
+import json
+import subprocess
+import sys
+import time
+
+import numpy as np
+
+from data_augmentation import INPUT_SHAPE
+from neural_networks.neural_networks_common import MODELS, PRECISIONS, TRAINING_MODES
+
+# batch sizes of train_all.py
+BATCH_SIZES = {
+	'nvidia': 150,
+	'densenet': 50,
+	'resnet': 30,
+	'vgg': 90
+}
+REPORT_COLUMNS = ['model', 'precision', 'xla', 'default', 'batch_size', 'samples_per_second', 'peak_memory_mb']
+
+
+# run: python benchmark_training.py -m resnet densenet -n 50 -o training_modes.csv
+
+def measure_mode(model_name, precision, xla, batch_size, warmup, steps):
+	"""
+	Trains the model on random batches, returns training throughput (samples/s) and peak GPU memory (MB)
+	"""
+	from neural_networks.neural_networks_common import get_empty_model, configure_training_session, \
+		get_training_optimizer, get_peak_memory_function
+
+	configure_training_session(xla)
+	model = get_empty_model(model_name, False)
+	model.compile(loss='mean_squared_error', optimizer=get_training_optimizer(1.0e-4, precision))
+	peak_memory = get_peak_memory_function()
+
+	random_state = np.random.RandomState(0)
+	images = random_state.randint(0, 256, (batch_size,) + INPUT_SHAPE).astype(np.uint8)
+	steers = random_state.uniform(-1, 1, (batch_size, 2)).astype(np.float32)
+	for _ in range(warmup):
+		model.train_on_batch(images, steers)
+	start = time.time()
+	for _ in range(steps):
+		model.train_on_batch(images, steers)
+	elapsed = time.time() - start
+
+	peak_bytes = peak_memory()
+	return steps * batch_size / elapsed, None if peak_bytes is None else peak_bytes / 2 ** 20
+
+
+def run_mode(args, model_name, precision, xla):
+	"""
+	Measures every mode in a separate process, so peak memory and session settings do not leak between modes
+	"""
+	batch_size = args.batch_size or BATCH_SIZES[model_name]
+	command = [sys.executable, __file__, '--measure', json.dumps([model_name, precision, xla, batch_size]),
+	           '-w', str(args.warmup), '-n', str(args.steps)]
+	output = subprocess.run(command, stdout=subprocess.PIPE, universal_newlines=True).stdout
+	default = TRAINING_MODES[model_name] == {'precision': precision, 'xla': xla}
+	result = {'model': model_name, 'precision': precision, 'xla': xla, 'default': default, 'batch_size': batch_size,
+	          'samples_per_second': None, 'peak_memory_mb': None}
+	# measurement is the last line of the output (models print their summaries before)
+	lines = output.strip().splitlines()
+	if lines and lines[-1].startswith('{'):
+		result.update(json.loads(lines[-1]))
+	return result
+
+
+def print_report(results):
+	print('-' * 80)
+	print('{:<10} {:<10} {:<6} {:>6} {:>14} {:>16}'.format('model', 'precision', 'xla', 'batch', 'samples/s',
+	                                                       'peak memory MB'))
+	print('-' * 80)
+	for result in results:
+		print('{:<10} {:<10} {:<6} {:>6} {:>14} {:>16}{}'.format(
+			result['model'], result['precision'], str(result['xla']), result['batch_size'],
+			'failed' if result['samples_per_second'] is None else '{:.1f}'.format(result['samples_per_second']),
+			'-' if result['peak_memory_mb'] is None else '{:.0f}'.format(result['peak_memory_mb']),
+			' (default)' if result['default'] else ''))
+	print('-' * 80)
+
+
+def main():
+	parser = argparse.ArgumentParser(description='Measures training throughput and memory of every training mode')
+	parser.add_argument('-m', '--models', nargs='+', choices=list(MODELS.keys()), default=list(MODELS.keys()))
+	parser.add_argument('--precisions', nargs='+', choices=PRECISIONS, default=PRECISIONS)
+	parser.add_argument('-b', '--batch-size', type=int, default=0, help='batch size (0 - batch size of train_all.py)')
+	parser.add_argument('-w', '--warmup', type=int, default=5, help='steps before measurement (XLA compilation)')
+	parser.add_argument('-n', '--steps', type=int, default=30, help='number of measured steps')
+	parser.add_argument('-o', '--output', default=None, help='csv file with the report')
+	parser.add_argument('--measure', default=None, help=argparse.SUPPRESS)
+	args = parser.parse_args()
+
+	if args.measure:
+		model_name, precision, xla, batch_size = json.loads(args.measure)
+		samples_per_second, peak_memory_mb = measure_mode(model_name, precision, xla, batch_size, args.warmup,
+		                                                  args.steps)
+		print(json.dumps({'samples_per_second': samples_per_second, 'peak_memory_mb': peak_memory_mb}))
+		return
+
+	results = [run_mode(args, model_name, precision, xla)
+	           for model_name in args.models for precision in args.precisions for xla in [False, True]]
+	print_report(results)
+	if args.output:
+		with open(args.output, 'w', newline='') as f:
+			writer = csv.DictWriter(f, fieldnames=REPORT_COLUMNS)
+			writer.writeheader()
+			writer.writerows(results)
+
+
+if __name__ == '__main__':
+	main()
@@ -1,14 +1,12 @@
 import argparse
 import pandas as pd
 import numpy as np
-from fastdtw import fastdtw
-from scipy.spatial.distance import euclidean
+from dtw_distance import dtw, DTW_MODES
 
 
-def compare(line1, line2):
-	distance, path = fastdtw(line1, line2, dist=euclidean, radius=10)
+def compare(line1, line2, mode='fast', radius=10):
+	distance, path = dtw(line1, line2, mode, radius)
 	print(distance)
-	pass
 
 
 if __name__ == '__main__':
@@ -19,9 +17,20 @@ if __name__ == '__main__':
 	argparser.add_argument(
 		'-l2', '--line2'
 	)
+	argparser.add_argument(
+		'-m', '--mode',
+		choices=DTW_MODES,
+		default='fast',
+		help='fast - FastDTW (default), exact - full DTW, sakoe_chiba - DTW in a band around diagonal'
+	)
+	argparser.add_argument(
+		'-r', '--radius',
+		type=int,
+		default=10
+	)
 	args = argparser.parse_args()
 
 	line1 = pd.read_csv(args.line1, dtype={'x': np.float, 'y': np.float})
 	line2 = pd.read_csv(args.line2, dtype={'x': np.float, 'y': np.float})
 
-	compare(np.column_stack((line1['x'], line1['y'])), np.column_stack((line2['x'], line2['y'])))
+	compare(np.column_stack((line1['x'], line1['y'])), np.column_stack((line2['x'], line2['y'])), args.mode, args.radius)
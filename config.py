@@ -3,6 +3,27 @@ CENTER_CAMERA_NAME = 'CameraRGB_C_{:0>6d}.png'
 RIGHT_CAMERA_NAME = 'CameraRGB_R_{:0>6d}.png'
 
 MEASUREMENTS_CSV_FILENAME = 'measurements.csv'
+PACKED_FRAMES_FILENAME = 'frames.npy'
+PACKED_LABELS_FILENAME = 'labels.npy'
+DATASET_INDEX_FILENAME = 'dataset_index.sqlite'
+SHARDS_INDEX_FILENAME = 'shards.json'
+SHARD_FRAMES_FILENAME = 'frames-{:05d}.npy'
+KEPT_FRAMES_FILENAME = 'kept_frames.npy'
+# rows and mtime of measurements.csv the kept frames were selected from, stale kept frames are ignored
+KEPT_FRAMES_INFO_FILENAME = 'kept_frames.json'
+# cached frames of runs (see frame_cache.py): FRAME_CACHE_DIRECTORY\<input shape>-<spec hash>\<run>\
+FRAME_CACHE_DIRECTORY = '.\\out\\cache'
+CACHED_FRAMES_FILENAME = 'frames.npy'
+CACHE_INFO_FILENAME = 'cache.json'
+# cached features of frozen backbones (see feature_cache.py):
+# FEATURE_CACHE_DIRECTORY\<model>-<precision>-<weights hash>\<run>\
+FEATURE_CACHE_DIRECTORY = '.\\out\\features'
+CACHED_FEATURES_FILENAME = 'features.npy'
+
+# exit code of gather_data.py which could not connect to the server (run_gather_data.py retries the job)
+CONNECTION_ERROR_EXIT_CODE = 3
+# exit code of gather_data.py which could not save some of the frames (they have no row in measurements.csv)
+FRAMES_ERROR_EXIT_CODE = 4
 
 MINIMAL_SPEED = 15
 MAXIMAL_SPEED = 25
@@ -1,9 +1,16 @@
+import hashlib
+import json
+import time
+
 import numpy as np
 import cv2
 import os
 import logging
 
-from config import CENTER_CAMERA_NAME, LEFT_CAMERA_NAME, RIGHT_CAMERA_NAME
+from batch_sampler import BalancedBatchSampler, DEFAULT_BUCKET_EDGES
+from config import CENTER_CAMERA_NAME, LEFT_CAMERA_NAME, RIGHT_CAMERA_NAME, PACKED_FRAMES_FILENAME, \
+	SHARDS_INDEX_FILENAME, SHARD_FRAMES_FILENAME, FRAME_CACHE_DIRECTORY, CACHED_FRAMES_FILENAME, \
+	MEASUREMENTS_CSV_FILENAME, PACKED_LABELS_FILENAME
 import pandas as pd
 
 IMAGE_HEIGHT, IMAGE_WIDTH, IMAGE_CHANNELS = 64, 200, 3
@@ -11,6 +18,40 @@ INPUT_SHAPE = (IMAGE_HEIGHT, IMAGE_WIDTH, IMAGE_CHANNELS)
 
 RANDOM_IMAGE_NOISE_PROBABILITY = 0.2
 IMAGE_NOISE_TYPE = 's&p'
+# fraction of values of the image set to 0 or 255 by salt and pepper noise
+SALT_AND_PEPPER_AMOUNT = 0.004
+
+# batch augmentation (augment_batch): brightness ratio from 1 +- BRIGHTNESS_RANGE / 2, shadow darkening one side of a
+# random line with ratio from SHADOW_RATIO_RANGE, translation by up to +- TRANSLATION_RANGE / 2 pixels
+BRIGHTNESS_RANGE = 0.4
+SHADOW_PROBABILITY = 0.5
+SHADOW_RATIO_RANGE = (0.5, 0.9)
+TRANSLATION_RANGE_X, TRANSLATION_RANGE_Y = 40, 8
+# steering added for every pixel of horizontal translation
+TRANSLATION_STEERING_PER_PIXEL = 0.002
+MULTIPLIER_SCALE = 128
+
+# steering added to the label of the left camera image (and subtracted for the right one)
+SIDE_CAMERA_STEERING_CORRECTION = 0.2
+
+# memory mapped frames of packed directories (see packed_data.py), opened once per process
+_packed_frames = {}
+# indexes (or None for not sharded directories) and memory mapped shards of recorded directories (see frame_shards.py)
+_shards_indexes = {}
+_shards = {}
+# memory mapped cached frames of run directories (see frame_cache.py)
+_cached_frames = {}
+
+# preprocessing of cached frames: rows cropped from top and bottom of the recorded frame, then resized to input_shape.
+# Version has to be increased whenever the code applying the spec changes, cached frames are then built again.
+# Spec without crop and with the input shape of recorded frames is identity, packed frames are used as the cache then.
+CACHE_SPEC = {
+	'version': 1,
+	'input_shape': list(INPUT_SHAPE),
+	'crop': [0, 0],
+	'interpolation': 'area',
+	'colors': 'rgb'
+}
 
 
 # Source of the code is based on an excelent piece code from stackoverflow
@@ -42,17 +83,17 @@ def noise_generator(noise_type, image):
 		return noisy.astype('uint8')
 	elif noise_type == "s&p":
 		s_vs_p = 0.5
-		amount = 0.004
-		out = image
+		amount = SALT_AND_PEPPER_AMOUNT
+		out = image.copy()
 		# Generate Salt '1' noise
 		num_salt = np.ceil(amount * image.size * s_vs_p)
-		coords = [np.random.randint(0, i - 1, int(num_salt))
-		          for i in image.shape]
+		coords = tuple(np.random.randint(0, i - 1, int(num_salt))
+		               for i in image.shape)
 		out[coords] = 255
 		# Generate Pepper '0' noise
 		num_pepper = np.ceil(amount * image.size * (1. - s_vs_p))
-		coords = [np.random.randint(0, i - 1, int(num_pepper))
-		          for i in image.shape]
+		coords = tuple(np.random.randint(0, i - 1, int(num_pepper))
+		               for i in image.shape)
 		out[coords] = 0
 		return out
 	elif noise_type == "poisson":
@@ -98,14 +139,14 @@ def random_brightness(img):
 	return cv2.cvtColor(hsv, cv2.COLOR_HSV2RGB)
 
 
-def choose_image(center, left, right, angle):
-	chosen = np.random.choice(3)
+def choose_image(center, left, right, angle, random_state=np.random):
+	chosen = random_state.choice(3)
 	if chosen == 0:
 		return center, angle
 	if chosen == 1:
-		return left, angle + 0.2
+		return left, angle + SIDE_CAMERA_STEERING_CORRECTION
 	if chosen == 2:
-		return right, angle - 0.2
+		return right, angle - SIDE_CAMERA_STEERING_CORRECTION
 
 
 def preprocess(img):
@@ -123,6 +164,70 @@ def augment(img, angle):
 	return augmented_img, augmented_angle
 
 
+def augment_batch(images, steers, random_state=np.random):
+	"""
+	Augments the whole batch at once: random translation (with steering correction), brightness, shadow
+	and salt and pepper noise. Parameters of every sample are drawn from random_state.
+	Returns new images, steers are corrected in place.
+	"""
+	batch_size, height, width, channels = images.shape
+
+	# translation, pixels outside of the image are copied from its edge
+	shift_x = np.round(TRANSLATION_RANGE_X * (random_state.rand(batch_size) - 0.5)).astype(int)
+	shift_y = np.round(TRANSLATION_RANGE_Y * (random_state.rand(batch_size) - 0.5)).astype(int)
+	rows = np.clip(np.arange(height) - shift_y[:, np.newaxis], 0, height - 1)
+	images = shift_columns(images, shift_x, rows)
+	steers[:, 0] = np.clip(steers[:, 0] + shift_x * TRANSLATION_STEERING_PER_PIXEL, -1.0, 1.0)
+
+	# brightness and shadow as one multiplier of every pixel (scaling RGB scales V of HSV),
+	# shadow covers pixels on the right of line from (x1, 0) to (x2, height)
+	brightness = 1.0 + BRIGHTNESS_RANGE * (random_state.rand(batch_size) - 0.5)
+	has_shadow = random_state.rand(batch_size) < SHADOW_PROBABILITY
+	shadow_ratio = np.where(has_shadow, random_state.uniform(*SHADOW_RATIO_RANGE, size=batch_size), 1.0)
+	x1, x2 = random_state.rand(2, batch_size) * width
+	boundary = (x1[:, np.newaxis] + (x2 - x1)[:, np.newaxis] * np.arange(height) / height).astype(np.int16)
+	in_shadow = np.arange(width, dtype=np.int16) >= boundary[:, :, np.newaxis]
+	# multipliers are fixed point numbers (MULTIPLIER_SCALE represents 1.0), cv2.multiply saturates results at 255
+	lit = np.round(brightness * MULTIPLIER_SCALE).astype(np.uint8)
+	shadowed = np.round(brightness * shadow_ratio * MULTIPLIER_SCALE).astype(np.uint8)
+	# uint8 arithmetic wraps around, so lit + (shadowed - lit) is shadowed even when shadowed < lit
+	multiplier = in_shadow.view(np.uint8) * (shadowed - lit)[:, np.newaxis, np.newaxis]
+	multiplier += lit[:, np.newaxis, np.newaxis]
+	multiplier = cv2.merge([multiplier.reshape(batch_size * height, width)] * channels)
+	cv2.multiply(images.reshape(batch_size * height, width, channels), multiplier, images.reshape(-1, width, channels),
+	             scale=1.0 / MULTIPLIER_SCALE)
+
+	# salt and pepper noise in random samples
+	noisy = np.flatnonzero(random_state.rand(batch_size) < RANDOM_IMAGE_NOISE_PROBABILITY)
+	noise_count = int(np.ceil(SALT_AND_PEPPER_AMOUNT * height * width * channels / 2))
+	flat_images = images.reshape(batch_size, -1)
+	for value in (255, 0):
+		positions = random_state.randint(0, flat_images.shape[1], (len(noisy), noise_count))
+		flat_images[noisy[:, np.newaxis], positions] = value
+
+	return images, steers
+
+
+def shift_columns(images, shifts, rows):
+	"""
+	Shifts every image horizontally by its number of pixels (one copy for all images with the same shift),
+	rows of the result are taken from given rows of the source image
+	"""
+	shifted = np.empty_like(images)
+	for shift in np.unique(shifts):
+		samples = np.flatnonzero(shifts == shift)
+		source = images[samples[:, np.newaxis], rows[samples]]
+		if shift > 0:
+			shifted[samples, :, shift:] = source[:, :, :-shift]
+			shifted[samples, :, :shift] = source[:, :, :1]
+		elif shift < 0:
+			shifted[samples, :, :shift] = source[:, :, -shift:]
+			shifted[samples, :, shift:] = source[:, :, -1:]
+		else:
+			shifted[samples] = source
+	return shifted
+
+
 def load_image(directory_path, file):
 	img = cv2.imread(os.path.join(directory_path, file))
 	return cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
@@ -134,66 +239,172 @@ def load_images(directory_path, frame):
 	       load_image(directory_path, RIGHT_CAMERA_NAME.format(frame))
 
 
-def get_acceleration(acceleration, braking):
-	return acceleration - braking  # we can not have both values different 0. So we get either acceleration either -breaking, range[-1, 1]
+def is_packed(directory):
+	frames_file = os.path.join(directory, PACKED_FRAMES_FILENAME)
+	labels_file = os.path.join(directory, PACKED_LABELS_FILENAME)
+	if not os.path.exists(frames_file) or not os.path.exists(labels_file):
+		return False
+	measurements_file = os.path.join(directory, MEASUREMENTS_CSV_FILENAME)
+	return os.path.getmtime(frames_file) >= os.path.getmtime(measurements_file)
+
+
+def open_packed_frames(directory_path):
+	frames = _packed_frames.get(directory_path)
+	if frames is None:
+		frames = np.load(os.path.join(directory_path, PACKED_FRAMES_FILENAME), mmap_mode='r')
+		_packed_frames[directory_path] = frames
+	return frames
+
+
+def load_packed_images(directory_path, index):
+	"""
+	Returns center, left and right images of a packed frame as views of the memory mapped file (no copy, no decoding)
+	"""
+	cameras = open_packed_frames(directory_path)[index]
+	return cameras[0], cameras[1], cameras[2]
+
+
+def read_shards_index(directory_path):
+	if directory_path not in _shards_indexes:
+		index_file = os.path.join(directory_path, SHARDS_INDEX_FILENAME)
+		index = None
+		if os.path.exists(index_file):
+			with open(index_file) as f:
+				index = json.load(f)
+		_shards_indexes[directory_path] = index
+	return _shards_indexes[directory_path]
+
+
+def is_sharded(directory_path):
+	return read_shards_index(directory_path) is not None
+
+
+def load_shard_images(directory_path, index):
+	"""
+	Returns center, left and right images of a frame recorded into shards as views of the memory mapped shard
+	"""
+	frames_per_shard = read_shards_index(directory_path)['frames_per_shard']
+	shard = index // frames_per_shard
+	frames = _shards.get((directory_path, shard))
+	if frames is None:
+		frames = np.load(os.path.join(directory_path, SHARD_FRAMES_FILENAME.format(shard)), mmap_mode='r')
+		_shards[(directory_path, shard)] = frames
+	cameras = frames[index % frames_per_shard]
+	return cameras[0], cameras[1], cameras[2]
+
+
+def get_cache_spec(input_shape=INPUT_SHAPE):
+	return dict(CACHE_SPEC, input_shape=list(input_shape))
+
+
+def is_identity_spec(input_shape=INPUT_SHAPE):
+	"""
+	Returns True when cached frames would be the same as packed frames (see packed_data.py)
+	"""
+	spec = get_cache_spec(input_shape)
+	return spec['crop'] == [0, 0] and tuple(spec['input_shape']) == INPUT_SHAPE
 
 
-def normalize_colors(img):
-	return img / 127.5 - 1.0
+def uses_packed_cache(directory_path, input_shape=INPUT_SHAPE):
+	# packed frames are not stored once more in the cache
+	return is_identity_spec(input_shape) and not is_sharded(directory_path) and is_packed(directory_path)
 
 
-def add_single_data_frame(row, is_training, images, steers, i):
-	frame, steering_angle, acceleration, braking, data_dir = row
+def get_cache_key(input_shape=INPUT_SHAPE):
+	spec = json.dumps(get_cache_spec(input_shape), sort_keys=True)
+	return '{}-{}'.format('x'.join(str(d) for d in input_shape), hashlib.sha1(spec.encode('utf-8')).hexdigest()[:10])
+
+
+def get_cache_directory(directory_path, input_shape=INPUT_SHAPE):
+	"""
+	Returns directory with cached frames of the run for the current preprocessing spec and given input shape
+	"""
+	path_hash = hashlib.sha1(os.path.abspath(directory_path).encode('utf-8')).hexdigest()[:8]
+	run_key = '{}-{}'.format(os.path.basename(os.path.normpath(directory_path)), path_hash)
+	return os.path.join(FRAME_CACHE_DIRECTORY, get_cache_key(input_shape), run_key)
+
+
+def load_cached_images(directory_path, index):
+	"""
+	Returns center, left and right images of a frame as views of the memory mapped cache (run frame_cache.py first)
+	or of packed frames when they are the same as cached ones
+	"""
+	frames = _cached_frames.get(directory_path)
+	if frames is None:
+		if uses_packed_cache(directory_path):
+			frames = open_packed_frames(directory_path)
+		else:
+			frames = np.load(os.path.join(get_cache_directory(directory_path), CACHED_FRAMES_FILENAME), mmap_mode='r')
+		_cached_frames[directory_path] = frames
+	cameras = frames[index]
+	return cameras[0], cameras[1], cameras[2]
+
+
+def get_acceleration(acceleration, braking):
+	return acceleration - braking  # we can not have both values different 0. So we get either acceleration either -breaking, range[-1, 1]
+
+
+def add_single_data_frame(row, is_training, images, steers, i, use_packed=False, random_state=np.random,
+                          use_cache=False, timings=None):
+	start = time.time()
+	frame, steering_angle, acceleration, braking, data_dir, packed_index = row
 	acceleration_brake_val = get_acceleration(acceleration, braking)
+	sharded = not use_cache and is_sharded(data_dir)
+	if use_cache:
+		center, left, right = load_cached_images(data_dir, packed_index)
+	elif sharded:
+		center, left, right = load_shard_images(data_dir, packed_index)
+	elif use_packed:
+		center, left, right = load_packed_images(data_dir, packed_index)
+	elif is_training:
+		center, left, right = load_images(data_dir, frame)
+	else:
+		center, left, right = load_image(data_dir, CENTER_CAMERA_NAME.format(frame)), None, None
+	loaded = time.time()
+
 	# argumentation
 	if is_training:
-		center, left, right = load_images(data_dir, frame)
-		image, steering_angle = choose_image(center, left, right, steering_angle)
+		image, steering_angle = choose_image(center, left, right, steering_angle, random_state)
 	else:
-		image = load_image(data_dir, CENTER_CAMERA_NAME.format(frame))
+		image = center
+	if timings is not None:
+		timings['load'] += loaded - start
+		timings['choice'] += time.time() - loaded
 
-	# add the image and steering angle to the batch
-	images[i] = normalize_colors(image)
+	# add the image and steering angle to the batch, colors are normalized inside of the model
+	images[i] = image
 	steers[i, 0] = steering_angle
 	steers[i, 1] = acceleration_brake_val
 
 
-def balanced_data_batch_generator(data, batch_size, is_training):
-	single_batch_size = int(batch_size / 3)
-	images = np.empty([3 * single_batch_size, IMAGE_HEIGHT, IMAGE_WIDTH, IMAGE_CHANNELS])
-	steers = np.empty([3 * single_batch_size, 2])
-
-	data_series = data
-	turn_offset = 0.05
-	s_left = data_series[data_series['steering'] <= -turn_offset]
-	s_right = data_series[data_series['steering'] >= turn_offset]
-	s_center = data_series[
-		np.logical_and(data_series['steering'] > -turn_offset, data_series['steering'] < turn_offset)]
-
-	while True:
-		i = 0
-		for row in np.random.permutation(s_left):
-			add_single_data_frame(row, is_training, images, steers, i)
-
-			i += 1
-			if i == single_batch_size:
-				break
-
-		for row in np.random.permutation(s_right):
-			add_single_data_frame(row, is_training, images, steers, i)
+def fill_batch(rows, is_training, use_packed=False, random_state=np.random, use_cache=False, timings=None):
+	"""
+	Loads images and labels of rows, with timings given seconds of loading (and decoding) and of choosing cameras
+	are added to its 'load' and 'choice' values
+	"""
+	images = np.empty([len(rows), IMAGE_HEIGHT, IMAGE_WIDTH, IMAGE_CHANNELS], dtype=np.uint8)
+	steers = np.empty([len(rows), 2], dtype=np.float32)
+	for i, row in enumerate(rows):
+		add_single_data_frame(row, is_training, images, steers, i, use_packed, random_state, use_cache, timings)
+	return images, steers
 
-			i += 1
-			if i == 2 * single_batch_size:
-				break
 
-		for row in np.random.permutation(s_center):
-			add_single_data_frame(row, is_training, images, steers, i)
+def load_validation_data(data, use_packed=False, use_cache=False):
+	"""
+	Loads center camera images and labels of all frames (in data order), so validation is a single ordered pass
+	"""
+	return fill_batch(data.values, False, use_packed, use_cache=use_cache)
 
-			i += 1
-			if i == 3 * single_batch_size:
-				break
 
-		yield images, steers
+def balanced_data_batch_generator(data, batch_size, is_training, use_packed=False, bucket_edges=DEFAULT_BUCKET_EDGES):
+	sampler = BalancedBatchSampler(data['steering'].values, batch_size, bucket_edges)
+	rows = data.values
+	epoch = 0
+	while True:
+		sampler.set_epoch(epoch)
+		for batch in range(len(sampler)):
+			yield fill_batch(rows[sampler.batch_indices(batch)], is_training, use_packed)
+		epoch += 1
 
 
 if __name__ == '__main__':
@@ -1,52 +1,158 @@
-import csv
+import argparse
+import json
 import logging
-import pandas as pd
-import numpy as np
 import os
+import re
+
+import numpy as np
+import pandas as pd
+
+from dataset_index import load_dataset
+
+# steering below -threshold is a left turn, above threshold is a right turn
+CENTER_THRESHOLD = 0.05
+STEERING_CLASSES = ['left', 'center', 'right']
+CONFIG_FILENAME = 'config.txt'
+# arguments of gathering scripts saved in config.txt: Namespace(debug=True, ..., weather=3)
+CONFIG_ARGUMENT_REGEX = re.compile(r"(\w+)=('[^']*'|[^,)]*)")
+
+FORMAT = '%(asctime)-15s : %(message)s'
+
+
+# run: python data_summary.py -b 20 -o out\data_summary.json
+
+def read_run_config(data_dir):
+	"""
+	Returns map and weather of the run saved by gathering scripts (None when unknown)
+	"""
+	config_file = os.path.join(data_dir, CONFIG_FILENAME)
+	if not os.path.exists(config_file):
+		return None, None
+	with open(config_file) as f:
+		arguments = dict(CONFIG_ARGUMENT_REGEX.findall(f.read()))
+
+	map_name = arguments.get('map_name', 'None').strip("'")
+	weather = arguments.get('weather')
+	return None if map_name == 'None' else map_name, int(weather) if weather is not None else None
+
+
+def add_run_configs(data):
+	data_dirs = data['data_dir'].unique()
+	configs = pd.DataFrame([read_run_config(data_dir) for data_dir in data_dirs], columns=['map', 'weather'])
+	configs['map'] = configs['map'].fillna('unknown')
+	configs['weather'] = configs['weather'].fillna(-1).astype(int)
+	configs['data_dir'] = data_dirs
+	return data.merge(configs, on='data_dir', how='left')
+
+
+def add_steering_classes(data):
+	steering = data['steering'].values
+	classes = (steering > -CENTER_THRESHOLD).astype(int) + (steering >= CENTER_THRESHOLD)
+	data['steering_class'] = pd.Categorical.from_codes(classes, STEERING_CLASSES)
+	data['acceleration'] = data['throttle'] - data['brake']
+	return data
+
 
-from config import MEASUREMENTS_CSV_FILENAME
+def histogram(values, bins):
+	counts, edges = np.histogram(values, bins=bins, range=(-1.0, 1.0))
+	return {'edges': edges.tolist(), 'counts': counts.tolist()}
 
 
-def describe():
-	directory = ".\\out\\data"
+def breakdown(data, column):
+	"""
+	Returns number of left, center and right frames and mean acceleration (throttle - brake) for every value of column
+	"""
+	table = pd.crosstab(data[column], data['steering_class'], dropna=False).reindex(columns=STEERING_CLASSES,
+	                                                                                 fill_value=0)
+	table.insert(0, 'count', table.sum(axis=1))
+	table['acceleration_mean'] = data.groupby(column)['acceleration'].mean()
+	table.index.name = 'key'
+	return table.reset_index()
+
+
+def summarize(data, bins):
+	data = add_steering_classes(add_run_configs(data))
+	classes = data['steering_class'].value_counts().reindex(STEERING_CLASSES, fill_value=0)
+	return {
+		'directories': int(data['data_dir'].nunique()),
+		'count': len(data),
+		'steering': data['steering'].describe().to_dict(),
+		'acceleration': data['acceleration'].describe().to_dict(),
+		'classes': {name: int(count) for name, count in classes.items()},
+		'steering_histogram': histogram(data['steering'].values, bins),
+		'acceleration_histogram': histogram(data['acceleration'].values, bins),
+		'by_directory': breakdown(data, 'data_dir'),
+		'by_map': breakdown(data, 'map'),
+		'by_weather': breakdown(data, 'weather')
+	}
+
+
+def print_histogram(name, values):
+	print(name)
+	total = max(sum(values['counts']), 1)
+	for low, high, count in zip(values['edges'][:-1], values['edges'][1:], values['counts']):
+		print("[{:+.2f}, {:+.2f}): {:>8} {}".format(low, high, count, '#' * int(round(count / total * 50))))
+
+
+def print_summary(summary):
+	for row in summary['by_directory'].itertuples(index=False):
+		print("{}; Right: {}; Center: {}; Left: {}; ".format(row.key, row.right, row.center, row.left))
+
+	print("Directories count: {}".format(summary['directories']))
+	print("Data count: {}".format(summary['count']))
+	print(pd.Series(summary['steering']))
+
+	count = max(summary['count'], 1)
+	left, center, right = (summary['classes'][name] for name in STEERING_CLASSES)
+	print("   All: {}; Right: {}; Center: {}; Left: {}; ".format(summary['count'], right, center, left))
+	print("  LEFT: {:.02f}% {}/{}".format(left / count * 100.0, left, summary['count']))
+	print(" RIGHT: {:.02f}% {}/{}".format(right / count * 100.0, right, summary['count']))
+	print("CENTER: {:.02f}% {}/{}".format(center / count * 100.0, center, summary['count']))
+
+	print_histogram("Steering:", summary['steering_histogram'])
+	print_histogram("Throttle - brake:", summary['acceleration_histogram'])
+	with pd.option_context('display.max_rows', None, 'display.width', 200):
+		print("By map:")
+		print(summary['by_map'].to_string(index=False))
+		print("By weather:")
+		print(summary['by_weather'].to_string(index=False))
+
+
+def write_summary(summary, filename):
+	"""
+	Writes summary as JSON or (when filename ends with .csv) breakdowns as one table
+	"""
+	breakdowns = ['by_directory', 'by_map', 'by_weather']
+	if filename.endswith('.csv'):
+		tables = [summary[name].assign(group=name[3:]) for name in breakdowns]
+		table = pd.concat(tables, ignore_index=True)
+		table[['group'] + [c for c in table.columns if c != 'group']].to_csv(filename, index=False)
+	else:
+		output = dict(summary)
+		for name in breakdowns:
+			output[name] = summary[name].to_dict(orient='records')
+		with open(filename, 'w') as f:
+			json.dump(output, f, indent=2, default=lambda value: value.item())
+
+
+def describe(directory=".\\out\\data", bins=20, output=None):
 	logging.info("Start loading data")
-	steerings = []
-	throttles = []
-	dir_count = 0
-	for dir in os.walk(directory):
-		if dir[0] == directory:
-			continue
-		measurements_file = os.path.join(dir[0], MEASUREMENTS_CSV_FILENAME)
-		dir_count = dir_count + 1
-		local_steerings = []
-		with open(measurements_file) as csvfile:
-			rows = csv.reader(csvfile)
-			for row in rows:
-				steerings.append(float(row[1]))
-				local_steerings.append(float(row[1]))
-
-				throttles.append(float(row[2]) - float(row[3]))
-
-		ss = pd.Series(local_steerings)
-		l_right = ss[ss >= 0.05]
-		l_left = ss[ss <= -0.05]
-		l_center = ss[np.logical_and(ss > -0.05, ss < 0.05)]
-
-		print("{}; Right: {}; Center: {}; Left: {}; ".format(dir[0], len(l_right), len(l_center), len(l_left)))
-
-	print("Directories count: {}".format(dir_count))
-	print("Data count: {}".format(len(steerings)))
-
-	s = pd.Series(steerings)
-	print(s.describe(include='all'))
-	right = s[s >= 0.05]
-	left = s[s <= -0.05]
-	center = s[np.logical_and(s > -0.05, s < 0.05)]
-
-	print("   All: {}; Right: {}; Center: {}; Left: {}; ".format(len(s), len(right), len(center), len(left)))
-	print("  LEFT: {:.02f}% {}/{}".format(len(left) / len(s) * 100.0, len(left), len(s)))
-	print(" RIGHT: {:.02f}% {}/{}".format(len(right) / len(s) * 100.0, len(right), len(s)))
-	print("CENTER: {:.02f}% {}/{}".format(len(center) / len(s) * 100.0, len(center), len(s)))
+	summary = summarize(load_dataset(directory), bins)
+	print_summary(summary)
+	if output:
+		write_summary(summary, output)
+
+
+def main():
+	parser = argparse.ArgumentParser(description='Prints summary of gathered data')
+	parser.add_argument('-d', '--directory', help='data directory', default=".\\out\\data")
+	parser.add_argument('-b', '--bins', help='number of histogram bins', type=int, default=20)
+	parser.add_argument('-o', '--output', help='write summary to file (.json or .csv)', default=None)
+	args = parser.parse_args()
+	describe(args.directory, args.bins, args.output)
+
 
 if __name__ == '__main__':
-	describe()
+	logging.basicConfig(format=FORMAT)
+	logging.getLogger().setLevel(logging.INFO)
+	main()
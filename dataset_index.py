@@ -0,0 +1,211 @@
+"""
+Persistent index (SQLite) of labels of all run directories of a data directory.
+Every directory is rescanned only when fingerprint (mtime and size) of its labels file or its kept frames index
+(written by prune_duplicates.py) changes.
+"""
+import argparse
+import json
+import logging
+import os
+import sqlite3
+
+import numpy as np
+import pandas as pd
+
+from config import MEASUREMENTS_CSV_FILENAME, PACKED_LABELS_FILENAME, DATASET_INDEX_FILENAME, SHARDS_INDEX_FILENAME, \
+	KEPT_FRAMES_FILENAME, KEPT_FRAMES_INFO_FILENAME
+
+LABEL_COLUMNS = ['frame', 'steering', 'throttle', 'brake']
+
+FORMAT = '%(asctime)-15s : %(message)s'
+
+# seconds a process waits for the index locked by another one (e.g. jobs of train_all.py updating it at once)
+INDEX_TIMEOUT_SECONDS = 600
+# index with other version is created again
+SCHEMA_VERSION = 2
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS directories (
+	data_dir TEXT NOT NULL,
+	source TEXT NOT NULL,
+	mtime REAL NOT NULL,
+	size INTEGER NOT NULL,
+	kept_mtime REAL NOT NULL,
+	PRIMARY KEY (data_dir, source)
+);
+CREATE TABLE IF NOT EXISTS samples (
+	data_dir TEXT NOT NULL,
+	source TEXT NOT NULL,
+	packed_index INTEGER NOT NULL,
+	frame INTEGER NOT NULL,
+	steering REAL NOT NULL,
+	throttle REAL NOT NULL,
+	brake REAL NOT NULL,
+	kept INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS samples_directory ON samples (data_dir, source);
+"""
+
+
+# run: python dataset_index.py -d .\out\data -d .\out\validation_data
+
+def get_index_path(directory):
+	return os.path.join(directory, DATASET_INDEX_FILENAME)
+
+
+def list_run_directories(directory):
+	# directories without measurements (e.g. of an interrupted gathering) are not runs
+	return sorted(dir[0] for dir in os.walk(directory)
+	              if dir[0] != directory and MEASUREMENTS_CSV_FILENAME in dir[2])
+
+
+def get_labels_filename(data_dir, use_packed=False):
+	# frames recorded into shards are already stored as arrays, their labels stay in measurements.csv
+	if use_packed and not os.path.exists(os.path.join(data_dir, SHARDS_INDEX_FILENAME)):
+		return PACKED_LABELS_FILENAME
+	return MEASUREMENTS_CSV_FILENAME
+
+
+def read_labels(data_dir, use_packed=False):
+	"""
+	Reads labels of a single run, rows follow rows of measurements.csv (and of the packed arrays or shards)
+	"""
+	if get_labels_filename(data_dir, use_packed) == PACKED_LABELS_FILENAME:
+		labels = np.load(os.path.join(data_dir, PACKED_LABELS_FILENAME))
+		loaded_data = pd.DataFrame(labels, columns=LABEL_COLUMNS)
+		loaded_data['frame'] = loaded_data['frame'].astype(int)
+	else:
+		measurements_file = os.path.join(data_dir, MEASUREMENTS_CSV_FILENAME)
+		loaded_data = pd.read_csv(measurements_file, sep=',', decimal='.', usecols=[0, 1, 2, 3], header=None,
+		                          names=LABEL_COLUMNS)
+	return loaded_data
+
+
+def get_kept_frames_info(data_dir, count):
+	return {'rows': count, 'measurements_mtime': os.path.getmtime(os.path.join(data_dir, MEASUREMENTS_CSV_FILENAME))}
+
+
+def write_kept_frames(data_dir, kept, count):
+	np.save(os.path.join(data_dir, KEPT_FRAMES_FILENAME), kept)
+	with open(os.path.join(data_dir, KEPT_FRAMES_INFO_FILENAME), 'w') as f:
+		json.dump(get_kept_frames_info(data_dir, count), f)
+
+
+def read_kept_frames(data_dir, count):
+	"""
+	Returns flags of rows kept by prune_duplicates.py (all rows when the directory was not pruned or when
+	measurements.csv changed since it was pruned)
+	"""
+	kept = np.ones(count, dtype=bool)
+	kept_file = os.path.join(data_dir, KEPT_FRAMES_FILENAME)
+	if not os.path.exists(kept_file):
+		return kept
+	info_file = os.path.join(data_dir, KEPT_FRAMES_INFO_FILENAME)
+	info = None
+	if os.path.exists(info_file):
+		with open(info_file) as f:
+			info = json.load(f)
+	if info != get_kept_frames_info(data_dir, count):
+		logging.warning("{}: {} does not match {}, all frames are used (run prune_duplicates.py again)".format(
+			data_dir, KEPT_FRAMES_FILENAME, MEASUREMENTS_CSV_FILENAME))
+		return kept
+	kept[:] = False
+	kept[np.load(kept_file)] = True
+	return kept
+
+
+def get_kept_frames_mtime(data_dir):
+	kept_file = os.path.join(data_dir, KEPT_FRAMES_FILENAME)
+	return os.path.getmtime(kept_file) if os.path.exists(kept_file) else 0.0
+
+
+def update_index(connection, directory, use_packed=False):
+	"""
+	Rescans directories which are new or whose labels file changed since the last update and forgets removed ones.
+	Returns number of rescanned directories.
+	"""
+	source = PACKED_LABELS_FILENAME if use_packed else MEASUREMENTS_CSV_FILENAME
+	indexed = {data_dir: (mtime, size, kept_mtime) for data_dir, mtime, size, kept_mtime in connection.execute(
+		'SELECT data_dir, mtime, size, kept_mtime FROM directories WHERE source = ?', (source,))}
+
+	data_dirs = list_run_directories(directory)
+	rescanned = 0
+	for data_dir in list(data_dirs):
+		labels_file = os.path.join(data_dir, get_labels_filename(data_dir, use_packed))
+		if not os.path.exists(labels_file):
+			logging.warning("{} has no labels file {}, skip".format(data_dir, os.path.basename(labels_file)))
+			data_dirs.remove(data_dir)
+			continue
+		stat = os.stat(labels_file)
+		kept_mtime = get_kept_frames_mtime(data_dir)
+		if indexed.get(data_dir) == (stat.st_mtime, stat.st_size, kept_mtime):
+			continue
+
+		labels = read_labels(data_dir, use_packed)
+		kept = read_kept_frames(data_dir, len(labels))
+		connection.execute('DELETE FROM samples WHERE data_dir = ? AND source = ?', (data_dir, source))
+		connection.executemany(
+			'INSERT INTO samples (data_dir, source, packed_index, frame, steering, throttle, brake, kept) '
+			'VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+			((data_dir, source, i, int(row.frame), float(row.steering), float(row.throttle), float(row.brake),
+			  int(kept[i])) for i, row in enumerate(labels.itertuples(index=False))))
+		connection.execute(
+			'INSERT OR REPLACE INTO directories (data_dir, source, mtime, size, kept_mtime) VALUES (?, ?, ?, ?, ?)',
+			(data_dir, source, stat.st_mtime, stat.st_size, kept_mtime))
+		rescanned += 1
+
+	for data_dir in set(indexed) - set(data_dirs):
+		connection.execute('DELETE FROM samples WHERE data_dir = ? AND source = ?', (data_dir, source))
+		connection.execute('DELETE FROM directories WHERE data_dir = ? AND source = ?', (data_dir, source))
+	return rescanned
+
+
+def open_index(directory):
+	connection = sqlite3.connect(get_index_path(directory), timeout=INDEX_TIMEOUT_SECONDS)
+	if connection.execute('PRAGMA user_version').fetchone()[0] != SCHEMA_VERSION:
+		connection.executescript('DROP TABLE IF EXISTS directories; DROP TABLE IF EXISTS samples;')
+		connection.execute('PRAGMA user_version = {}'.format(SCHEMA_VERSION))
+	connection.executescript(SCHEMA)
+	return connection
+
+
+def load_dataset(directory, use_packed=False, use_pruned=True):
+	"""
+	Returns labels of all runs in the directory (frame, steering, throttle, brake, data_dir, packed_index),
+	updating the index of the directory first. With use_pruned frames dropped by prune_duplicates.py are skipped.
+	"""
+	connection = open_index(directory)
+	try:
+		with connection:
+			rescanned = update_index(connection, directory, use_packed)
+		if rescanned > 0:
+			logging.info("Dataset index of {} updated ({} directories rescanned)".format(directory, rescanned))
+
+		source = PACKED_LABELS_FILENAME if use_packed else MEASUREMENTS_CSV_FILENAME
+		return pd.read_sql_query(
+			'SELECT frame, steering, throttle, brake, data_dir, packed_index FROM samples '
+			'WHERE source = ? AND kept >= ? ORDER BY data_dir, packed_index', connection,
+			params=(source, int(use_pruned)))
+	finally:
+		connection.close()
+
+
+def main():
+	parser = argparse.ArgumentParser(description='Updates index of labels of gathered data')
+	parser.add_argument('-d', '--directory', help='data directory to index (can be repeated)', action='append',
+	                    dest='directories')
+	parser.add_argument('-k', '--packed', help='index labels of packed data', action='store_true')
+	parser.add_argument('--rebuild', help='rescan all directories', action='store_true')
+	args = parser.parse_args()
+
+	directories = args.directories or [".\\out\\data", ".\\out\\validation_data"]
+	for directory in directories:
+		if args.rebuild and os.path.exists(get_index_path(directory)):
+			os.remove(get_index_path(directory))
+		data = load_dataset(directory, args.packed)
+		logging.info("{}: {} frames".format(directory, len(data)))
+
+
+if __name__ == '__main__':
+	logging.basicConfig(format=FORMAT)
+	logging.getLogger().setLevel(logging.INFO)
+	main()
@@ -14,12 +14,16 @@ Carla simulation started...
 """
 import argparse
 import logging
+import queue
+import threading
 import time
 
 from carla.sensor import Camera
 from carla.settings import CarlaSettings
-from data_augmentation import preprocess
-from neural_networks.neural_networks_common import add_model_cmd_arg, load_model
+from data_augmentation import preprocess, SIDE_CAMERA_STEERING_CORRECTION
+from gathering_data_common import add_cameras
+from neural_networks.neural_networks_common import add_model_cmd_arg, load_model, get_inference_function, \
+	load_exported_model
 from common import *
 from tests.common import evaluate_run, save_run
 try:
@@ -37,6 +41,24 @@ from config import USE_SPEED_CONSTRAINTS, MINIMAL_SPEED, MAXIMAL_SPEED
 WINDOW_WIDTH = 100
 WINDOW_HEIGHT = 100
 
+# size of queues between stages of the pipelined driver
+PIPELINE_QUEUE_SIZE = 2
+
+# steering predicted from a side camera image is shifted like labels of side cameras in training
+CAMERA_STEERING_OFFSETS = {
+	'MainCamera': 0.0,
+	'CameraRGB_C': 0.0,
+	'CameraRGB_L': SIDE_CAMERA_STEERING_CORRECTION,
+	'CameraRGB_R': -SIDE_CAMERA_STEERING_CORRECTION
+}
+
+# weights of cameras used to fuse their predictions into a single control
+FUSION_WEIGHTS = {
+	'center': {'MainCamera': 1.0, 'CameraRGB_C': 1.0, 'CameraRGB_L': 0.0, 'CameraRGB_R': 0.0},
+	'mean': {'MainCamera': 1.0, 'CameraRGB_C': 1.0, 'CameraRGB_L': 1.0, 'CameraRGB_R': 1.0},
+	'weighted': {'MainCamera': 1.0, 'CameraRGB_C': 0.5, 'CameraRGB_L': 0.25, 'CameraRGB_R': 0.25}
+}
+
 class Timer(object):
 	def __init__(self):
 		self.step = 0
@@ -66,6 +88,10 @@ def gen_settings(args):
 		WeatherId=args.weather,
 		QualityLevel=args.quality_level)
 	settings.randomize_seeds()
+	if args.fusion != 'center':
+		add_cameras(settings)
+		return settings
+
 	camera_pos_x = 2
 	camera_pos_y = 0
 	camera_pos_z = 1
@@ -76,12 +102,27 @@ def gen_settings(args):
 	settings.add_sensor(camera)
 	return settings
 
+
+def fuse_controls(camera_names, predictions, fusion):
+	"""
+	Fuses predictions (steer, acceleration) of cameras into a single control according to fusion policy
+	"""
+	offsets = np.array([CAMERA_STEERING_OFFSETS[name] for name in camera_names])
+	weights = np.array([FUSION_WEIGHTS[fusion][name] for name in camera_names])
+	steer = np.average(predictions[:, 0] - offsets, weights=weights)
+	acceleration = np.average(predictions[:, 1], weights=weights)
+	return steer, acceleration
+
 class CarlaGame(object):
-	def __init__(self, carla_client, args, model):
+	def __init__(self, carla_client, args, predict):
 		self.client = carla_client
 		self._carla_settings = gen_settings(args)
 		self._timer = None
-		self._model = model
+		self._predict = predict
+		self._fusion = args.fusion
+		# inference times are appended by the inference thread of the pipelined game, so they are guarded
+		self._inference_times = []
+		self._inference_lock = threading.Lock()
 		self._model_name = args.model
 		self._map_name = args.map_name
 		self._checkpoint = args.checkpoint
@@ -125,23 +166,37 @@ class CarlaGame(object):
 		self.points_y = []
 
 	def _on_loop(self, frame):
+		measurements, sensor_data = self.client.read_data()
+		camera_names, model_input = self._preprocess(self._decode(sensor_data))
+		steer, acceleration = self._infer(camera_names, model_input)
+		return self._on_control(frame, measurements, steer, acceleration)
+
+	def _decode(self, sensor_data):
+		return {name: measurement.data for name, measurement in sensor_data.items()
+		        if FUSION_WEIGHTS[self._fusion][name] > 0}
+
+	def _preprocess(self, images):
+		camera_names = sorted(images.keys())
+		return camera_names, np.stack([preprocess(images[name]) for name in camera_names])
+
+	def _infer(self, camera_names, model_input):
+		# all cameras are predicted in a single forward pass
+		inference_start = time.time()
+		predictions = self._predict(model_input)
+		steer, acceleration = fuse_controls(camera_names, predictions, self._fusion)
+		latency = time.time() - inference_start
+		with self._inference_lock:
+			self._inference_times.append(latency)
+		logging.debug("Inference latency: {:.2f}ms".format(latency * 1000))
+		return steer, acceleration
+
+	def _on_control(self, frame, measurements, steer, acceleration):
 		self._timer.tick()
 
 		skip_frames = 40
-		measurements, sensor_data = self.client.read_data()
 		current_position = vec3tovec2(measurements.player_measurements.transform.location)
 		self._velocities.append(measurements.player_measurements.forward_speed * 3.6) # convert to km/h
 
-		steer = 0.0
-		acceleration = 0.0
-		for name, measurement in sensor_data.items():
-			model_input = preprocess(measurement.data)
-			model_input = np.array(model_input / 127.5 - 1, dtype=np.float32)
-			model_input = np.expand_dims(model_input, axis=0)
-			ret = self._model.predict(model_input)[0]
-			steer = ret[0]
-			acceleration = ret[1]
-
 		if USE_SPEED_CONSTRAINTS:
 			if measurements.player_measurements.forward_speed * 3.6 < MINIMAL_SPEED:
 				acceleration = 0.7
@@ -170,7 +225,7 @@ class CarlaGame(object):
 			return False
 
 		if self._timer.elapsed_seconds_since_lap() > 0.5:
-			self._print_player_measurements(control)
+			self._print_player_measurements(control, self._take_inference_times())
 			logging.info("Add point: [{:.4f},{:.4f}], points count: {:0>4d}, distance from start: {:.4f}".format(
 				current_position[0],
 				current_position[1],
@@ -180,16 +235,96 @@ class CarlaGame(object):
 
 		return True
 
-	def _print_player_measurements(self, control):
+	def _take_inference_times(self):
+		# the list is swapped, so times appended meanwhile are counted in the next report
+		with self._inference_lock:
+			inference_times, self._inference_times = self._inference_times, []
+		return inference_times
+
+	def _print_player_measurements(self, control, inference_times):
 		msg = "steer: {:.2f}, throttle: {:.2f}, "
-		msg += "avg speed: {:.2f}km/h "
+		msg += "avg speed: {:.2f}km/h, "
+		msg += "avg inference latency: {}, "
+		msg += "{:.1f} ticks/s"
 		logging.info(msg
 			.format(
 			control.steer,
 			control.throttle,
-			np.average(self._velocities)
+			np.average(self._velocities),
+			'{:.2f}ms'.format(np.average(inference_times) * 1000) if inference_times else '-',
+			self._timer.ticks_per_second()
 		))
 
+
+class PipelinedCarlaGame(CarlaGame):
+	"""
+	Reads and decodes sensor data, preprocesses it and runs the model on separate threads joined by bounded queues.
+	Control computed for a frame is sent control_latency frames later, so the simulator renders next frames while
+	the model is predicting.
+	"""
+
+	def __init__(self, carla_client, args, predict):
+		super(PipelinedCarlaGame, self).__init__(carla_client, args, predict)
+		self._control_latency = args.control_latency
+		self._stop = threading.Event()
+		self._controls = None
+
+	def execute(self):
+		try:
+			super(PipelinedCarlaGame, self).execute()
+		finally:
+			self._stop.set()
+
+	def _initialize_game(self):
+		super(PipelinedCarlaGame, self)._initialize_game()
+
+		frames = queue.Queue(PIPELINE_QUEUE_SIZE)
+		batches = queue.Queue(PIPELINE_QUEUE_SIZE)
+		self._controls = queue.Queue(PIPELINE_QUEUE_SIZE)
+		self._start_stage(self._receive_stage, None, frames)
+		self._start_stage(self._preprocess_stage, frames, batches)
+		self._start_stage(self._infer_stage, batches, self._controls)
+
+		# neutral controls let the simulator run control_latency frames ahead of the model
+		for _ in range(self._control_latency):
+			self.client.send_control(VehicleControl())
+
+	def _on_loop(self, frame):
+		result = self._controls.get()
+		if isinstance(result, Exception):
+			raise result
+		measurements, steer, acceleration = result
+		return self._on_control(frame, measurements, steer, acceleration)
+
+	def _receive_stage(self, _):
+		measurements, sensor_data = self.client.read_data()
+		return measurements, self._decode(sensor_data)
+
+	def _preprocess_stage(self, item):
+		measurements, images = item
+		return (measurements,) + self._preprocess(images)
+
+	def _infer_stage(self, item):
+		measurements, camera_names, model_input = item
+		return (measurements,) + self._infer(camera_names, model_input)
+
+	def _start_stage(self, work, input_queue, output_queue):
+		def run():
+			while not self._stop.is_set():
+				item = input_queue.get() if input_queue is not None else None
+				if not isinstance(item, Exception):
+					try:
+						item = work(item)
+					except Exception as error:
+						item = error
+				output_queue.put(item)
+				if isinstance(item, Exception):
+					return
+
+		thread = threading.Thread(target=run, name=work.__name__)
+		thread.daemon = True
+		thread.start()
+
 def main():
 	argparser = argparse.ArgumentParser(
 		description='AI Driving')
@@ -236,6 +371,30 @@ def main():
 		default='TestTown',
 		choices=['TestTown', 'Town03', 'Town04', 'TestTown02', 'TestTown03']
 	)
+	argparser.add_argument(
+		'-f',
+		'--fusion',
+		default='center',
+		choices=sorted(FUSION_WEIGHTS.keys()),
+		help='policy fusing predictions of cameras into one control (mean and weighted add left and right cameras)'
+	)
+	argparser.add_argument(
+		'-e',
+		'--exported',
+		default=None,
+		help='drive with a model exported by export_model.py (.tflite file or SavedModel directory)'
+	)
+	argparser.add_argument(
+		'--pipelined',
+		action='store_true',
+		help='read data, preprocess and predict on separate threads'
+	)
+	argparser.add_argument(
+		'--control-latency',
+		type=int,
+		default=1,
+		help='number of frames between a frame and applying its control in pipelined mode (default: 1)'
+	)
 	args = argparser.parse_args()
 
 	log_level = logging.DEBUG if args.debug else logging.INFO
@@ -245,12 +404,18 @@ def main():
 
 	print(__doc__)
 
-	model = load_model(args.model, args.checkpoint, False)
+	if args.exported:
+		predict = load_exported_model(args.exported)
+	else:
+		predict = get_inference_function(load_model(args.model, args.checkpoint, False))
 
 	while True:
 		try:
 			with make_carla_client(args.host, args.port) as client:
-				game = CarlaGame(client, args, model)
+				if args.pipelined:
+					game = PipelinedCarlaGame(client, args, predict)
+				else:
+					game = CarlaGame(client, args, predict)
 				game.execute()
 				break
 
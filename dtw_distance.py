@@ -0,0 +1,121 @@
+import numpy as np
+
+DTW_MODES = ['fast', 'exact', 'sakoe_chiba']
+
+
+def dtw(line1, line2, mode='fast', radius=10):
+	"""
+	Dynamic time warping of two lines (arrays of points) with euclidean distance of points.
+	Returns distance and warping path (list of index pairs).
+	Modes:
+		fast        - FastDTW, gives the same result as fastdtw.fastdtw(line1, line2, radius, dist=euclidean)
+		exact       - DTW without any constraint (memory len(line1) x len(line2))
+		sakoe_chiba - DTW restricted to a band of given radius around the diagonal
+	"""
+	x = as_points(line1)
+	y = as_points(line2)
+	if mode == 'fast':
+		return _fast_dtw(x, y, radius)
+	elif mode == 'exact':
+		low, high = _full_window(len(x), len(y))
+	elif mode == 'sakoe_chiba':
+		low, high = _sakoe_chiba_window(len(x), len(y), radius)
+	else:
+		raise ValueError("Unknown DTW mode: {}".format(mode))
+	return _windowed_dtw(x, y, low, high)
+
+
+def as_points(line):
+	line = np.asarray(line, dtype=float)
+	return line.reshape(len(line), -1)
+
+
+def _distances(points1, points2):
+	return np.sqrt(np.sum((points1 - points2) ** 2, axis=-1))
+
+
+def _full_window(len_x, len_y):
+	return np.zeros(len_x, dtype=int), np.full(len_x, len_y - 1, dtype=int)
+
+
+def _sakoe_chiba_window(len_x, len_y, radius):
+	# band follows the diagonal of the (possibly not square) matrix and is wide enough to keep the path connected
+	radius = max(radius, int(np.ceil((len_y - 1) / max(len_x - 1, 1))))
+	center = np.round(np.arange(len_x) * (len_y - 1) / max(len_x - 1, 1)).astype(int)
+	return np.clip(center - radius, 0, len_y - 1), np.clip(center + radius, 0, len_y - 1)
+
+
+def _fast_dtw(x, y, radius):
+	if len(x) < radius + 2 or len(y) < radius + 2:
+		return _windowed_dtw(x, y, *_full_window(len(x), len(y)))
+
+	x_shrinked = (x[0:len(x) - len(x) % 2:2] + x[1:len(x) - len(x) % 2:2]) / 2
+	y_shrinked = (y[0:len(y) - len(y) % 2:2] + y[1:len(y) - len(y) % 2:2]) / 2
+	_, path = _fast_dtw(x_shrinked, y_shrinked, radius)
+	low, high = _expand_window(np.array(path), len(x), len(y), radius)
+	return _windowed_dtw(x, y, low, high)
+
+
+def _expand_window(path, len_x, len_y, radius):
+	"""
+	Projects path of the shrinked lines (with its radius neighbourhood) onto full lines.
+	Returns the first and the last column of the window in every row.
+	"""
+	rows_count = path[-1, 0] + 1
+	row_min = np.full(rows_count, len_y, dtype=int)
+	row_max = np.full(rows_count, -1, dtype=int)
+	np.minimum.at(row_min, path[:, 0], path[:, 1])
+	np.maximum.at(row_max, path[:, 0], path[:, 1])
+
+	# path is monotone, so columns near shrinked row c span from the first column of row c - radius
+	# to the last column of row c + radius
+	shrinked_rows = np.arange(len_x) // 2
+	first = row_min[np.clip(shrinked_rows - radius, 0, rows_count - 1)]
+	last = row_max[np.clip(shrinked_rows + radius, 0, rows_count - 1)]
+	low = np.clip(2 * (first - radius), 0, len_y - 1)
+	high = np.clip(2 * (last + radius) + 1, 0, len_y - 1)
+	return low, high
+
+
+def _windowed_dtw(x, y, low, high):
+	"""
+	DTW restricted to window given by the first (low) and the last (high) column of every row, both non decreasing.
+	Cells of one anti-diagonal do not depend on each other, so every anti-diagonal is computed at once.
+	"""
+	len_x, len_y = len(x), len(y)
+	# row r of the cost matrix keeps row r - 1 of the window shifted by offset[r], row 0 and column 0 are padding,
+	# so predecessors of every cell (also outside of the window) are read without bounds checks
+	offset = np.concatenate(([-1], low - 1))
+	width = int(np.max(high - offset[:-1])) + 2
+	cost = np.full((len_x + 1, width), np.inf)
+	cost[0, 0] = 0.0
+
+	rows = np.arange(len_x)
+	diagonals = np.arange(len_x + len_y - 1)
+	starts = np.searchsorted(rows + high, diagonals)
+	ends = np.searchsorted(rows + low, diagonals, side='right')
+	for k in diagonals:
+		i = rows[starts[k]:ends[k]]
+		j = k - i
+		up = cost[i, j - offset[i]]
+		left = cost[i + 1, j - 1 - offset[i + 1]]
+		diagonal = cost[i, j - 1 - offset[i]]
+		cost[i + 1, j - offset[i + 1]] = np.minimum(np.minimum(up, left), diagonal) + _distances(x[i], y[j])
+
+	# path goes back through the first of minimal predecessors (in order: up, left, diagonal) like in fastdtw
+	path = []
+	i, j = len_x - 1, len_y - 1
+	while True:
+		path.append((i, j))
+		if i == 0 and j == 0:
+			break
+		distance = _distances(x[i], y[j])
+		candidates = [
+			(cost[i, j - offset[i]] + distance, i - 1, j),
+			(cost[i + 1, j - 1 - offset[i + 1]] + distance, i, j - 1),
+			(cost[i, j - 1 - offset[i]] + distance, i - 1, j - 1)
+		]
+		_, i, j = min(candidates, key=lambda candidate: candidate[0])
+	path.reverse()
+
+	return cost[len_x, len_y - 1 - offset[len_x]], path
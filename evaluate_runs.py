@@ -0,0 +1,151 @@
+import argparse
+import logging
+import os
+import re
+from multiprocessing import Pool
+
+import pandas as pd
+
+from tests.common import out_run_folder, run_csv_name, result_name, score_run
+
+FORMAT = '%(asctime)-15s : %(message)s'
+RUN_KEY_COLUMNS = ['model', 'checkpoint', 'map', 'weather', 'run']
+FINGERPRINT_COLUMNS = ['run_csv_mtime', 'run_csv_size']
+SCORE_COLUMNS = ['dtw', 'points', 'mean_deviation', 'max_deviation', 'p95_deviation', 'outside_corridor']
+
+
+# run: python evaluate_runs.py -j 8 -o out\map_points\results.csv
+
+def find_runs(directory):
+	"""
+	Returns description of every run directory (<model>\\<map>\\run-<timestamp>) with fingerprint of its run.csv
+	"""
+	runs = []
+	for model in sorted(os.listdir(directory)):
+		for map_name in sorted(os.listdir(os.path.join(directory, model))):
+			map_dir = os.path.join(directory, model, map_name)
+			for run in sorted(os.listdir(map_dir)):
+				run_dir = os.path.join(map_dir, run)
+				run_csv = os.path.join(run_dir, run_csv_name)
+				if not os.path.exists(run_csv):
+					continue
+
+				checkpoint, weather, avg_speed = read_run_info(run_dir)
+				stat = os.stat(run_csv)
+				runs.append({
+					'model': model,
+					'checkpoint': checkpoint,
+					'map': map_name,
+					'weather': weather,
+					'run': run,
+					'avg_speed': avg_speed,
+					'run_csv_mtime': stat.st_mtime,
+					'run_csv_size': stat.st_size,
+					'run_dir': run_dir
+				})
+	return pd.DataFrame(runs, columns=RUN_KEY_COLUMNS + ['avg_speed'] + FINGERPRINT_COLUMNS + ['run_dir'])
+
+
+def read_run_info(run_dir):
+	"""
+	Reads checkpoint, weather and average speed written by drive.py into result.txt
+	"""
+	result_file = os.path.join(run_dir, result_name)
+	if not os.path.exists(result_file):
+		return None, None, None
+	with open(result_file) as f:
+		text = f.read()
+
+	info = re.search(r'epoch: (\d+) weather: (\d+)', text)
+	speed = re.search(r'Avg speed: ([\d.]+)', text)
+	return int(info.group(1)) if info else None, \
+	       int(info.group(2)) if info else None, \
+	       float(speed.group(1)) if speed else None
+
+
+def score_job(job):
+	run_dir, map_name = job
+	try:
+		return run_dir, score_run(run_dir, map_name)
+	except Exception as error:
+		logging.error("Scoring {} failed: {}".format(run_dir, error))
+		return run_dir, None
+
+
+def read_results(filename):
+	if not os.path.exists(filename):
+		return None
+	if filename.endswith('.parquet'):
+		return pd.read_parquet(filename)
+	return pd.read_csv(filename)
+
+
+def write_results(results, filename):
+	if filename.endswith('.parquet'):
+		results.to_parquet(filename, index=False)
+	else:
+		results.to_csv(filename, index=False)
+
+
+def evaluate_runs(directory, results_file, processes, force=False):
+	runs = find_runs(directory)
+	previous = None if force else read_results(results_file)
+
+	if previous is not None and len(previous) > 0:
+		# runs with unchanged run.csv keep their scores
+		merged = runs.merge(previous.drop(columns=['avg_speed', 'run_dir'], errors='ignore'),
+		                    on=['model', 'map', 'run'] + FINGERPRINT_COLUMNS, how='left', suffixes=('', '_previous'))
+		merged = merged.drop(columns=[c for c in merged.columns if c.endswith('_previous')])
+		unchanged = merged[merged['dtw'].notnull()]
+		changed = runs[~runs['run_dir'].isin(unchanged['run_dir'])]
+	else:
+		unchanged = None
+		changed = runs
+
+	logging.info("Runs: {}, to score: {}".format(len(runs), len(changed)))
+	scored = []
+	with Pool(processes) as pool:
+		jobs = zip(changed['run_dir'], changed['map'])
+		for run_dir, scores in pool.imap_unordered(score_job, jobs):
+			if scores is not None:
+				scores['run_dir'] = run_dir
+				scored.append(scores)
+
+	results = changed.merge(pd.DataFrame(scored, columns=['run_dir'] + SCORE_COLUMNS), on='run_dir')
+	if unchanged is not None:
+		results = pd.concat([unchanged, results], ignore_index=True, sort=False)
+	results = results.sort_values(RUN_KEY_COLUMNS).reset_index(drop=True)
+	write_results(results, results_file)
+	return results
+
+
+def print_leaderboard(results):
+	leaderboard = results.groupby(['model', 'checkpoint', 'map'], dropna=False).agg(
+		runs=('run', 'count'),
+		dtw=('dtw', 'mean'),
+		mean_deviation=('mean_deviation', 'mean'),
+		p95_deviation=('p95_deviation', 'mean'),
+		outside_corridor=('outside_corridor', 'mean'),
+		avg_speed=('avg_speed', 'mean')
+	).sort_values(['map', 'dtw'])
+	with pd.option_context('display.max_rows', None, 'display.max_columns', None, 'display.width', 200):
+		print(leaderboard)
+
+
+def main():
+	parser = argparse.ArgumentParser(description='Scores all autonomous runs and prints leaderboard of models')
+	parser.add_argument('-d', '--directory', help='directory with autonomous runs', default=out_run_folder)
+	parser.add_argument('-o', '--output', help='results table (.csv or .parquet)',
+	                    default='out\\map_points\\results.csv')
+	parser.add_argument('-j', '--processes', help='number of scoring processes', type=int, default=os.cpu_count())
+	parser.add_argument('--force', help='score again all runs', action='store_true')
+	args = parser.parse_args()
+
+	results = evaluate_runs(args.directory, args.output, args.processes, args.force)
+	print_leaderboard(results)
+
+
+if __name__ == '__main__':
+	logging.basicConfig(format=FORMAT)
+	logging.getLogger().setLevel(logging.INFO)
+	main()
@@ -0,0 +1,128 @@
+import argparse
+import logging
+import os
+import shutil
+import time
+
+import numpy as np
+import tensorflow as tf
+from tensorflow.python.tools import optimize_for_inference_lib
+
+from data_augmentation import fill_batch
+from neural_networks.neural_networks_common import add_model_cmd_arg, load_model, get_inference_function, \
+	get_export_directory, load_exported_model
+from train import get_data_frame
+
+FORMAT = '%(asctime)-15s : %(message)s'
+
+
+# run: python export_model.py -m resnet -c 40 -q
+
+def load_calibration_images(directory, count):
+	data = get_data_frame(directory)
+	rows = data.values[np.random.choice(len(data), min(count, len(data)), replace=False)]
+	images, _ = fill_batch(rows, False)
+	return images
+
+
+def freeze_graph(model):
+	"""
+	Returns inference graph of the model with variables converted to constants and folded batch normalizations
+	"""
+	session = tf.keras.backend.get_session()
+	input_name = model.input.op.name
+	output_name = model.output.op.name
+	graph_def = tf.graph_util.convert_variables_to_constants(session, session.graph.as_graph_def(), [output_name])
+	graph_def = optimize_for_inference_lib.optimize_for_inference(
+		graph_def, [input_name], [output_name], tf.uint8.as_datatype_enum)
+	return graph_def, input_name, output_name
+
+
+def export_saved_model(model, path):
+	if os.path.exists(path):
+		shutil.rmtree(path)
+
+	graph_def, input_name, output_name = freeze_graph(model)
+	with tf.Graph().as_default() as graph:
+		tf.import_graph_def(graph_def, name='')
+		with tf.Session(graph=graph) as session:
+			tf.saved_model.simple_save(
+				session,
+				path,
+				inputs={'image': graph.get_tensor_by_name(input_name + ':0')},
+				outputs={'control': graph.get_tensor_by_name(output_name + ':0')})
+
+
+def export_tflite(model, path, calibration_images=None):
+	"""
+	Converts the model to TFLite, with calibration images the model is quantized to int8 (post training quantization)
+	"""
+	converter = tf.lite.TFLiteConverter.from_session(tf.keras.backend.get_session(), model.inputs, model.outputs)
+	if calibration_images is not None:
+		converter.optimizations = [tf.lite.Optimize.DEFAULT]
+		converter.representative_dataset = lambda: ([np.expand_dims(image, axis=0)] for image in calibration_images)
+
+	with open(path, 'wb') as f:
+		f.write(converter.convert())
+
+
+def measure(predict, images, repeats):
+	"""
+	Returns mean latency of single image inference and predictions for all images
+	"""
+	predictions = np.concatenate([predict(np.expand_dims(image, axis=0)) for image in images])
+	start = time.time()
+	for i in range(repeats):
+		predict(np.expand_dims(images[i % len(images)], axis=0))
+	return (time.time() - start) / repeats, predictions
+
+
+def report(artifacts, images, repeats):
+	keras_predictions = np.concatenate([artifacts[0][1](np.expand_dims(image, axis=0)) for image in images])
+	print('-' * 30)
+	print('{:<12} {:>14} {:>14} {:>14}'.format('artifact', 'latency [ms]', 'max drift', 'mean drift'))
+	for name, predict in artifacts:
+		latency, predictions = measure(predict, images, repeats)
+		drift = np.abs(predictions - keras_predictions)
+		print('{:<12} {:>14.3f} {:>14.5f} {:>14.5f}'.format(name, latency * 1000, np.max(drift), np.mean(drift)))
+	print('-' * 30)
+
+
+def main():
+	parser = argparse.ArgumentParser(description='Exports trained model for inference (SavedModel and TFLite)')
+	add_model_cmd_arg(parser)
+	parser.add_argument('-c', '--checkpoint', help='checkpoint number to export', type=int, default=1)
+	parser.add_argument('-q', '--quantize', help='quantize TFLite model to int8', action='store_true')
+	parser.add_argument('-d', '--data', help='directory with calibration and drift measurement data',
+	                    default='.\\out\\data')
+	parser.add_argument('-n', '--samples', help='number of calibration samples', type=int, default=200)
+	parser.add_argument('-r', '--repeats', help='number of inferences measuring latency', type=int, default=100)
+	args = parser.parse_args()
+
+	# inference graph only, without training branches (dropout)
+	tf.keras.backend.set_learning_phase(0)
+	model = load_model(args.model, args.checkpoint, False)
+
+	out_directory = get_export_directory(args.model, args.checkpoint)
+	os.makedirs(out_directory, exist_ok=True)
+	saved_model_path = os.path.join(out_directory, 'saved_model')
+	tflite_path = os.path.join(out_directory, 'model.tflite')
+
+	images = load_calibration_images(args.data, args.samples)
+
+	logging.info("Exporting SavedModel to {}".format(saved_model_path))
+	export_saved_model(model, saved_model_path)
+	logging.info("Exporting TFLite model to {} (int8: {})".format(tflite_path, args.quantize))
+	export_tflite(model, tflite_path, images if args.quantize else None)
+
+	report([
+		('keras', get_inference_function(model)),
+		('saved_model', load_exported_model(saved_model_path)),
+		('tflite', load_exported_model(tflite_path))
+	], images, args.repeats)
+
+
+if __name__ == '__main__':
+	logging.basicConfig(format=FORMAT)
+	logging.getLogger().setLevel(logging.INFO)
+	main()
@@ -0,0 +1,172 @@
+"""
+Cache of features of frozen backbones. Layers of the model before its first trainable layer (colors normalization and
+a frozen ImageNet backbone, e.g. resnet without fine tuning) are run once over every camera image of every run
+(without augmentation) and their outputs are stored as a memory mapped array (frames count x cameras x features,
+float32, rows follow rows of measurements.csv). Only the head of the model is then trained on cached features.
+Features are kept per (run, model, precision, hash of weights of frozen layers) and computed again when the run
+changes.
+Frozen layers are run in inference mode (batch normalization uses moving statistics).
+"""
+import hashlib
+import json
+import logging
+import os
+
+import numpy as np
+import tensorflow as tf
+
+from config import FEATURE_CACHE_DIRECTORY, CACHED_FEATURES_FILENAME, CACHE_INFO_FILENAME
+from data_augmentation import get_cache_spec, get_acceleration, choose_image
+from dataset_index import read_labels
+from frame_cache import get_source_fingerprint, read_cache_info, load_source_images, apply_spec
+
+# frames (with all cameras) passed through frozen layers at once
+FEATURE_BATCH_FRAMES = 32
+CAMERAS_COUNT = 3
+
+# memory mapped features of run directories, opened once per process
+_feature_stores = {}
+
+
+def get_frozen_split(model):
+	"""
+	Returns index of the first trainable layer of the model when layers before it have (frozen) weights,
+	None when there is nothing worth caching (e.g. backbone is fine tuned)
+	"""
+	for i, layer in enumerate(model.layers):
+		if layer.trainable_weights:
+			return i if any(frozen.weights for frozen in model.layers[:i]) else None
+	return None
+
+
+def get_feature_key(model_name, model, split, precision='float32'):
+	"""
+	Returns key of features of frozen layers: model name, compute precision of the model (features of a float16 model
+	differ) and hash of weights of frozen layers and of input spec
+	"""
+	digest = hashlib.sha1(json.dumps(get_cache_spec(), sort_keys=True).encode('utf-8'))
+	for layer in model.layers[:split]:
+		for weights in layer.get_weights():
+			digest.update(np.ascontiguousarray(weights).tobytes())
+	return '{}-{}-{}'.format(model_name, precision, digest.hexdigest()[:10])
+
+
+def get_feature_directory(data_dir, feature_key):
+	path_hash = hashlib.sha1(os.path.abspath(data_dir).encode('utf-8')).hexdigest()[:8]
+	run_key = '{}-{}'.format(os.path.basename(os.path.normpath(data_dir)), path_hash)
+	return os.path.join(FEATURE_CACHE_DIRECTORY, feature_key, run_key)
+
+
+def get_feature_function(model, split):
+	"""
+	Returns function computing outputs of frozen layers for a batch of images (in inference mode)
+	"""
+	forward_pass = tf.keras.backend.function(model.inputs, [model.layers[split - 1].output])
+	return lambda images: forward_pass([images])[0]
+
+
+def build_feature_store(data_dir, feature_key, feature_function, feature_shape, force=False):
+	"""
+	Computes features of all camera images of a single run unless they are fresh. Returns number of computed frames.
+	"""
+	feature_dir = get_feature_directory(data_dir, feature_key)
+	fingerprint = get_source_fingerprint(data_dir)
+	info = read_cache_info(feature_dir, CACHED_FEATURES_FILENAME)
+	if not force and info is not None and info['fingerprint'] == fingerprint:
+		return 0
+
+	spec = get_cache_spec()
+	labels = read_labels(data_dir)
+	os.makedirs(feature_dir, exist_ok=True)
+	info_file = os.path.join(feature_dir, CACHE_INFO_FILENAME)
+	if os.path.exists(info_file):
+		os.remove(info_file)
+
+	features_file = os.path.join(feature_dir, CACHED_FEATURES_FILENAME)
+	tmp_features_file = features_file + '.tmp'
+	features = np.lib.format.open_memmap(tmp_features_file, mode='w+', dtype=np.float32,
+	                                     shape=(len(labels), CAMERAS_COUNT) + tuple(feature_shape))
+	frames = labels['frame'].values
+	for start in range(0, len(frames), FEATURE_BATCH_FRAMES):
+		end = min(start + FEATURE_BATCH_FRAMES, len(frames))
+		images = np.stack([apply_spec(image, spec) for i in range(start, end)
+		                   for image in load_source_images(data_dir, i, frames[i])])
+		features[start:end] = feature_function(images).reshape((end - start, CAMERAS_COUNT) + tuple(feature_shape))
+	features.flush()
+	del features
+	os.replace(tmp_features_file, features_file)
+
+	# info is written last, so interrupted computation is never taken as fresh features
+	with open(info_file, 'w') as f:
+		json.dump({'data_dir': os.path.abspath(data_dir), 'feature_key': feature_key, 'fingerprint': fingerprint}, f,
+		          indent=4)
+	return len(labels)
+
+
+def warm_up_features(data_dirs, feature_key, model, split):
+	"""
+	Computes features of given runs which are missing or stale
+	"""
+	feature_function = get_feature_function(model, split)
+	feature_shape = tuple(model.layers[split - 1].output_shape[1:])
+	computed_runs, computed_frames = 0, 0
+	for data_dir in data_dirs:
+		count = build_feature_store(data_dir, feature_key, feature_function, feature_shape)
+		if count > 0:
+			logging.info("{}: computed features of {} frames".format(data_dir, count))
+			computed_runs += 1
+			computed_frames += count
+	logging.info("Computed features of {} frames of {}/{} runs ({})".format(computed_frames, computed_runs,
+	                                                                      len(data_dirs), feature_key))
+
+
+def open_feature_store(data_dir, feature_key):
+	features = _feature_stores.get((data_dir, feature_key))
+	if features is None:
+		features = np.load(os.path.join(get_feature_directory(data_dir, feature_key), CACHED_FEATURES_FILENAME),
+		                   mmap_mode='r')
+		_feature_stores[(data_dir, feature_key)] = features
+	return features
+
+
+def fill_feature_batch(rows, is_training, feature_key, random_state=np.random):
+	"""
+	Batch of cached features, training samples take features of a random camera (as fill_batch does with images)
+	"""
+	features, steers = None, np.empty([len(rows), 2], dtype=np.float32)
+	for i, (frame, steering_angle, acceleration, braking, data_dir, packed_index) in enumerate(rows):
+		center, left, right = open_feature_store(data_dir, feature_key)[packed_index]
+		if is_training:
+			sample, steering_angle = choose_image(center, left, right, steering_angle, random_state)
+		else:
+			sample = center
+		if features is None:
+			features = np.empty((len(rows),) + sample.shape, dtype=np.float32)
+		features[i] = sample
+		steers[i, 0] = steering_angle
+		steers[i, 1] = get_acceleration(acceleration, braking)
+	return features, steers
+
+
+def build_head_model(model, split):
+	"""
+	Returns model of layers from the split on, fed with features (it shares weights with the whole model)
+	"""
+	head = tf.keras.models.Sequential()
+	head.add(tf.keras.layers.InputLayer(input_shape=model.layers[split - 1].output_shape[1:]))
+	for layer in model.layers[split:]:
+		head.add(layer)
+	return head
+
+
+class FullModelCheckpoint(tf.keras.callbacks.ModelCheckpoint):
+	"""
+	Saves the given whole model also when only its head is trained, so checkpoints are the same as of full training
+	"""
+
+	def __init__(self, full_model, *args, **kwargs):
+		super(FullModelCheckpoint, self).__init__(*args, **kwargs)
+		self._full_model = full_model
+
+	def set_model(self, model):
+		super(FullModelCheckpoint, self).set_model(self._full_model)
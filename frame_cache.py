@@ -0,0 +1,192 @@
+"""
+Cache of ready to train frames of gathered runs. Frames of every run (png images, packed arrays or shards) are decoded,
+preprocessed by CACHE_SPEC of data_augmentation.py and stored once as a memory mapped array
+(frames count x cameras x height x width x channels, uint8, rows follow rows of measurements.csv).
+Cached frames are kept per (run, spec hash, input shape): a changed spec or input shape uses a new cache directory
+and a changed run (fingerprint of its labels and frames files) is cached again.
+Colors are normalized inside of the model (NormalizeColors layer), so cached frames stay uint8.
+"""
+import argparse
+import json
+import logging
+import os
+import shutil
+from multiprocessing import Pool
+
+import cv2
+import numpy as np
+
+from config import MEASUREMENTS_CSV_FILENAME, PACKED_FRAMES_FILENAME, SHARDS_INDEX_FILENAME, FRAME_CACHE_DIRECTORY, \
+	CACHED_FRAMES_FILENAME, CACHE_INFO_FILENAME
+from data_augmentation import INPUT_SHAPE, get_cache_spec, get_cache_key, get_cache_directory, load_images, \
+	load_packed_images, is_sharded, load_shard_images, is_packed, uses_packed_cache
+from dataset_index import read_labels, list_run_directories
+
+INTERPOLATIONS = {
+	'area': cv2.INTER_AREA,
+	'linear': cv2.INTER_LINEAR,
+	'nearest': cv2.INTER_NEAREST
+}
+CAMERAS_COUNT = 3
+
+FORMAT = '%(asctime)-15s : %(message)s'
+
+
+# run: python frame_cache.py -d .\out\data -d .\out\validation_data -j 8
+
+def parse_input_shape(value):
+	return tuple(int(d) for d in value.split(','))
+
+
+def get_source_fingerprint(data_dir):
+	"""
+	Returns name, mtime and size of files the frames of the run are read from (and state of png images of unpacked run)
+	"""
+	filenames = [MEASUREMENTS_CSV_FILENAME]
+	if is_sharded(data_dir):
+		filenames.append(SHARDS_INDEX_FILENAME)
+	elif is_packed(data_dir):
+		filenames.append(PACKED_FRAMES_FILENAME)
+	fingerprint = []
+	for filename in filenames:
+		stat = os.stat(os.path.join(data_dir, filename))
+		fingerprint.append([filename, stat.st_mtime, stat.st_size])
+	if len(filenames) == 1:
+		fingerprint.append(get_images_fingerprint(data_dir))
+	return fingerprint
+
+
+def get_images_fingerprint(data_dir):
+	"""
+	Returns number, the latest mtime and total size of png images of the run (e.g. exported again by frame_shards.py)
+	"""
+	count, mtime, size = 0, 0.0, 0
+	for entry in os.scandir(data_dir):
+		if entry.name.endswith('.png'):
+			stat = entry.stat()
+			count += 1
+			mtime = max(mtime, stat.st_mtime)
+			size += stat.st_size
+	return ['png', count, mtime, size]
+
+
+def read_cache_info(cache_dir, cached_filename=CACHED_FRAMES_FILENAME):
+	info_file = os.path.join(cache_dir, CACHE_INFO_FILENAME)
+	if not os.path.exists(info_file) or not os.path.exists(os.path.join(cache_dir, cached_filename)):
+		return None
+	with open(info_file) as f:
+		return json.load(f)
+
+
+def is_cache_fresh(data_dir, input_shape=INPUT_SHAPE):
+	info = read_cache_info(get_cache_directory(data_dir, input_shape))
+	return info is not None and info['spec'] == get_cache_spec(input_shape) and \
+	       info['fingerprint'] == get_source_fingerprint(data_dir)
+
+
+def load_source_images(data_dir, index, frame):
+	if is_sharded(data_dir):
+		return load_shard_images(data_dir, index)
+	if is_packed(data_dir):
+		return load_packed_images(data_dir, index)
+	return load_images(data_dir, frame)
+
+
+def apply_spec(image, spec):
+	top, bottom = spec['crop']
+	image = image[top:image.shape[0] - bottom]
+	height, width = spec['input_shape'][:2]
+	if image.shape[:2] != (height, width):
+		image = cv2.resize(image, (width, height), interpolation=INTERPOLATIONS[spec['interpolation']])
+	return image
+
+
+def build_cache(job):
+	"""
+	Caches frames of a single run unless its cache is fresh. Returns directory, number of cached frames
+	(0 when the cache was fresh) and the cache directory. Packed runs are not copied when the spec is identity,
+	their frames.npy is the cache then.
+	"""
+	data_dir, input_shape, force = job
+	if uses_packed_cache(data_dir, input_shape):
+		return data_dir, 0, data_dir
+	cache_dir = get_cache_directory(data_dir, input_shape)
+	if not force and is_cache_fresh(data_dir, input_shape):
+		return data_dir, 0, cache_dir
+
+	spec = get_cache_spec(input_shape)
+	fingerprint = get_source_fingerprint(data_dir)
+	labels = read_labels(data_dir)
+	os.makedirs(cache_dir, exist_ok=True)
+	info_file = os.path.join(cache_dir, CACHE_INFO_FILENAME)
+	if os.path.exists(info_file):
+		os.remove(info_file)
+
+	frames_file = os.path.join(cache_dir, CACHED_FRAMES_FILENAME)
+	tmp_frames_file = frames_file + '.tmp'
+	frames = np.lib.format.open_memmap(tmp_frames_file, mode='w+', dtype=np.uint8,
+	                                   shape=(len(labels), CAMERAS_COUNT) + tuple(input_shape))
+	for i, frame in enumerate(labels['frame'].values):
+		frames[i] = [apply_spec(image, spec) for image in load_source_images(data_dir, i, frame)]
+	frames.flush()
+	del frames
+	os.replace(tmp_frames_file, frames_file)
+
+	# info is written last, so an interrupted caching is never taken as fresh cache
+	with open(info_file, 'w') as f:
+		json.dump({'data_dir': os.path.abspath(data_dir), 'spec': spec, 'fingerprint': fingerprint}, f, indent=4)
+	return data_dir, len(labels), cache_dir
+
+
+def warm_up(directory, input_shape=INPUT_SHAPE, processes=None, force=False):
+	"""
+	Caches frames of all runs of the directory whose cache is missing or stale
+	"""
+	jobs = [(data_dir, input_shape, force) for data_dir in list_run_directories(directory)]
+	cached_runs, cached_frames = 0, 0
+	with Pool(processes) as pool:
+		for data_dir, count, cache_dir in pool.imap_unordered(build_cache, jobs):
+			if count > 0:
+				logging.info("{}: cached {} frames in {}".format(data_dir, count, cache_dir))
+				cached_runs += 1
+				cached_frames += count
+	logging.info("{}: cached {} frames of {}/{} runs ({})".format(directory, cached_frames, cached_runs, len(jobs),
+	                                                           get_cache_key(input_shape)))
+
+
+def remove_stale_caches(input_shape=INPUT_SHAPE):
+	"""
+	Removes caches of the input shape built with other preprocessing specs
+	"""
+	if not os.path.exists(FRAME_CACHE_DIRECTORY):
+		return
+	key = get_cache_key(input_shape)
+	shape_prefix = key.split('-')[0] + '-'
+	for name in os.listdir(FRAME_CACHE_DIRECTORY):
+		if name.startswith(shape_prefix) and name != key:
+			logging.info("Removing stale cache {}".format(name))
+			shutil.rmtree(os.path.join(FRAME_CACHE_DIRECTORY, name))
+
+
+def main():
+	parser = argparse.ArgumentParser(description='Caches preprocessed frames of gathered data')
+	parser.add_argument('-d', '--directory', help='data directory to cache (can be repeated)', action='append',
+	                    dest='directories')
+	parser.add_argument('-s', '--input-shape', help='comma separated height, width and channels of model input',
+	                    type=parse_input_shape, default=INPUT_SHAPE)
+	parser.add_argument('-j', '--processes', help='number of processes', type=int, default=None)
+	parser.add_argument('--force', help='cache again runs with fresh cache', action='store_true')
+	parser.add_argument('--clean', help='remove caches of the input shape built with other specs', action='store_true')
+	args = parser.parse_args()
+
+	if args.clean:
+		remove_stale_caches(args.input_shape)
+	directories = args.directories or [".\\out\\data", ".\\out\\validation_data"]
+	for directory in directories:
+		warm_up(directory, args.input_shape, args.processes, args.force)
+
+
+if __name__ == '__main__':
+	logging.basicConfig(format=FORMAT)
+	logging.getLogger().setLevel(logging.INFO)
+	main()
@@ -0,0 +1,118 @@
+"""
+Recording of gathered frames into shards - arrays of preprocessed frames of fixed size (frames x cameras x height x
+width x channels, uint8) saved as .npy files next to measurements.csv. Row i of measurements.csv is frame
+i % frames_per_shard of shard i // frames_per_shard. Shards are read by the training loader as memory mapped arrays.
+"""
+import argparse
+import json
+import logging
+import os
+import shutil
+import threading
+
+import cv2
+import numpy as np
+import pandas as pd
+
+from config import CENTER_CAMERA_NAME, LEFT_CAMERA_NAME, RIGHT_CAMERA_NAME, MEASUREMENTS_CSV_FILENAME, \
+	SHARDS_INDEX_FILENAME, SHARD_FRAMES_FILENAME
+from data_augmentation import INPUT_SHAPE, load_shard_images, read_shards_index
+
+# sensors stored in shards, in the same order as returned by load_images (center, left, right)
+SHARD_CAMERAS = ['CameraRGB_C', 'CameraRGB_L', 'CameraRGB_R']
+FRAMES_PER_SHARD = 256
+
+FORMAT = '%(asctime)-15s : %(message)s'
+
+
+# run: python frame_shards.py -d .\out\data\20181113184752 -o .\out\png\20181113184752
+
+class ShardWriter(object):
+	"""
+	Writes preprocessed frames into shards at given positions, may be used by many threads at once
+	"""
+
+	def __init__(self, directory, frames_per_shard=FRAMES_PER_SHARD, cameras=SHARD_CAMERAS):
+		self._directory = directory
+		self._frames_per_shard = frames_per_shard
+		self._cameras = cameras
+		self._shards = {}
+		self._lock = threading.Lock()
+		self.count = 0
+
+	def write(self, index, images):
+		shard = index // self._frames_per_shard
+		with self._lock:
+			frames = self._shards.get(shard)
+			if frames is None:
+				frames = np.lib.format.open_memmap(self._shard_path(shard), mode='w+', dtype=np.uint8,
+				                                   shape=(self._frames_per_shard, len(self._cameras)) + INPUT_SHAPE)
+				self._shards[shard] = frames
+			self.count = max(self.count, index + 1)
+		frames[index % self._frames_per_shard] = images
+
+	def close(self):
+		"""
+		Flushes shards, cuts the last one to the number of written frames and writes index of shards
+		"""
+		shards_count = (self.count + self._frames_per_shard - 1) // self._frames_per_shard
+		for shard in self._shards:
+			self._shards[shard].flush()
+		last_count = self.count - (shards_count - 1) * self._frames_per_shard
+		cut_last = shards_count > 0 and last_count < self._frames_per_shard
+		last_path = self._shard_path(shards_count - 1)
+		if cut_last:
+			np.save(last_path + '.tmp.npy', self._shards[shards_count - 1][:last_count])
+		# no memory map may stay open, a mapped file cannot be replaced on Windows
+		self._shards = {}
+		if cut_last:
+			os.replace(last_path + '.tmp.npy', last_path)
+
+		index = {
+			'frames_per_shard': self._frames_per_shard,
+			'frames': self.count,
+			'cameras': self._cameras,
+			'shards': [SHARD_FRAMES_FILENAME.format(shard) for shard in range(shards_count)]
+		}
+		with open(os.path.join(self._directory, SHARDS_INDEX_FILENAME), 'w') as f:
+			json.dump(index, f, indent=2)
+
+	def _shard_path(self, shard):
+		return os.path.join(self._directory, SHARD_FRAMES_FILENAME.format(shard))
+
+
+def export_png(directory, out_directory):
+	"""
+	Saves frames of a sharded directory as png images (named as by gather_data.py) for inspection
+	"""
+	if read_shards_index(directory) is None:
+		raise ValueError("{} has no {}".format(directory, SHARDS_INDEX_FILENAME))
+
+	os.makedirs(out_directory, exist_ok=True)
+	if os.path.abspath(out_directory) != os.path.abspath(directory):
+		for filename in [MEASUREMENTS_CSV_FILENAME, 'config.txt']:
+			if os.path.exists(os.path.join(directory, filename)):
+				shutil.copy(os.path.join(directory, filename), out_directory)
+
+	measurements = pd.read_csv(os.path.join(directory, MEASUREMENTS_CSV_FILENAME), usecols=[0], header=None)
+	for index, frame in enumerate(measurements[0]):
+		images = load_shard_images(directory, index)
+		for name, image in zip([CENTER_CAMERA_NAME, LEFT_CAMERA_NAME, RIGHT_CAMERA_NAME], images):
+			cv2.imwrite(os.path.join(out_directory, name.format(frame)), cv2.cvtColor(image, cv2.COLOR_RGB2BGR))
+	return len(measurements)
+
+
+def main():
+	parser = argparse.ArgumentParser(description='Exports frames recorded into shards as png images')
+	parser.add_argument('-d', '--directory', help='directory recorded with --record shards', required=True)
+	parser.add_argument('-o', '--out-directory', help='output directory (default: the recorded directory)')
+	args = parser.parse_args()
+
+	count = export_png(args.directory, args.out_directory or args.directory)
+	logging.info("Exported {} frames".format(count))
+
+
+if __name__ == '__main__':
+	logging.basicConfig(format=FORMAT)
+	logging.getLogger().setLevel(logging.INFO)
+	main()
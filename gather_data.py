@@ -1,11 +1,11 @@
-import csv
 import logging
 import random
+import sys
 import time
 
 from carla.client import make_carla_client
 from carla.tcp import TCPConnectionError
-from config import MEASUREMENTS_CSV_FILENAME
+from config import MEASUREMENTS_CSV_FILENAME, CONNECTION_ERROR_EXIT_CODE, FRAMES_ERROR_EXIT_CODE
 from gathering_data_common import *
 
 
@@ -14,16 +14,18 @@ def start_gathering_data(args, out_directory):
 		settings = get_settings_for_scene(args)
 		scene = client.load_settings(settings)
 
-		# Choose one player start at random.
+		# Choose one player start at random (unless it is given).
 		number_of_player_starts = len(scene.player_start_spots)
-		player_start = random.randint(0, max(0, number_of_player_starts - 1))
+		if args.start_spot >= 0:
+			player_start = min(args.start_spot, max(0, number_of_player_starts - 1))
+		else:
+			player_start = random.randint(0, max(0, number_of_player_starts - 1))
 		client.start_episode(player_start)
 
 		skip_frames = args.skip_frames  # make screen every skip_frames
 
-		with open(out_directory + '\\' + MEASUREMENTS_CSV_FILENAME, 'w', newline='') as csvfile:
-			measurements_file = csv.writer(csvfile, delimiter=',', quotechar='|', quoting=csv.QUOTE_MINIMAL)
-
+		with open(out_directory + '\\' + MEASUREMENTS_CSV_FILENAME, 'w', newline='') as csvfile, \
+				make_frame_writer(out_directory, csvfile, args) as writer:
 			# let skip first 20 frames (car is in the air)
 			for _ in range(20):
 				measurements, sensor_data = client.read_data()
@@ -46,7 +48,9 @@ def start_gathering_data(args, out_directory):
 					client.send_control(control)
 					continue
 
-				if frame % skip_frames == 0:
+				# images are saved by the writer threads, the row is written by them once all cameras are saved
+				control = measurements.player_measurements.autopilot_control
+				if frame % skip_frames == 0 and writer.submit(frame, sensor_data, control):
 					saved_frames = saved_frames + 1
 					logging.info("[SAVE] {}/{}: steering: {}, acc: {}, brake: {} ".format(
 						saved_frames,
@@ -55,11 +59,6 @@ def start_gathering_data(args, out_directory):
 						measurements.player_measurements.autopilot_control.throttle,
 						measurements.player_measurements.autopilot_control.brake))
 
-					write_measurements_to_csv(measurements_file, frame, measurements.player_measurements.autopilot_control)
-
-					for name, measurement in sensor_data.items():
-						save_frame_image(out_directory, frame, measurement, name)
-
 				frame = frame + 1
 				control = measurements.player_measurements.autopilot_control
 				client.send_control(control)
@@ -68,6 +67,9 @@ def start_gathering_data(args, out_directory):
 					logging.info("Saved frames: {}; STOP".format(saved_frames))
 					break
 
+		# frames which could not be saved have no row in measurements.csv
+		return writer.failed
+
 
 def main():
 	argparser = generate_run_arguments()
@@ -83,23 +85,48 @@ def main():
 		default=10,
 		help='save screen every skip_frames'
 	)
+	argparser.add_argument(
+		'--start-spot',
+		type=int,
+		default=-1,
+		help='index of the player start spot (default: random)'
+	)
+	argparser.add_argument(
+		'-o', '--out-directory',
+		default=None,
+		help='directory for gathered data (default: .\\out\\data\\{timestamp})'
+	)
+	argparser.add_argument(
+		'--connection-retries',
+		type=int,
+		default=0,
+		help='exit with error after that many failed connections to the server (default: 0 - retry forever)'
+	)
 	args = argparser.parse_args()
 	log_level = logging.DEBUG if args.debug else logging.INFO
 	logging.basicConfig(level=log_level)
 
-	out_directory = create_out_directory()
+	out_directory = create_out_directory(args.out_directory)
 	save_run_config(out_directory, args)
 
 	logging.info('STARTING GATHERING DATA (at {})'.format(datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')))
 
+	failed_connections = 0
 	while True:
 		try:
-			start_gathering_data(args, out_directory)
+			failed_frames = start_gathering_data(args, out_directory)
 			print("\nFinished (at {})".format(datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')))
+			if failed_frames > 0:
+				logging.error("Saving of {} frames failed".format(failed_frames))
+				sys.exit(FRAMES_ERROR_EXIT_CODE)
 			return
 
 		except TCPConnectionError as error:
 			logging.error(error)
+			failed_connections += 1
+			if 0 < args.connection_retries <= failed_connections:
+				logging.error("Failed to connect {} times, exit".format(failed_connections))
+				sys.exit(CONNECTION_ERROR_EXIT_CODE)
 			time.sleep(1)
 
 
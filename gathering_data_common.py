@@ -1,11 +1,23 @@
 import datetime
+import logging
 import os
 import argparse
+import csv
+import queue
+import threading
+import time
 import cv2
 
 from carla.sensor import Camera
 from carla.settings import CarlaSettings
 from data_augmentation import preprocess
+from frame_shards import ShardWriter, SHARD_CAMERAS
+
+# number of threads preprocessing and saving frames and number of frames waiting for them
+WRITER_THREADS = 2
+WRITER_QUEUE_SIZE = 32
+# frame is late when it waits for a writer thread longer than this (seconds)
+LATE_FRAME_SECONDS = 1.0
 
 weather_presets = {
 	0: 'Default',
@@ -31,10 +43,22 @@ def save_run_config(directory, args):
 	f.write(str(args))
 
 
-def create_out_directory():
-	out_directory = '.\\out\\data\\{}'.format(datetime.datetime.now().strftime("%Y%m%d%H%M%S"))
-	os.makedirs(out_directory)
-	return out_directory
+def create_out_directory(out_directory=None):
+	if out_directory is not None:
+		os.makedirs(out_directory)
+		return out_directory
+
+	# gathering processes started in the same second (e.g. by run_gather_data.py) get directories with suffixes
+	base_directory = '.\\out\\data\\{}'.format(datetime.datetime.now().strftime("%Y%m%d%H%M%S"))
+	out_directory = base_directory
+	suffix = 0
+	while True:
+		try:
+			os.makedirs(out_directory)
+			return out_directory
+		except FileExistsError:
+			suffix += 1
+			out_directory = '{}-{}'.format(base_directory, suffix)
 
 
 class CameraSettings:
@@ -132,6 +156,34 @@ def generate_run_arguments():
 		default=0,
 		help='weather preset'
 	)
+	argparser.add_argument(
+		'-t', '--map_name',
+		default=None,
+		help='name of the map loaded by the server (saved in config.txt of the run)'
+	)
+	argparser.add_argument(
+		'--writer-threads',
+		type=int,
+		default=WRITER_THREADS,
+		help='number of threads saving frames in background (0 - save in the client loop)'
+	)
+	argparser.add_argument(
+		'--writer-queue',
+		type=int,
+		default=WRITER_QUEUE_SIZE,
+		help='number of frames waiting to be saved, the client loop waits (or drops frames) when it is full'
+	)
+	argparser.add_argument(
+		'--drop-frames',
+		action='store_true',
+		help='drop frames instead of waiting when writer queue is full'
+	)
+	argparser.add_argument(
+		'--record',
+		choices=['png', 'shards'],
+		default='png',
+		help='save frames as png images or as shards of preprocessed arrays (see frame_shards.py)'
+	)
 	return argparser
 
 
@@ -140,4 +192,167 @@ def save_frame_image(out_directory, frame, sensor_data, name):
 	data = sensor_data.data
 	data = preprocess(data)
 	data = cv2.cvtColor(data, cv2.COLOR_BGR2RGB)
-	cv2.imwrite(filename, data)
\ No newline at end of file
+	if not cv2.imwrite(filename, data):
+		raise IOError("Could not write {}".format(filename))
+
+
+class AsyncFrameWriter(object):
+	"""
+	Preprocesses and saves camera frames on background threads, so the client loop only queues raw sensor data.
+	When the queue is full submit waits for a free place (back-pressure) or, with drop_frames, drops the frame.
+	Row of the frame is written to measurements_file (csv writer) only after all its cameras were saved, rows keep
+	the order of submitted frames and a frame which could not be saved gets no row (it is counted as failed).
+	Use as a context manager: all queued frames are saved on exit, also after KeyboardInterrupt.
+	"""
+
+	def __init__(self, out_directory, measurements_file, threads=WRITER_THREADS, queue_size=WRITER_QUEUE_SIZE,
+	             drop_frames=False):
+		self._out_directory = out_directory
+		self._measurements_file = measurements_file
+		self._drop_frames = drop_frames
+		self._queue = queue.Queue(queue_size)
+		self._lock = threading.Lock()
+		# frames saved (or failed) out of order wait here until all frames submitted before them are done
+		self._done = {}
+		self._next_row = 0
+		self.submitted = 0
+		self.saved = 0
+		self.dropped = 0
+		self.late = 0
+		self.failed = 0
+		self._threads = []
+		for i in range(threads):
+			thread = threading.Thread(target=self._run, name='frame-writer-{}'.format(i))
+			thread.daemon = True
+			thread.start()
+			self._threads.append(thread)
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, exc_type, exc_value, traceback):
+		self.close()
+
+	def submit(self, frame, sensor_data, control):
+		"""
+		Queues all cameras of the frame with its control (written to measurements.csv when the frame is saved),
+		returns False when the frame was dropped
+		"""
+		if len(self._threads) == 0:
+			self._process(self.submitted, frame, sensor_data, control)
+			self.submitted += 1
+			return True
+
+		item = (self.submitted, frame, sensor_data, control, time.time())
+		if self._drop_frames:
+			try:
+				self._queue.put_nowait(item)
+			except queue.Full:
+				self.dropped += 1
+				logging.warning("[{}] Writer queue is full, frame dropped (dropped: {})".format(frame, self.dropped))
+				return False
+		else:
+			start = time.time()
+			self._queue.put(item)
+			waited = time.time() - start
+			if waited > LATE_FRAME_SECONDS:
+				logging.warning("[{}] Client loop waited {:.2f}s for the writer queue".format(frame, waited))
+		self.submitted += 1
+		return True
+
+	def close(self):
+		if len(self._threads) > 0:
+			logging.info("Saving {} queued frames...".format(self._queue.qsize()))
+		for _ in self._threads:
+			self._queue.put(None)
+		for thread in self._threads:
+			thread.join()
+		self._threads = []
+		logging.info("Frame writer: saved {}, dropped {}, late {}, failed {}".format(
+			self.saved, self.dropped, self.late, self.failed))
+
+	def _run(self):
+		while True:
+			item = self._queue.get()
+			if item is None:
+				return
+			index, frame, sensor_data, control, submitted = item
+			waited = time.time() - submitted
+			if waited > LATE_FRAME_SECONDS:
+				with self._lock:
+					self.late += 1
+				logging.warning("[{}] Frame saved late, waited {:.2f}s in the writer queue".format(frame, waited))
+			self._process(index, frame, sensor_data, control)
+
+	def _process(self, index, frame, sensor_data, control):
+		try:
+			saved = self._save(index, frame, sensor_data)
+		except Exception as error:
+			logging.error("[{}] Saving frame failed: {}".format(frame, error))
+			saved = None
+		self._commit(index, None if saved is None else (frame, control, saved))
+
+	def _commit(self, index, result):
+		"""
+		Writes rows of frames done in order of submission, result is None for a frame which could not be saved
+		"""
+		with self._lock:
+			self._done[index] = result
+			while self._next_row in self._done:
+				result = self._done.pop(self._next_row)
+				self._next_row += 1
+				if result is None:
+					self.failed += 1
+					continue
+				try:
+					self._write_row(*result)
+				except Exception as error:
+					self.failed += 1
+					logging.error("[{}] Writing frame failed: {}".format(result[0], error))
+
+	def _save(self, index, frame, sensor_data):
+		"""
+		Saves the frame, index is position of the frame among submitted ones. Returns value passed to _write_row.
+		"""
+		for name, measurement in sensor_data.items():
+			save_frame_image(self._out_directory, frame, measurement, name)
+		return True
+
+	def _write_row(self, frame, control, saved):
+		# called in order of submission under the lock, so rows follow frames of the run
+		write_measurements_to_csv(self._measurements_file, frame, control)
+		self.saved += 1
+
+
+class ShardFrameWriter(AsyncFrameWriter):
+	"""
+	Writes preprocessed frames straight into shards instead of png images. Frames are preprocessed by writer threads
+	and stored at the position of their row when it is written, so a frame which could not be preprocessed or stored
+	has neither a row nor a slot in shards (rows and shard slots stay aligned).
+	"""
+
+	def __init__(self, out_directory, measurements_file, threads=WRITER_THREADS, queue_size=WRITER_QUEUE_SIZE,
+	             drop_frames=False):
+		self._shards = ShardWriter(out_directory)
+		super(ShardFrameWriter, self).__init__(out_directory, measurements_file, threads, queue_size, drop_frames)
+
+	def close(self):
+		super(ShardFrameWriter, self).close()
+		self._shards.close()
+
+	def _save(self, index, frame, sensor_data):
+		return [preprocess(sensor_data[name].data) for name in SHARD_CAMERAS]
+
+	def _write_row(self, frame, control, saved):
+		# saved is the number of rows written so far, so it is the position of the row
+		self._shards.write(self.saved, saved)
+		super(ShardFrameWriter, self)._write_row(frame, control, saved)
+
+
+def make_frame_writer(out_directory, csvfile, args):
+	"""
+	Returns writer of frames of the run which writes their rows to the opened measurements.csv file
+	"""
+	measurements_file = csv.writer(csvfile, delimiter=',', quotechar='|', quoting=csv.QUOTE_MINIMAL)
+	writer_class = ShardFrameWriter if args.record == 'shards' else AsyncFrameWriter
+	return writer_class(out_directory, measurements_file, args.writer_threads, args.writer_queue, args.drop_frames)
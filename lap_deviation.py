@@ -0,0 +1,54 @@
+import numpy as np
+from scipy.spatial import cKDTree
+
+# run is outside of the corridor when it is further from the racing line than the tolerance (meters)
+CORRIDOR_TOLERANCE = 2.0
+
+
+class RacingLineIndex:
+	"""
+	Spatial index (k-d trees of points and of segment midpoints) of a reference racing line answering distances
+	of points to the line
+	"""
+
+	def __init__(self, points):
+		self.points = np.asarray(points, dtype=float)
+		self.tree = cKDTree(self.points)
+		# the lap is closed, the last segment goes from the last point back to the first one
+		self.starts = self.points
+		self.ends = np.roll(self.points, -1, axis=0)
+		self.segment_tree = cKDTree((self.starts + self.ends) / 2.0)
+		# (with a margin for rounding of the search radius)
+		self.max_half_length = np.max(np.sqrt(np.sum((self.ends - self.starts) ** 2, axis=1))) / 2.0 + 1e-6
+
+	def cross_track_errors(self, points):
+		"""
+		Returns distance of every point to the racing line (closed polyline through the reference points)
+		"""
+		points = np.asarray(points, dtype=float)
+		# the closest segment is not further than the nearest point, so its midpoint is not further than that
+		# distance and half of the longest segment
+		nearest_distances, _ = self.tree.query(points)
+		candidates = [self.segment_tree.query_ball_point(point, distance + self.max_half_length)
+		              for point, distance in zip(points, nearest_distances)]
+		counts = np.array([len(segments) for segments in candidates])
+		segments = np.concatenate(candidates).astype(int)
+		distances = segment_distances(np.repeat(points, counts, axis=0), self.starts[segments], self.ends[segments])
+		return np.minimum.reduceat(distances, np.cumsum(counts) - counts)
+
+
+def segment_distances(points, starts, ends):
+	segments = ends - starts
+	lengths = np.sum(segments ** 2, axis=1)
+	projections = np.sum((points - starts) * segments, axis=1) / np.where(lengths > 0, lengths, 1.0)
+	closest = starts + np.clip(projections, 0.0, 1.0)[:, np.newaxis] * segments
+	return np.sqrt(np.sum((points - closest) ** 2, axis=1))
+
+
+def deviation_metrics(errors, tolerance=CORRIDOR_TOLERANCE):
+	return {
+		'mean_deviation': float(np.mean(errors)),
+		'max_deviation': float(np.max(errors)),
+		'p95_deviation': float(np.percentile(errors, 95)),
+		'outside_corridor': float(np.mean(errors > tolerance) * 100.0)
+	}
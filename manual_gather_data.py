@@ -13,13 +13,13 @@ LEFT AXIS : STEERING
 
 STARTING in a moment...
 """
-import csv
 import logging
+import sys
 import time
 
-from config import MEASUREMENTS_CSV_FILENAME
+from config import MEASUREMENTS_CSV_FILENAME, FRAMES_ERROR_EXIT_CODE
 from gathering_data_common import generate_run_arguments, create_out_directory, save_run_config, \
-	write_measurements_to_csv, save_frame_image, get_settings_for_scene
+	get_settings_for_scene, make_frame_writer
 
 try:
 	import pygame
@@ -60,7 +60,9 @@ class Timer(object):
 class CarlaGame(object):
 	def __init__(self, carla_client, args):
 		self.client = carla_client
+		self._args = args
 		self._carla_settings = get_settings_for_scene(args, sync_mode=False)
+		self._writer = None
 		self._timer = None
 		self._current_joystick = None
 		self._out_directory = None
@@ -77,20 +79,21 @@ class CarlaGame(object):
 
 		self._out_directory = out_directory
 		logging.info("Ot directory: {}".format(self._out_directory))
-		with open(out_directory + '\\' + MEASUREMENTS_CSV_FILENAME, 'w', newline='') as csvfile:
-			measurements_file = csv.writer(csvfile, delimiter=',', quotechar='|', quoting=csv.QUOTE_MINIMAL)
+		with open(out_directory + '\\' + MEASUREMENTS_CSV_FILENAME, 'w', newline='') as csvfile, \
+				make_frame_writer(out_directory, csvfile, self._args) as self._writer:
 			try:
 				while True:
-					for event in pygame.event.get():
-						if event.type == pygame.QUIT:
-							return
-					self._on_loop(measurements_file, every_second)
+					if any(event.type == pygame.QUIT for event in pygame.event.get()):
+						break
+					self._on_loop(every_second)
 					self._on_render()
 					if self._saved_frames >= self._max_saved_frames:
 						logging.info("All data saved. Quit...")
 						break
 			finally:
 				pygame.quit()
+		# frames which could not be saved have no row in measurements.csv
+		return self._writer.failed
 
 	def _initialize_game(self):
 		self._on_new_episode()
@@ -111,19 +114,19 @@ class CarlaGame(object):
 		self.client.start_episode(player_start)
 		self._timer = Timer()
 
-	def _on_loop(self, measurements_file, every_second):
+	def _on_loop(self, every_second):
 		self._timer.tick()
 
 		control = self._get_joystick_control()
 		if self._timer.elapsed_seconds_since_lap() > every_second:
-			self._save_data_frame(control, measurements_file)
+			self._save_data_frame(control)
 
 		if control is None:
 			self._on_new_episode()
 		else:
 			self.client.send_control(control)
 
-	def _save_data_frame(self, control, measurements_file):
+	def _save_data_frame(self, control):
 		_, sensor_data = self.client.read_data()
 		if len(sensor_data) < 3:
 			logging.warning("{}/{}: missing camera shots from Carla, skip saving (#shots: {})".format(
@@ -133,9 +136,10 @@ class CarlaGame(object):
 			))
 			return
 
-		write_measurements_to_csv(measurements_file, self._saved_frames, control)
-		for name, sensor_data in sensor_data.items():
-			save_frame_image(self._out_directory, self._saved_frames, sensor_data, name)
+		# images (and then the row) are saved by the writer threads, so the joystick is sampled in regular intervals
+		if not self._writer.submit(self._saved_frames, sensor_data, control):
+			return
+
 		logging.info("[SAVE] {}/{}: steering: {}, acc: {}, brake: {} ".format(
 			self._saved_frames + 1,
 			self._max_saved_frames,
@@ -207,7 +211,10 @@ def main():
 
 			with make_carla_client(args.host, args.port) as client:
 				game = CarlaGame(client, args)
-				game.execute(out_directory, args.frames, args.every_second)
+				failed_frames = game.execute(out_directory, args.frames, args.every_second)
+				if failed_frames > 0:
+					logging.error("Saving of {} frames failed".format(failed_frames))
+					sys.exit(FRAMES_ERROR_EXIT_CODE)
 				break
 
 		except TCPConnectionError as error:
@@ -13,6 +13,7 @@ class DenseNetModel(ModelBase):
 		)
 
 		ret_model = tf.keras.models.Sequential()
+		self.add_input_normalization(ret_model)
 		ret_model.add(densenet)
 		ret_model.add(
 			tf.keras.layers.Dense(2)
@@ -1,5 +1,16 @@
+import tensorflow as tf
+
+from data_augmentation import INPUT_SHAPE
+from neural_networks.NormalizeColorsLayer import NormalizeColors
+
+
 class ModelBase:
 	@staticmethod
 	def load_weights(model, filename):
 		model.load_weights(filename)
 		return model
+
+	@staticmethod
+	def add_input_normalization(model):
+		model.add(tf.keras.layers.InputLayer(input_shape=INPUT_SHAPE, dtype='uint8'))
+		model.add(NormalizeColors())
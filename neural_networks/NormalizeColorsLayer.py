@@ -0,0 +1,13 @@
+import tensorflow as tf
+
+
+class NormalizeColors(tf.keras.layers.Layer):
+	"""
+	Maps uint8 colors to float32 range [-1, 1], so models are fed with raw images
+	"""
+
+	def call(self, inputs):
+		return tf.cast(inputs, tf.float32) / 127.5 - 1.0
+
+	def compute_output_shape(self, input_shape):
+		return input_shape
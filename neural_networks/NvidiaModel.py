@@ -1,16 +1,15 @@
 import tensorflow as tf
 
-from data_augmentation import INPUT_SHAPE
 from neural_networks.ModelBase import ModelBase
 
 
 class NvidiaModel(ModelBase):
 	def model(self, fine_tuning):
 		model = tf.keras.Sequential()
+		self.add_input_normalization(model)
 
 		model.add(
 			tf.keras.layers.Conv2D(
-				input_shape=INPUT_SHAPE,
 				filters=24,
 				kernel_size=[5, 5],
 				padding='same',
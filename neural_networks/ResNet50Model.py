@@ -19,6 +19,7 @@ class ResNet50Model(ModelBase):
 				layer.trainable = True
 
 		ret_model = tf.keras.models.Sequential()
+		self.add_input_normalization(ret_model)
 		ret_model.add(resnet)
 		ret_model.add(
 			tf.keras.layers.Dense(2, activity_regularizer=tf.keras.regularizers.l1(0.01))
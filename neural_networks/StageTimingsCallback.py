@@ -0,0 +1,104 @@
+import csv
+import logging
+import os
+import queue
+import time
+from datetime import datetime
+
+import numpy as np
+import tensorflow as tf
+
+from batch_sequence import INPUT_STAGES
+
+# stages of a training step measured in fit_generator: waiting for the next batch and training on it
+# (colors are normalized inside of the model, so normalization is a part of the train step)
+STEP_STAGES = ['queue_wait', 'train_step']
+# rows of every training (also resumed one) appended to the same file are told apart by its start time
+CSV_COLUMNS = ['run', 'epoch', 'batch'] + INPUT_STAGES + STEP_STAGES
+# epoch is reported as input-bound when waiting for batches takes more percent of step time
+INPUT_BOUND_PERCENT = 30.0
+
+
+class StageTimings(tf.keras.callbacks.Callback):
+	"""
+	Records seconds of every stage of every training batch. Stages of producing batches are received from
+	timings_queue of the batch sequence (see BalancedBatchSequence), the step stages are measured between batch
+	callbacks. Rows are appended to csv_file (with start time of the training as run), epoch means (ms) and percent of
+	step time spent waiting for input are added to the epoch logs (so they are TensorBoard scalars) and an input-bound
+	epoch is reported as warning.
+	"""
+
+	def __init__(self, csv_file, timings_queue=None, input_bound_percent=INPUT_BOUND_PERCENT):
+		super(StageTimings, self).__init__()
+		self.csv_file = csv_file
+		self.input_bound_percent = input_bound_percent
+		self._timings_queue = timings_queue
+		# epochs of the sequence count from 0 for every training (also resumed one)
+		self._sequence_epoch = 0
+		self._epoch = 0
+		self._run = datetime.now().strftime("%Y%m%d%H%M%S")
+		self._pending = {}
+		self._rows = []
+		self._batch_begin = 0.0
+		self._last_batch_end = 0.0
+
+	def on_train_begin(self, logs=None):
+		self._run = datetime.now().strftime("%Y%m%d%H%M%S")
+
+	def on_epoch_begin(self, epoch, logs=None):
+		self._epoch = epoch
+		self._rows = []
+		self._last_batch_end = time.time()
+
+	def on_batch_begin(self, batch, logs=None):
+		self._batch_begin = time.time()
+
+	def on_batch_end(self, batch, logs=None):
+		end = time.time()
+		row = {'run': self._run, 'epoch': self._epoch, 'batch': batch, 'queue_wait': self._batch_begin - self._last_batch_end,
+		       'train_step': end - self._batch_begin}
+		self._last_batch_end = end
+		self._receive_timings()
+		row.update(self._pending.pop((self._sequence_epoch, batch), {}))
+		self._rows.append(row)
+
+	def on_epoch_end(self, epoch, logs=None):
+		self._write_rows()
+		means = {stage: np.mean([row[stage] for row in self._rows if stage in row])
+		         for stage in INPUT_STAGES + STEP_STAGES if any(stage in row for row in self._rows)}
+		wait = sum(row['queue_wait'] for row in self._rows)
+		step = wait + sum(row['train_step'] for row in self._rows)
+		wait_percent = wait / step * 100.0 if step > 0 else 0.0
+
+		if logs is not None:
+			for stage, mean in means.items():
+				logs['time_{}_ms'.format(stage)] = mean * 1000.0
+			logs['input_wait_percent'] = wait_percent
+		logging.info("Epoch {} stage times (ms per batch): {}; waiting for input: {:.1f}% of step time".format(
+			epoch + 1, ', '.join('{}: {:.1f}'.format(stage, mean * 1000.0) for stage, mean in means.items()),
+			wait_percent))
+		if wait_percent > self.input_bound_percent:
+			logging.warning("Epoch {} is input-bound: {:.1f}% of step time is spent waiting for batches (more "
+			                "workers, packed data or frame cache could help)".format(epoch + 1, wait_percent))
+
+		self._sequence_epoch += 1
+		self._pending = {key: timings for key, timings in self._pending.items() if key[0] >= self._sequence_epoch}
+
+	def _receive_timings(self):
+		if self._timings_queue is None:
+			return
+		while True:
+			try:
+				epoch, batch, timings = self._timings_queue.get_nowait()
+			except queue.Empty:
+				return
+			self._pending[(epoch, batch)] = timings
+
+	def _write_rows(self):
+		os.makedirs(os.path.dirname(self.csv_file) or '.', exist_ok=True)
+		write_header = not os.path.exists(self.csv_file)
+		with open(self.csv_file, 'a', newline='') as f:
+			writer = csv.DictWriter(f, fieldnames=CSV_COLUMNS)
+			if write_header:
+				writer.writeheader()
+			writer.writerows(self._rows)
@@ -0,0 +1,49 @@
+import json
+import time
+
+import tensorflow as tf
+
+
+class Throughput(tf.keras.callbacks.Callback):
+	"""
+	Measures training samples per second of every epoch (without validation) and adds it to the epoch logs,
+	totals of the training are written as JSON to stats_file (used by train_all.py)
+	"""
+
+	def __init__(self, stats_file=None):
+		super(Throughput, self).__init__()
+		self.stats_file = stats_file
+		self.epochs = 0
+		self.samples = 0
+		self.seconds = 0.0
+		self._epoch_start = 0.0
+		self._epoch_samples = 0
+		self._last_batch_end = 0.0
+
+	def on_epoch_begin(self, epoch, logs=None):
+		self._epoch_start = time.time()
+		self._last_batch_end = self._epoch_start
+		self._epoch_samples = 0
+
+	def on_batch_end(self, batch, logs=None):
+		self._last_batch_end = time.time()
+		self._epoch_samples += (logs or {}).get('size', 0)
+
+	def on_epoch_end(self, epoch, logs=None):
+		seconds = self._last_batch_end - self._epoch_start
+		self.epochs += 1
+		self.samples += self._epoch_samples
+		self.seconds += seconds
+		if logs is not None and seconds > 0:
+			logs['samples_per_second'] = self._epoch_samples / seconds
+
+	def on_train_end(self, logs=None):
+		if self.stats_file is None:
+			return
+		with open(self.stats_file, 'w') as f:
+			json.dump({
+				'epochs': self.epochs,
+				'samples': self.samples,
+				'seconds': round(self.seconds, 2),
+				'samples_per_second': round(self.samples / self.seconds, 2) if self.seconds > 0 else 0.0
+			}, f)
@@ -20,6 +20,7 @@ class VGG16Model(ModelBase):
 				layer.trainable = False
 
 		ret_model = tf.keras.models.Sequential()
+		self.add_input_normalization(ret_model)
 		ret_model.add(model_vgg16_conv)
 		ret_model.add(
 			tf.keras.layers.Flatten()
@@ -1,37 +1,175 @@
-from neural_networks.DenseNetModel import DenseNetModel
-from neural_networks.ModelBase import ModelBase
-from neural_networks.NvidiaModel import NvidiaModel
-from neural_networks.ResNet50Model import ResNet50Model
-from neural_networks.VGG16Model import VGG16Model
+import importlib
+
+# tensorflow and model modules are imported only when needed, so only the selected architecture is loaded
+MODELS = {
+	'vgg': ('neural_networks.VGG16Model', 'VGG16Model'),
+	'nvidia': ('neural_networks.NvidiaModel', 'NvidiaModel'),
+	'resnet': ('neural_networks.ResNet50Model', 'ResNet50Model'),
+	'densenet': ('neural_networks.DenseNetModel', 'DenseNetModel')
+}
+
+# default compute precision and XLA compilation of training of every architecture (train.py --precision, --xla),
+# every architecture trains in float32 without XLA unless asked for (see benchmark_training.py),
+# float16 keeps float32 variables, so checkpoints are the same for every mode
+PRECISIONS = ['float32', 'float16']
+TRAINING_MODES = {
+	'vgg': {'precision': 'float32', 'xla': False},
+	'nvidia': {'precision': 'float32', 'xla': False},
+	'resnet': {'precision': 'float32', 'xla': False},
+	'densenet': {'precision': 'float32', 'xla': False}
+}
+
+
+def get_model_class(model_name):
+	module_name, class_name = MODELS[model_name]
+	return getattr(importlib.import_module(module_name), class_name)
 
 
 def get_empty_model(model_name, fine_tuning):
-	if model_name == 'nvidia':
-		return NvidiaModel().model(fine_tuning)
-	elif model_name == 'vgg':
-		return VGG16Model().model(fine_tuning)
-	elif model_name == 'resnet':
-		return ResNet50Model().model(fine_tuning)
-	elif model_name == 'densenet':
-		return DenseNetModel().model(fine_tuning)
-	else:
+	if model_name not in MODELS:
 		return None
+	return get_model_class(model_name)().model(fine_tuning)
 
 
 def add_model_cmd_arg(parser):
 	parser.add_argument('-m',
 	                    help='choose model to train (vgg, nvidia, resnet, densenet)',
 	                    dest='model',
-	                    choices=['vgg', 'nvidia', 'resnet', 'densenet'],
+	                    choices=list(MODELS.keys()),
 	                    default='nvidia')
 
 
-def load_model(model_name, checkpoint, fine_tuning):
+def get_training_mode(model_name, precision=None, xla=None):
+	"""
+	Returns precision and XLA flag of training of the model, given values override defaults of the architecture
+	"""
+	mode = dict(TRAINING_MODES[model_name])
+	if precision is not None:
+		mode['precision'] = precision
+	if xla is not None:
+		mode['xla'] = xla
+	return mode
+
+
+def configure_training_session(xla):
+	"""
+	Sets session used by keras, with xla the training step is compiled by XLA (just in time)
+	"""
+	import tensorflow as tf
+
+	config = tf.ConfigProto()
+	if xla:
+		config.graph_options.optimizer_options.global_jit_level = tf.OptimizerOptions.ON_1
+	tf.keras.backend.set_session(tf.Session(config=config))
+
+
+def get_training_optimizer(learning_rate, precision):
+	"""
+	Returns Adam optimizer, for float16 precision wrapped by the mixed precision graph rewrite: float16 compute with
+	float32 variables, model output and loss, the loss is scaled dynamically so small gradients do not underflow
+	"""
+	import tensorflow as tf
+
+	optimizer = tf.keras.optimizers.Adam(lr=learning_rate)
+	if precision == 'float16':
+		optimizer = tf.train.experimental.enable_mixed_precision_graph_rewrite(optimizer, loss_scale='dynamic')
+	return optimizer
+
+
+def get_peak_memory_function():
+	"""
+	Returns function reading peak number of bytes allocated on the GPU by the keras session (None without a GPU)
+	"""
+	import tensorflow as tf
+
+	if not tf.test.is_gpu_available():
+		return lambda: None
+	with tf.device('/gpu:0'):
+		max_bytes_in_use = tf.contrib.memory_stats.MaxBytesInUse()
+	session = tf.keras.backend.get_session()
+	return lambda: session.run(max_bytes_in_use)
+
+
+def get_checkpoint_path(model_name, checkpoint):
+	return "trained_models\\{}\\{}-model-{:03d}.h5".format(model_name, model_name, checkpoint)
+
+
+def get_export_directory(model_name, checkpoint):
+	return "trained_models\\{}\\export-{:03d}".format(model_name, checkpoint)
+
+
+def is_complete_model_file(filename):
+	"""
+	Checks if checkpoint contains architecture of the model (with colors normalization, older ones are rebuilt)
+	"""
+	import h5py
+
+	with h5py.File(filename, 'r') as f:
+		config = f.attrs.get('model_config')
+	if config is None:
+		return False
+	if isinstance(config, bytes):
+		config = config.decode('utf-8')
+	return 'NormalizeColors' in config
+
+
+def load_model(model_name, checkpoint, fine_tuning, rebuild=False):
+	"""
+	Loads model saved in checkpoint. Checkpoints with architecture are restored directly (without ImageNet weights),
+	weights only checkpoints or rebuild=True build the model first (fine_tuning sets trainable layers)
+	"""
 	print("Loading model ({})...".format(model_name))
 
+	filename = get_checkpoint_path(model_name, checkpoint)
+	if not rebuild and is_complete_model_file(filename):
+		import tensorflow as tf
+		from neural_networks.NormalizeColorsLayer import NormalizeColors
+
+		return tf.keras.models.load_model(filename, custom_objects={'NormalizeColors': NormalizeColors}, compile=False)
+
+	from neural_networks.ModelBase import ModelBase
+
 	model = get_empty_model(model_name, fine_tuning)
-	model = ModelBase.load_weights(
-		model,
-		"trained_models\\{}\\{}-model-{:03d}.h5"
-			.format(model_name, model_name, checkpoint))
-	return model
\ No newline at end of file
+	model = ModelBase.load_weights(model, filename)
+	return model
+
+
+def get_inference_function(model):
+	"""
+	Returns function running a single forward pass of the model in inference mode.
+	It skips the per call overhead of Model.predict (batching loop, callbacks), which dominates for small batches.
+	"""
+	import tensorflow as tf
+
+	if tf.executing_eagerly():
+		return lambda batch: model(batch, training=False).numpy()
+
+	forward_pass = tf.keras.backend.function(model.inputs, model.outputs)
+	return lambda batch: forward_pass([batch])[0]
+
+
+def load_exported_model(path):
+	"""
+	Returns inference function of a model exported by export_model.py (.tflite file or SavedModel directory)
+	"""
+	print("Loading exported model ({})...".format(path))
+	import tensorflow as tf
+
+	if path.endswith('.tflite'):
+		interpreter = tf.lite.Interpreter(model_path=path)
+		interpreter.allocate_tensors()
+		input_index = interpreter.get_input_details()[0]['index']
+		output_index = interpreter.get_output_details()[0]['index']
+
+		def forward_pass(batch):
+			if tuple(interpreter.get_input_details()[0]['shape']) != batch.shape:
+				interpreter.resize_tensor_input(input_index, batch.shape)
+				interpreter.allocate_tensors()
+			interpreter.set_tensor(input_index, batch)
+			interpreter.invoke()
+			return interpreter.get_tensor(output_index)
+
+		return forward_pass
+
+	predictor = tf.contrib.predictor.from_saved_model(path)
+	return lambda batch: predictor({'image': batch})['control']
@@ -0,0 +1,77 @@
+import argparse
+import logging
+import os
+
+import numpy as np
+import pandas as pd
+
+from config import MEASUREMENTS_CSV_FILENAME, PACKED_FRAMES_FILENAME, PACKED_LABELS_FILENAME
+from data_augmentation import INPUT_SHAPE, load_images, is_sharded, is_packed
+
+# cameras are stored in the same order as returned by load_images
+CAMERAS_COUNT = 3
+
+FORMAT = '%(asctime)-15s : %(message)s'
+
+
+# run: python packed_data.py -d .\out\data -d .\out\validation_data
+
+def pack_directory(directory):
+	"""
+	Converts images and measurements of a single run into:
+		frames.npy - uint8 array (frames count x cameras x height x width x channels)
+		labels.npy - float32 array (frames count x [frame, steering, throttle, brake])
+	Rows of both arrays follow rows of measurements.csv
+	"""
+	measurements = pd.read_csv(os.path.join(directory, MEASUREMENTS_CSV_FILENAME), sep=',', decimal='.',
+	                           usecols=[0, 1, 2, 3], header=None, names=['frame', 'steering', 'throttle', 'brake'])
+
+	frames_file = os.path.join(directory, PACKED_FRAMES_FILENAME)
+	tmp_frames_file = frames_file + '.tmp'
+	frames = np.lib.format.open_memmap(tmp_frames_file, mode='w+', dtype=np.uint8,
+	                                   shape=(len(measurements), CAMERAS_COUNT) + INPUT_SHAPE)
+	for i, frame in enumerate(measurements['frame']):
+		frames[i] = load_images(directory, frame)
+	frames.flush()
+	del frames
+
+	np.save(os.path.join(directory, PACKED_LABELS_FILENAME), measurements.values.astype(np.float32))
+	# frames file is written last, so an interrupted packing is never taken as packed directory
+	os.replace(tmp_frames_file, frames_file)
+	return len(measurements)
+
+
+def pack(directory, force=False):
+	for dir in os.walk(directory):
+		if dir[0] == directory:
+			continue
+
+		if is_sharded(dir[0]):
+			logging.info("{} is recorded into shards, skip".format(dir[0]))
+			continue
+
+		if not force and is_packed(dir[0]):
+			logging.info("{} is already packed, skip".format(dir[0]))
+			continue
+
+		logging.info("Packing {}...".format(dir[0]))
+		count = pack_directory(dir[0])
+		logging.info("Packed {} frames".format(count))
+
+
+def main():
+	parser = argparse.ArgumentParser(description='Packs gathered images into memory mapped arrays')
+	parser.add_argument('-d', '--directory', help='data directory to pack (can be repeated)', action='append',
+	                    dest='directories')
+	parser.add_argument('--force', help='pack again already packed directories', action='store_true')
+	args = parser.parse_args()
+
+	directories = args.directories or [".\\out\\data", ".\\out\\validation_data"]
+	for directory in directories:
+		pack(directory, args.force)
+
+
+if __name__ == '__main__':
+	logging.basicConfig(format=FORMAT)
+	logging.getLogger().setLevel(logging.INFO)
+	main()
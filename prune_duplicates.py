@@ -0,0 +1,134 @@
+"""
+Drops duplicated and nearly duplicated frames of gathered runs (e.g. long straight stretches driven with the same
+steering). Frames are compared by average hashes of their center camera images: a frame is dropped when it is
+identical to a kept frame with the same labels, or when it is in the same steering bucket as the previously kept frame
+and its hash differs in at most max_distance bits. Kept rows are written to kept_frames.npy of the run, which is
+honored by the dataset index (train.py -p true) until measurements.csv of the run changes.
+"""
+import argparse
+import hashlib
+import logging
+import os
+from multiprocessing import Pool
+
+import numpy as np
+
+from batch_sampler import DEFAULT_BUCKET_EDGES, parse_bucket_edges, get_bucket_ids
+from config import CENTER_CAMERA_NAME, LEFT_CAMERA_NAME, RIGHT_CAMERA_NAME
+from data_augmentation import IMAGE_HEIGHT, IMAGE_WIDTH, IMAGE_CHANNELS, load_image, is_sharded, load_shard_images, \
+	open_packed_frames
+from dataset_index import read_labels, list_run_directories, write_kept_frames
+from packed_data import is_packed
+
+# images are averaged in HASH_SIZE x HASH_SIZE blocks, every block gives one bit of the hash
+HASH_SIZE = 8
+MAX_HASH_DISTANCE = 4
+FRAME_BYTES = 3 * IMAGE_HEIGHT * IMAGE_WIDTH * IMAGE_CHANNELS
+
+FORMAT = '%(asctime)-15s : %(message)s'
+
+
+# run: python prune_duplicates.py -d .\out\data -t 4 -j 8
+
+def load_center_images(data_dir, frames):
+	if is_sharded(data_dir):
+		return np.stack([load_shard_images(data_dir, index)[0] for index in range(len(frames))])
+	if is_packed(data_dir):
+		return np.asarray(open_packed_frames(data_dir)[:, 0])
+	return np.stack([load_image(data_dir, CENTER_CAMERA_NAME.format(frame)) for frame in frames])
+
+
+def average_hashes(images):
+	"""
+	Returns 64 bit average hash of every image (bit is set when block of the image is brighter than the image)
+	"""
+	gray = images.mean(axis=3)
+	height, width = gray.shape[1] - gray.shape[1] % HASH_SIZE, gray.shape[2] - gray.shape[2] % HASH_SIZE
+	blocks = gray[:, :height, :width].reshape(
+		len(images), HASH_SIZE, height // HASH_SIZE, HASH_SIZE, width // HASH_SIZE).mean(axis=(2, 4))
+	bits = blocks.reshape(len(images), -1) > blocks.reshape(len(images), -1).mean(axis=1, keepdims=True)
+	return np.packbits(bits, axis=1).view('>u8').ravel()
+
+
+def hash_distance(hash1, hash2):
+	return bin(int(hash1) ^ int(hash2)).count('1')
+
+
+def select_kept_frames(images, labels, bucket_edges, max_distance):
+	"""
+	Returns indices of kept frames
+	"""
+	hashes = average_hashes(images)
+	buckets = get_bucket_ids(labels['steering'].values, bucket_edges)
+	label_values = labels[['steering', 'throttle', 'brake']].values
+
+	kept = []
+	seen = set()
+	for i in range(len(images)):
+		# identical image with identical labels does not add anything (lossless)
+		digest = (hashlib.blake2b(images[i].tobytes(), digest_size=16).digest(), label_values[i].tobytes())
+		if digest in seen:
+			continue
+		seen.add(digest)
+
+		if len(kept) > 0:
+			last = kept[-1]
+			if buckets[i] == buckets[last] and hash_distance(hashes[i], hashes[last]) <= max_distance:
+				continue
+		kept.append(i)
+	return np.array(kept, dtype=np.int64)
+
+
+def get_frame_storage(data_dir, frame):
+	if is_sharded(data_dir) or is_packed(data_dir):
+		return FRAME_BYTES
+	return sum(os.path.getsize(os.path.join(data_dir, name.format(frame)))
+	           for name in [CENTER_CAMERA_NAME, LEFT_CAMERA_NAME, RIGHT_CAMERA_NAME])
+
+
+def prune_directory(job):
+	data_dir, bucket_edges, max_distance, dry_run = job
+	labels = read_labels(data_dir)
+	kept = select_kept_frames(load_center_images(data_dir, labels['frame'].values), labels, bucket_edges, max_distance)
+
+	dropped = np.setdiff1d(np.arange(len(labels)), kept)
+	saved_bytes = sum(get_frame_storage(data_dir, frame) for frame in labels['frame'].values[dropped])
+	if not dry_run:
+		write_kept_frames(data_dir, kept, len(labels))
+	return data_dir, len(labels), len(kept), saved_bytes
+
+
+def prune(directory, bucket_edges=DEFAULT_BUCKET_EDGES, max_distance=MAX_HASH_DISTANCE, processes=None, dry_run=False):
+	jobs = [(data_dir, bucket_edges, max_distance, dry_run) for data_dir in list_run_directories(directory)]
+	total_frames, total_kept, total_saved = 0, 0, 0
+	with Pool(processes) as pool:
+		for data_dir, frames, kept, saved_bytes in pool.imap(prune_directory, jobs):
+			logging.info("{}: kept {}/{} frames, {:.1f} MB".format(data_dir, kept, frames, saved_bytes / 2 ** 20))
+			total_frames += frames
+			total_kept += kept
+			total_saved += saved_bytes
+
+	print("Kept frames: {}/{} ({:.2f}%)".format(total_kept, total_frames, total_kept / max(total_frames, 1) * 100.0))
+	print("Storage of dropped frames: {:.1f} MB".format(total_saved / 2 ** 20))
+
+
+def main():
+	parser = argparse.ArgumentParser(description='Drops duplicated and nearly duplicated frames of gathered data')
+	parser.add_argument('-d', '--directory', help='data directory to prune (can be repeated)', action='append',
+	                    dest='directories')
+	parser.add_argument('-t', '--max-distance', help='maximal number of different bits of hashes of near duplicates',
+	                    type=int, default=MAX_HASH_DISTANCE)
+	parser.add_argument('--bucket-edges', help='comma separated steering bucket edges (e.g. --bucket-edges=-0.05,0.05)',
+	                    type=parse_bucket_edges, default=DEFAULT_BUCKET_EDGES)
+	parser.add_argument('-j', '--processes', help='number of processes', type=int, default=None)
+	parser.add_argument('--dry-run', help='only report, do not write kept frames', action='store_true')
+	args = parser.parse_args()
+
+	for directory in args.directories or [".\\out\\data"]:
+		prune(directory, args.bucket_edges, args.max_distance, args.processes, args.dry_run)
+
+
+if __name__ == '__main__':
+	logging.basicConfig(format=FORMAT)
+	logging.getLogger().setLevel(logging.INFO)
+	main()
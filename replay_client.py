@@ -0,0 +1,135 @@
+"""
+Stand-in of the CARLA client replaying frames recorded in a data directory (or synthetic frames) without a server.
+"""
+import math
+import os
+import time
+from contextlib import contextmanager
+
+import numpy as np
+import pandas as pd
+import cv2
+
+from config import MEASUREMENTS_CSV_FILENAME
+from data_augmentation import load_images, INPUT_SHAPE, is_sharded, load_shard_images
+
+# size of frames rendered by cameras of the simulator
+FRAME_HEIGHT, FRAME_WIDTH = 600, 800
+# rows of the frame kept by data_augmentation.crop
+CROP_TOP, CROP_BOTTOM = 300, 50
+
+# replayed car drives a circle with constant speed, so every lap ends like a real one
+LAP_RADIUS = 50.0
+REPLAY_SPEED = 20.0 / 3.6  # m/s
+
+
+class ReplayData(object):
+	def __init__(self, **kwargs):
+		self.__dict__.update(kwargs)
+
+
+class ReplayClient(object):
+	"""
+	Implements part of carla.client.CarlaClient used by drive.py and gathering scripts
+	"""
+
+	def __init__(self, directory=None, rate=0.0, synthetic_frames=100):
+		self._rate = rate
+		self._frames = load_replay_frames(directory) if directory else generate_synthetic_frames(synthetic_frames)
+		self._controls = load_replay_controls(directory, len(self._frames))
+		self._camera_names = []
+		self._step = 0
+		self._last_read = None
+		self.last_control = None
+		# seconds the last read_data spent placing replayed images into frames of simulator size (work of the replay
+		# only, benchmark_drive.py does not count it as reading)
+		self.replay_seconds = 0.0
+
+	def connect(self):
+		pass
+
+	def disconnect(self):
+		pass
+
+	def load_settings(self, carla_settings):
+		sensors = getattr(carla_settings, '_sensors', [])
+		self._camera_names = [sensor.SensorName for sensor in sensors] or ['MainCamera']
+		return ReplayData(player_start_spots=[None])
+
+	def start_episode(self, player_start_index):
+		self._step = 0
+
+	def read_data(self):
+		if self._rate > 0 and self._last_read is not None:
+			time.sleep(max(0.0, 1.0 / self._rate - (time.time() - self._last_read)))
+		self._last_read = time.time()
+
+		index = self._step % len(self._frames)
+		angle = 2 * math.pi * self._step / len(self._frames)
+		self._step += 1
+
+		steer, throttle, brake = self._controls[index]
+		player_measurements = ReplayData(
+			transform=ReplayData(location=ReplayData(x=LAP_RADIUS * math.cos(angle), y=LAP_RADIUS * math.sin(angle), z=0.0)),
+			forward_speed=REPLAY_SPEED,
+			autopilot_control=ReplayData(steer=steer, throttle=throttle, brake=brake),
+			intersection_otherlane=0.0,
+			intersection_offroad=0.0)
+		measurements = ReplayData(player_measurements=player_measurements, frame_number=self._step)
+		replay_start = time.time()
+		sensor_data = {name: ReplayData(data=to_full_frame(self._frames[index][camera_index(name)]))
+		               for name in self._camera_names}
+		self.replay_seconds = time.time() - replay_start
+		return measurements, sensor_data
+
+	def send_control(self, *args, **kwargs):
+		self.last_control = args[0] if len(args) == 1 else kwargs
+
+
+@contextmanager
+def make_replay_client(directory=None, rate=0.0, synthetic_frames=100):
+	client = ReplayClient(directory, rate, synthetic_frames)
+	client.connect()
+	try:
+		yield client
+	finally:
+		client.disconnect()
+
+
+def camera_index(name):
+	"""
+	Index of camera in frames returned by load_images (center, left, right)
+	"""
+	if name.endswith('_L'):
+		return 1
+	if name.endswith('_R'):
+		return 2
+	return 0
+
+
+def to_full_frame(image):
+	"""
+	Places preprocessed image back into a frame of simulator size, so preprocessing works as with the simulator
+	"""
+	frame = np.zeros((FRAME_HEIGHT, FRAME_WIDTH, 3), dtype=np.uint8)
+	frame[CROP_TOP:-CROP_BOTTOM] = cv2.resize(image, (FRAME_WIDTH, FRAME_HEIGHT - CROP_TOP - CROP_BOTTOM))
+	return frame
+
+
+def load_replay_frames(directory):
+	measurements = pd.read_csv(os.path.join(directory, MEASUREMENTS_CSV_FILENAME), usecols=[0], header=None)
+	if is_sharded(directory):
+		return [load_shard_images(directory, index) for index in range(len(measurements))]
+	return [load_images(directory, frame) for frame in measurements[0]]
+
+
+def load_replay_controls(directory, count):
+	if not directory:
+		return [(0.0, 0.5, 0.0)] * count
+	measurements = pd.read_csv(os.path.join(directory, MEASUREMENTS_CSV_FILENAME), usecols=[1, 2, 3], header=None)
+	return [tuple(row) for row in measurements.values]
+
+
+def generate_synthetic_frames(count):
+	random_state = np.random.RandomState(0)
+	return [[random_state.randint(0, 256, INPUT_SHAPE, dtype=np.uint8)] * 3 for _ in range(count)]
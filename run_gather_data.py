@@ -1,11 +1,20 @@
-# Script is designed to run gathering data for every map and every weather preset
-import subprocess
-import psutil
+# Script is designed to run gathering data for every map and every weather preset on several Carla servers at once
+import argparse
+import csv
 import logging
 import os
+import shlex
+import shutil
+import subprocess
+import sys
+import threading
+import time
+from collections import namedtuple
 from datetime import datetime
 
-logging.basicConfig(level=10, filename="gathering_data.log")
+import psutil
+
+from config import MEASUREMENTS_CSV_FILENAME, CONNECTION_ERROR_EXIT_CODE
 
 weather_presets = {
 	0: 'Default',
@@ -32,47 +41,260 @@ autopilot_maps = [
 	'/Game/Maps/Town03'
 ]
 
+CARLA_CONFIG_FILE = 'C:\\Carla\\builds\\build3\\WindowsNoEditor\\CarlaSettings.ini'
+CARLA_SERVER_FILE = 'C:\\Carla\\builds\\build6\\WindowsNoEditor\\CarlaUE4.exe'
+# {map} and {port} are replaced for every server
+SERVER_COMMAND = CARLA_SERVER_FILE + ' {map} -carla-settings=' + CARLA_CONFIG_FILE + \
+                 ' -ResX=800 -ResY=600 -windowed -carla-server -carla-port={port}'
+GATHER_DATA_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'gather_data.py')
+# Carla server listens on three consecutive ports
+PORTS_PER_SERVER = 3
+JOBS_LOG_COLUMNS = ['map', 'weather', 'start_spot', 'port', 'attempt', 'exit_code', 'frames', 'seconds',
+                    'frames_per_second', 'out_directory']
+
+GatheringJob = namedtuple('GatheringJob', ['map', 'weather', 'start_spot'])
+
+
+# run: python run_gather_data.py -k 3 -f 1000 --weathers 0 1 2 3
+
+def log(msg):
+	logging.debug("[{}] {}".format(datetime.now().strftime('%Y-%m-%d %H:%M:%S'), msg))
+
 
-def kill_carla_processes():
-	for proc in psutil.process_iter():
+def split_command(command):
+	return command if os.name == 'nt' else shlex.split(command)
+
+
+def kill_process_tree(process):
+	try:
+		parent = psutil.Process(process.pid)
+		processes = parent.children(recursive=True) + [parent]
+	except psutil.NoSuchProcess:
+		return
+	for proc in processes:
 		try:
-			pinfo = proc.as_dict(attrs=['pid', 'name'])
+			proc.terminate()
 		except psutil.NoSuchProcess:
 			pass
-		else:
-			if (pinfo['name'] == "CarlaUE4.exe"):
-				print(pinfo)
-				proc.terminate()
+	psutil.wait_procs(processes, timeout=10)
 
 
-def log(msg):
-	logging.debug("[{}] {}".format(datetime.now().strftime('%Y-%m-%d %H:%M:%S'), msg))
+class JobQueue(object):
+	"""
+	Jobs waiting for a server, servers take jobs of the map they have already loaded first
+	"""
 
+	def __init__(self, jobs):
+		self._jobs = list(jobs)
+		self._lock = threading.Lock()
 
-if __name__ == '__main__':
+	def take(self, map_name):
+		with self._lock:
+			if len(self._jobs) == 0:
+				return None
+			same_map = [i for i, job in enumerate(self._jobs) if job.map == map_name]
+			return self._jobs.pop(same_map[0] if same_map else 0)
+
+	def put(self, job):
+		with self._lock:
+			self._jobs.append(job)
+
+
+class SimulatorServer(object):
+	def __init__(self, command, port, startup_seconds):
+		self.port = port
+		self.map = None
+		self._command = command
+		self._startup_seconds = startup_seconds
+		self._process = None
+
+	def start(self, map_name):
+		self.stop()
+		self.map = map_name
+		if not self._command:
+			return
+		log("Start server (port: {}, map: {})".format(self.port, map_name))
+		self._process = subprocess.Popen(split_command(self._command.format(map=map_name, port=self.port)))
+		time.sleep(self._startup_seconds)
+
+	def stop(self):
+		if self._process is not None:
+			log("Stop server (port: {}, map: {})".format(self.port, self.map))
+			kill_process_tree(self._process)
+			self._process = None
+		self.map = None
+
+
+class GatheringOrchestrator(object):
+	"""
+	Runs gather_data.py jobs on servers working in parallel, every server is used by one job at a time.
+	Failed job (e.g. server did not accept connections) is retried after restart of the server.
+	"""
+
+	def __init__(self, args, jobs):
+		self._args = args
+		self._queue = JobQueue(jobs)
+		self._attempts = {}
+		self._lock = threading.Lock()
+		self.results = []
+
+	def run(self):
+		servers = [SimulatorServer(self._args.server_command, self._args.base_port + i * PORTS_PER_SERVER,
+		                           self._args.server_startup) for i in range(self._args.servers)]
+		threads = [threading.Thread(target=self._serve, args=(server,), name='server-{}'.format(server.port))
+		           for server in servers]
+		for thread in threads:
+			thread.start()
+		for thread in threads:
+			thread.join()
+		return self.results
+
+	def _serve(self, server):
+		try:
+			while True:
+				job = self._queue.take(server.map)
+				if job is None:
+					return
+				if server.map != job.map:
+					server.start(job.map)
+
+				result = self._run_job(job, server.port)
+				if result['exit_code'] != 0:
+					# server could be broken, the job goes back to the queue and the server is started again
+					server.stop()
+					if result['attempt'] < self._args.job_retries:
+						self._queue.put(job)
+		finally:
+			server.stop()
+
+	def _run_job(self, job, port):
+		with self._lock:
+			attempt = self._attempts.get(job, 0)
+			self._attempts[job] = attempt + 1
+
+		map_name = job.map.split('/')[-1]
+		start_spot = job.start_spot if job.start_spot >= 0 else 'random'
+		out_directory = os.path.join(self._args.out_directory, '{}-{}-w{}-s{}-{}'.format(
+			datetime.now().strftime("%Y%m%d%H%M%S"), map_name, job.weather, start_spot, attempt))
+		command = [sys.executable, self._args.gather_script,
+		           '-f', str(self._args.frames),
+		           '-s', str(self._args.skip_frames),
+		           '-w', str(job.weather),
+		           '-t', map_name,
+		           '-p', str(port),
+		           '--start-spot', str(job.start_spot),
+		           '--connection-retries', str(self._args.connection_retries),
+		           '-o', out_directory,
+		           '-v'] + shlex.split(self._args.gather_args, posix=(os.name != 'nt'))
+
+		log("Start job: map: {}; weather: {}; start spot: {}; port: {}; attempt: {}".format(
+			map_name, weather_presets.get(job.weather, job.weather), job.start_spot, port, attempt))
+		start = time.time()
+		try:
+			exit_code = subprocess.call(command, timeout=self._args.job_timeout or None)
+		except subprocess.TimeoutExpired:
+			exit_code = -1
+		seconds = time.time() - start
+
+		frames = count_frames(out_directory)
+		if exit_code != 0:
+			out_directory = self._quarantine(out_directory)
+		result = {
+			'map': map_name,
+			'weather': job.weather,
+			'start_spot': job.start_spot,
+			'port': port,
+			'attempt': attempt,
+			'exit_code': exit_code,
+			'frames': frames,
+			'seconds': round(seconds, 2),
+			'frames_per_second': round(frames / seconds, 2) if seconds > 0 else 0.0,
+			'out_directory': out_directory
+		}
+		if exit_code == CONNECTION_ERROR_EXIT_CODE:
+			log("Job could not connect to the server (port: {})".format(port))
+		log("Finished job: {}".format(result))
+		with self._lock:
+			self.results.append(result)
+			write_job_result(self._args.jobs_log, result)
+		return result
+
+	def _quarantine(self, out_directory):
+		"""
+		Moves data of a failed job out of the data directory (it is removed when there is no failed directory),
+		so partial runs are never indexed or trained on. Returns the new directory (empty when removed).
+		"""
+		if not os.path.exists(out_directory):
+			return ''
+		if not self._args.failed_directory:
+			shutil.rmtree(out_directory, ignore_errors=True)
+			return ''
+		os.makedirs(self._args.failed_directory, exist_ok=True)
+		failed_directory = os.path.join(self._args.failed_directory, os.path.basename(out_directory))
+		shutil.move(out_directory, failed_directory)
+		return failed_directory
+
+
+def count_frames(out_directory):
+	measurements_file = os.path.join(out_directory, MEASUREMENTS_CSV_FILENAME)
+	if not os.path.exists(measurements_file):
+		return 0
+	with open(measurements_file) as f:
+		return sum(1 for _ in f)
+
+
+def write_job_result(filename, result):
+	write_header = not os.path.exists(filename)
+	with open(filename, 'a', newline='') as f:
+		writer = csv.DictWriter(f, fieldnames=JOBS_LOG_COLUMNS)
+		if write_header:
+			writer.writeheader()
+		writer.writerow(result)
+
+
+def print_summary(results):
+	finished = [result for result in results if result['exit_code'] == 0]
+	failed = len(set((r['map'], r['weather'], r['start_spot']) for r in results if r['exit_code'] != 0) -
+	             set((r['map'], r['weather'], r['start_spot']) for r in finished))
+	frames = sum(result['frames'] for result in finished)
+	seconds = sum(result['seconds'] for result in finished)
+	print("Finished jobs: {}; failed jobs: {}; attempts: {}".format(len(finished), failed, len(results)))
+	print("Frames: {}; average job throughput: {:.2f} frames/s".format(frames, frames / seconds if seconds > 0 else 0))
+
+
+def main():
+	parser = argparse.ArgumentParser(description='Gathers data for every map, weather and start spot on many servers')
+	parser.add_argument('-k', '--servers', type=int, default=2, help='number of servers running at once')
+	parser.add_argument('--base-port', type=int, default=2000, help='port of the first server')
+	parser.add_argument('--maps', nargs='+', default=autopilot_maps)
+	parser.add_argument('--weathers', nargs='+', type=int, default=sorted(weather_presets.keys()))
+	parser.add_argument('--start-spots', nargs='+', type=int, default=[-1], help='player start spots (-1 - random)')
+	parser.add_argument('-f', '--frames', type=int, default=1000, help='number of frames saved by every job')
+	parser.add_argument('-s', '--skip-frames', type=int, default=10)
+	parser.add_argument('--server-command', default=SERVER_COMMAND,
+	                    help='command starting a server with {map} and {port} ("" - servers are already running)')
+	parser.add_argument('--server-startup', type=float, default=20.0, help='seconds to wait for a started server')
+	parser.add_argument('--gather-script', default=GATHER_DATA_FILE)
+	parser.add_argument('--gather-args', default='', help='additional arguments of gather_data.py')
+	parser.add_argument('--job-retries', type=int, default=2, help='number of retries of a failed job')
+	parser.add_argument('--connection-retries', type=int, default=10,
+	                    help='number of failed connections after which the job fails')
+	parser.add_argument('--job-timeout', type=float, default=0, help='seconds after which the job fails (0 - none)')
+	parser.add_argument('-o', '--out-directory', default='.\\out\\data')
+	parser.add_argument('--failed-directory', default='.\\out\\failed_data',
+	                    help='directory data of failed jobs are moved to (empty - data are removed)')
+	parser.add_argument('--jobs-log', default='gathering_jobs.csv', help='csv file with results of every job')
+	args = parser.parse_args()
+
+	logging.basicConfig(level=10, filename="gathering_data.log")
 	log("Start gathering data...")
+	log("frames_count: {}; servers: {}; server command: {};".format(args.frames, args.servers, args.server_command))
+
+	jobs = [GatheringJob(map_name, weather, start_spot)
+	        for map_name in args.maps for weather in args.weathers for start_spot in args.start_spots]
+	results = GatheringOrchestrator(args, jobs).run()
+	print_summary(results)
 
-	frames_count = 1000
-	config_file = 'C:\\Carla\\builds\\build3\\WindowsNoEditor\\CarlaSettings.ini'
-	carla_server_file = 'C:\\Carla\\builds\\build6\\WindowsNoEditor\\CarlaUE4.exe'
-	gather_data_file = "C:\\Users\\Adam\\Documents\\Materialy_pw\\PW\\Magisterka\\AutonomousCarProject\\gather_data.py"
-
-	log("frames_count: {}; config file: {}; carla file: {};".format(frames_count, config_file, carla_server_file))
-
-	for autopilot_map in autopilot_maps:
-		log("Start gathering data map: {}".format(autopilot_map))
-		log("Create carla process...")
-		carla_pid = subprocess.Popen(
-			[carla_server_file, autopilot_map, "-carla-settings=" + config_file, "-ResX=800", "-ResY=600", "-windowed", "-carla-server"])
-
-		for weather in range(0, 15):
-			log("Start gathering data map: {}; weather: {}".format(autopilot_map, weather_presets[weather]))
-			# parameters = "-f {} -w {} -v".format(frames_count, weather)
-			data_pid = subprocess.Popen(
-				["python", gather_data_file, "-f", str(frames_count), "-w", str(weather), "-v", "-s", "10"])
-			# os.system("gather_data.py {}".format(parameters))
-			data_pid.wait()
-			log("Finished gathering data...")
-
-		log("Kill carla processes...")
-		kill_carla_processes()
+
+if __name__ == '__main__':
+	main()
@@ -3,9 +3,9 @@ from datetime import datetime
 import pandas as pd
 import matplotlib.pyplot as plt
 import logging
-from fastdtw import fastdtw
-from scipy.spatial.distance import euclidean
 import numpy as np
+from dtw_distance import dtw
+from lap_deviation import RacingLineIndex, deviation_metrics, CORRIDOR_TOLERANCE
 
 out_run_folder = 'out\\map_points\\autonomous_runs\\'
 reference_dir = 'out\\map_points\\reference\\'
@@ -13,21 +13,48 @@ run_csv_name = 'run.csv'
 run_image_name = '{}.png'
 result_name = 'result.txt'
 
+# reference racing lines with their spatial indexes, loaded once per map
+_references = {}
 
-def evaluate_run(run_dir, map_name, velocities, model_name='', checkpoint=0, weather=0):
-	reference_csv = reference_dir + '{}\\{}.csv'.format(map_name, map_name)
-	reference_points = pd.read_csv(reference_csv, dtype={'x': float, 'y': float})
 
-	run_csv = os.path.join(run_dir, run_csv_name)
-	run_points = pd.read_csv(run_csv, dtype={'x': float, 'y': float})
+def load_points(csv_file):
+	points = pd.read_csv(csv_file, dtype={'x': float, 'y': float})
+	return np.column_stack((points['x'], points['y']))
+
+
+def load_reference(map_name):
+	reference = _references.get(map_name)
+	if reference is None:
+		reference_points = load_points(reference_dir + '{}\\{}.csv'.format(map_name, map_name))
+		reference = (reference_points, RacingLineIndex(reference_points))
+		_references[map_name] = reference
+	return reference
+
 
-	stacked_reference = np.column_stack((reference_points['x'], reference_points['y']))
-	stacked_run = np.column_stack((run_points['x'], run_points['y']))
+def score_run(run_dir, map_name):
+	"""
+	Returns DTW distance and cross-track error metrics of the run against the reference racing line of the map
+	"""
+	stacked_reference, reference_index = load_reference(map_name)
+	stacked_run = load_points(os.path.join(run_dir, run_csv_name))
 
-	dist = compare(stacked_reference, stacked_run)
+	scores = {'dtw': compare(stacked_reference, stacked_run), 'points': len(stacked_run)}
+	scores.update(deviation_metrics(reference_index.cross_track_errors(stacked_run)))
+	return scores
+
+
+def evaluate_run(run_dir, map_name, velocities, model_name='', checkpoint=0, weather=0):
+	scores = score_run(run_dir, map_name)
+	dist = scores['dtw']
 	avg_speed = np.average(velocities)
 	f = open(os.path.join(run_dir, result_name), 'w')
 	f.write('Run results\n==============\nmodel: {} epoch: {} weather: {}\nResult:{}\nAvg speed: {:.2f}km/h'.format(model_name, checkpoint, weather, dist, avg_speed))
+	f.write('\nCross-track error: mean {:.3f}m, max {:.3f}m, p95 {:.3f}m\nOutside corridor ({:.1f}m): {:.2f}%'.format(
+		scores['mean_deviation'],
+		scores['max_deviation'],
+		scores['p95_deviation'],
+		CORRIDOR_TOLERANCE,
+		scores['outside_corridor']))
 	f.close()
 
 	if model_name == '' or checkpoint == 0:
@@ -36,7 +63,7 @@ def evaluate_run(run_dir, map_name, velocities, model_name='', checkpoint=0, wea
 
 def compare(line1, line2):
 	logging.info('Start DTW algorithm...')
-	distance, _ = fastdtw(line1, line2, dist=euclidean, radius=10)
+	distance, _ = dtw(line1, line2, radius=10)
 	logging.info('DTW algorithm finished. Final score: {}'.format(distance))
 	return distance
 
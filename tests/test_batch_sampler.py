@@ -0,0 +1,34 @@
+import numpy as np
+import pytest
+
+from batch_sampler import BalancedBatchSampler, get_bucket_ids, parse_bucket_edges, DEFAULT_BUCKET_EDGES
+
+# run: python -m pytest tests/test_batch_sampler.py
+
+
+def test_default_buckets_match_left_center_right_turns():
+	steerings = [-0.5, -0.05, -0.049, 0.0, 0.049, 0.05, 0.5]
+
+	assert list(get_bucket_ids(steerings, DEFAULT_BUCKET_EDGES)) == [0, 0, 1, 1, 1, 2, 2]
+
+
+def test_batches_are_balanced():
+	steerings = np.concatenate([np.full(10, -0.3), np.full(100, 0.0), np.full(20, 0.3)])
+	sampler = BalancedBatchSampler(steerings, 30, seed=1)
+
+	for batch in range(len(sampler)):
+		indices = sampler.batch_indices(batch)
+		assert len(indices) == 30
+		assert list(np.bincount(get_bucket_ids(steerings[indices], DEFAULT_BUCKET_EDGES))) == [10, 10, 10]
+
+
+def test_unsorted_edges_are_rejected():
+	with pytest.raises(ValueError):
+		parse_bucket_edges('0.05,-0.05')
+	with pytest.raises(ValueError):
+		BalancedBatchSampler([0.0, 0.1], 4, bucket_edges=[0.1, 0.1])
+
+
+def test_batch_smaller_than_buckets_is_rejected():
+	with pytest.raises(ValueError):
+		BalancedBatchSampler([-0.3, 0.0, 0.3], 2)
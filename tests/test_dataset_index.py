@@ -0,0 +1,30 @@
+import os
+
+import numpy as np
+
+from config import MEASUREMENTS_CSV_FILENAME
+from dataset_index import read_kept_frames, write_kept_frames
+
+# run: python -m pytest tests/test_dataset_index.py
+
+
+def write_measurements(directory, rows):
+	with open(os.path.join(str(directory), MEASUREMENTS_CSV_FILENAME), 'w') as f:
+		for frame in range(rows):
+			f.write('{},0.0,0.5,0.0\n'.format(frame))
+
+
+def test_kept_frames_of_pruned_run(tmpdir):
+	write_measurements(tmpdir, 4)
+	write_kept_frames(str(tmpdir), np.array([0, 2]), 4)
+
+	assert list(read_kept_frames(str(tmpdir), 4)) == [True, False, True, False]
+
+
+def test_stale_kept_frames_are_ignored(tmpdir):
+	write_measurements(tmpdir, 4)
+	write_kept_frames(str(tmpdir), np.array([0, 3]), 4)
+	write_measurements(tmpdir, 2)
+	os.utime(os.path.join(str(tmpdir), MEASUREMENTS_CSV_FILENAME), (0, 0))
+
+	assert list(read_kept_frames(str(tmpdir), 2)) == [True, True]
@@ -0,0 +1,108 @@
+import glob
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from dtw_distance import dtw
+
+fastdtw = pytest.importorskip('fastdtw')
+
+# run: python -m pytest tests/test_dtw_distance.py
+
+REPOSITORY_DIRECTORY = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# recorded runs and reference racing lines (see common.py), compared when they are present
+RECORDED_RUNS = sorted(glob.glob(os.path.join(REPOSITORY_DIRECTORY, 'out', 'map_points', 'autonomous_runs', '*', '*',
+                                              '*', 'run.csv')))
+REFERENCE_LINES = sorted(glob.glob(os.path.join(REPOSITORY_DIRECTORY, 'out', 'map_points', 'reference', '*', '*.csv')))
+# points of a recorded lap compared with the pure python fastdtw
+LAP_POINTS = 600
+SEEDS = [0, 1, 2]
+
+
+def euclidean(a, b):
+	return np.linalg.norm(a - b)
+
+
+def random_walk(seed, length):
+	random_state = np.random.RandomState(seed)
+	return np.cumsum(random_state.normal(size=(length, 2)), axis=0)
+
+
+def generated_lap(seed, points, noise=0.5):
+	"""
+	Lap around an oval track driven with varying speed and with a noisy position, similar to a recorded run
+	"""
+	random_state = np.random.RandomState(seed)
+	speed = 1.0 + 0.5 * np.sin(np.linspace(0, 6 * np.pi, points)) + random_state.uniform(0, 0.2, points)
+	angles = 2 * np.pi * np.cumsum(speed) / np.sum(speed)
+	lap = np.column_stack((120.0 * np.cos(angles), 60.0 * np.sin(angles)))
+	return lap + random_state.normal(scale=noise, size=lap.shape)
+
+
+def load_lap(csv_file):
+	points = pd.read_csv(csv_file, dtype={'x': float, 'y': float})
+	return np.column_stack((points['x'], points['y']))[:LAP_POINTS]
+
+
+def assert_same(result, expected):
+	distance, path = result
+	expected_distance, expected_path = expected
+	assert distance == pytest.approx(expected_distance, rel=1e-9)
+	assert [tuple(int(i) for i in step) for step in path] == [tuple(step) for step in expected_path]
+
+
+@pytest.mark.parametrize('seed', SEEDS)
+@pytest.mark.parametrize('lengths', [(1, 1), (1, 7), (12, 5), (50, 50), (90, 130)])
+def test_exact_matches_fastdtw_dtw(seed, lengths):
+	line1, line2 = random_walk(seed, lengths[0]), random_walk(seed + 100, lengths[1])
+
+	assert_same(dtw(line1, line2, mode='exact'), fastdtw.dtw(line1, line2, dist=euclidean))
+
+
+@pytest.mark.parametrize('seed', SEEDS)
+@pytest.mark.parametrize('radius', [1, 3, 10])
+@pytest.mark.parametrize('lengths', [(5, 9), (64, 64), (201, 150), (333, 400)])
+def test_fast_matches_fastdtw(seed, radius, lengths):
+	line1, line2 = random_walk(seed, lengths[0]), random_walk(seed + 100, lengths[1])
+
+	assert_same(dtw(line1, line2, mode='fast', radius=radius),
+	            fastdtw.fastdtw(line1, line2, radius=radius, dist=euclidean))
+
+
+def test_one_dimensional_lines():
+	random_state = np.random.RandomState(3)
+	line1, line2 = random_state.normal(size=80), random_state.normal(size=60)
+
+	assert_same(dtw(line1, line2, mode='fast', radius=2), fastdtw.fastdtw(line1, line2, radius=2, dist=euclidean))
+
+
+@pytest.mark.parametrize('seed', SEEDS)
+def test_sakoe_chiba_is_bounded_by_exact(seed):
+	line1, line2 = random_walk(seed, 120), random_walk(seed + 100, 90)
+	exact_distance, exact_path = dtw(line1, line2, mode='exact')
+
+	distance, path = dtw(line1, line2, mode='sakoe_chiba', radius=5)
+	assert distance >= exact_distance - 1e-9
+	assert path[0] == (0, 0) and path[-1] == (len(line1) - 1, len(line2) - 1)
+	assert_same(dtw(line1, line2, mode='sakoe_chiba', radius=len(line2)), (exact_distance, exact_path))
+
+
+def test_unknown_mode():
+	with pytest.raises(ValueError):
+		dtw([[0, 0]], [[0, 0]], mode='slow')
+
+
+@pytest.mark.parametrize('seed', SEEDS)
+def test_lap_matches_fastdtw(seed):
+	reference, run = generated_lap(seed, 500, noise=0.0), generated_lap(seed + 100, 440)
+
+	assert_same(dtw(reference, run, radius=10), fastdtw.fastdtw(reference, run, radius=10, dist=euclidean))
+
+
+@pytest.mark.skipif(not RECORDED_RUNS or not REFERENCE_LINES, reason='no recorded run in out/map_points')
+def test_recorded_lap_matches_fastdtw():
+	reference, run = load_lap(REFERENCE_LINES[0]), load_lap(RECORDED_RUNS[0])
+
+	assert_same(dtw(reference, run, radius=10), fastdtw.fastdtw(reference, run, radius=10, dist=euclidean))
@@ -0,0 +1,30 @@
+import os
+
+import numpy as np
+
+import data_augmentation
+from config import MEASUREMENTS_CSV_FILENAME, PACKED_FRAMES_FILENAME, PACKED_LABELS_FILENAME, FRAME_CACHE_DIRECTORY
+from data_augmentation import INPUT_SHAPE, load_cached_images
+from frame_cache import build_cache
+
+# run: python -m pytest tests/test_frame_cache.py
+
+
+def make_packed_run(directory):
+	with open(os.path.join(str(directory), MEASUREMENTS_CSV_FILENAME), 'w') as f:
+		f.write('frame,steering\n0,0.0\n')
+	frames = np.arange(3 * np.prod(INPUT_SHAPE), dtype=np.uint8).reshape((1, 3) + INPUT_SHAPE)
+	np.save(os.path.join(str(directory), PACKED_FRAMES_FILENAME), frames)
+	np.save(os.path.join(str(directory), PACKED_LABELS_FILENAME), np.zeros((1, 2), dtype=np.float32))
+	return frames
+
+
+def test_identity_spec_reuses_packed_frames(tmpdir, monkeypatch):
+	monkeypatch.setattr(data_augmentation, '_cached_frames', {})
+	frames = make_packed_run(tmpdir)
+
+	assert build_cache((str(tmpdir), INPUT_SHAPE, False)) == (str(tmpdir), 0, str(tmpdir))
+	assert not os.path.exists(os.path.join(str(tmpdir), FRAME_CACHE_DIRECTORY))
+	center, left, right = load_cached_images(str(tmpdir), 0)
+	assert np.array_equal(center, frames[0, 0])
+	assert np.array_equal(right, frames[0, 2])
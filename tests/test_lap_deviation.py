@@ -0,0 +1,18 @@
+import numpy as np
+
+from lap_deviation import RacingLineIndex
+
+# run: python -m pytest tests/test_lap_deviation.py
+
+
+def test_closing_segment_of_the_lap():
+	index = RacingLineIndex([[0.0, 0.0], [10.0, 0.0], [10.0, 10.0], [0.0, 10.0]])
+
+	assert np.allclose(index.cross_track_errors([[-1.0, 5.0], [5.0, 1.0]]), [1.0, 1.0])
+
+
+def test_long_segment_next_to_dense_points():
+	points = [[x, 0.0] for x in np.linspace(0.0, 1.0, 11)] + [[50.0, 0.0], [50.0, 5.0], [0.0, 5.0]]
+	index = RacingLineIndex(points)
+
+	assert np.allclose(index.cross_track_errors([[25.0, 4.0], [25.0, 1.0]]), [1.0, 1.0])
@@ -0,0 +1,171 @@
+import argparse
+import csv
+import os
+import socket
+import sys
+
+from config import CONNECTION_ERROR_EXIT_CODE, MEASUREMENTS_CSV_FILENAME
+from run_gather_data import GatheringJob, GatheringOrchestrator, JobQueue, JOBS_LOG_COLUMNS
+
+# run: python -m pytest tests/test_run_gather_data.py
+
+# accepts connections on the port until it is killed, every start is logged with its map
+DUMMY_SERVER = '''
+import argparse
+import socket
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--port', type=int)
+parser.add_argument('--map')
+parser.add_argument('--log')
+args = parser.parse_args()
+with open(args.log, 'a') as f:
+	f.write('{} {}\\n'.format(args.port, args.map))
+server = socket.socket()
+server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+server.bind(('127.0.0.1', args.port))
+server.listen(5)
+while True:
+	connection, _ = server.accept()
+	connection.close()
+'''
+
+# stand-in of gather_data.py: the first attempt of a job started with --fail-first fails to connect and leaves
+# partial data, other attempts connect to the server and save requested frames
+DUMMY_GATHER = '''
+import argparse
+import os
+import socket
+import sys
+import time
+
+parser = argparse.ArgumentParser()
+parser.add_argument('-f', '--frames', type=int)
+parser.add_argument('-s', '--skip-frames', type=int)
+parser.add_argument('-w', '--weather', type=int)
+parser.add_argument('-t', '--map')
+parser.add_argument('-p', '--port', type=int)
+parser.add_argument('--start-spot', type=int)
+parser.add_argument('--connection-retries', type=int)
+parser.add_argument('-o', '--out-directory')
+parser.add_argument('-v', '--verbose', action='store_true')
+parser.add_argument('--fail-first', default=None)
+args = parser.parse_args()
+
+os.makedirs(args.out_directory)
+measurements = open(os.path.join(args.out_directory, '{measurements}'), 'w')
+marker = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'failed-{{}}-{{}}'.format(args.map, args.weather))
+if args.fail_first == '{{}}-{{}}'.format(args.map, args.weather) and not os.path.exists(marker):
+	open(marker, 'w').close()
+	measurements.write('0,0.0,0.0,0.0\\n')
+	sys.exit({exit_code})
+
+for _ in range(args.connection_retries * 10):
+	try:
+		socket.create_connection(('127.0.0.1', args.port), timeout=1).close()
+		break
+	except OSError:
+		time.sleep(0.1)
+else:
+	sys.exit({exit_code})
+for frame in range(args.frames):
+	measurements.write('{{}},0.0,0.5,0.0\\n'.format(frame * args.skip_frames))
+'''.format(measurements=MEASUREMENTS_CSV_FILENAME, exit_code=CONNECTION_ERROR_EXIT_CODE)
+
+
+def get_free_base_port(servers, ports_per_server=3):
+	with socket.socket() as s:
+		s.bind(('127.0.0.1', 0))
+		port = s.getsockname()[1]
+	return min(port, 65535 - servers * ports_per_server)
+
+
+def make_args(tmp_path, servers=2, job_retries=2, gather_args=''):
+	server_script = tmp_path / 'dummy_server.py'
+	server_script.write_text(DUMMY_SERVER)
+	gather_script = tmp_path / 'dummy_gather.py'
+	gather_script.write_text(DUMMY_GATHER)
+	server_command = '{} {} --port {{port}} --map {{map}} --log {}'.format(sys.executable, server_script,
+	                                                                       tmp_path / 'servers.log')
+	return argparse.Namespace(servers=servers, base_port=get_free_base_port(servers), frames=5, skip_frames=2,
+	                          server_command=server_command, server_startup=0.5, gather_script=str(gather_script),
+	                          gather_args=gather_args, job_retries=job_retries, connection_retries=3, job_timeout=60,
+	                          out_directory=str(tmp_path / 'data'), failed_directory=str(tmp_path / 'failed_data'),
+	                          jobs_log=str(tmp_path / 'gathering_jobs.csv'))
+
+
+def read_jobs_log(filename):
+	with open(filename) as f:
+		reader = csv.DictReader(f)
+		assert reader.fieldnames == JOBS_LOG_COLUMNS
+		return list(reader)
+
+
+def test_queue_takes_jobs_of_loaded_map_first():
+	jobs = [GatheringJob('/Game/Maps/Town04', 0, -1), GatheringJob('/Game/Maps/Town03', 0, -1),
+	        GatheringJob('/Game/Maps/Town04', 1, -1)]
+	queue = JobQueue(jobs)
+
+	assert queue.take('/Game/Maps/Town03') == jobs[1]
+	assert queue.take(None) == jobs[0]
+	queue.put(jobs[1])
+	assert queue.take('/Game/Maps/Town03') == jobs[1]
+	assert queue.take('/Game/Maps/Town03') == jobs[2]
+	assert queue.take('/Game/Maps/Town04') is None
+
+
+def test_jobs_are_gathered_on_all_servers(tmp_path):
+	args = make_args(tmp_path)
+	jobs = [GatheringJob('/Game/Maps/Town04', weather, -1) for weather in range(3)] + \
+	       [GatheringJob('/Game/Maps/Town03', weather, 2) for weather in range(3)]
+
+	results = GatheringOrchestrator(args, jobs).run()
+
+	assert len(results) == len(jobs)
+	assert all(result['exit_code'] == 0 and result['attempt'] == 0 for result in results)
+	assert {result['port'] for result in results} == {args.base_port, args.base_port + 3}
+	rows = read_jobs_log(args.jobs_log)
+	assert sorted((row['map'], int(row['weather']), int(row['start_spot'])) for row in rows) == \
+	       sorted((job.map.split('/')[-1], job.weather, job.start_spot) for job in jobs)
+	for row in rows:
+		assert int(row['frames']) == args.frames
+		assert os.path.exists(os.path.join(row['out_directory'], MEASUREMENTS_CSV_FILENAME))
+	assert len(os.listdir(args.out_directory)) == len(jobs)
+	# a server takes jobs of its loaded map first, so it loads every map once
+	with open(str(tmp_path / 'servers.log')) as f:
+		starts = f.readlines()
+	assert len(starts) == len(set(starts))
+
+
+def test_job_is_retried_after_connection_error(tmp_path):
+	args = make_args(tmp_path, servers=1, gather_args='--fail-first Town04-1')
+	jobs = [GatheringJob('/Game/Maps/Town04', weather, -1) for weather in range(2)]
+
+	results = GatheringOrchestrator(args, jobs).run()
+
+	rows = read_jobs_log(args.jobs_log)
+	assert len(rows) == len(results) == 3
+	failed = [row for row in rows if row['weather'] == '1' and row['attempt'] == '0']
+	assert len(failed) == 1
+	assert int(failed[0]['exit_code']) == CONNECTION_ERROR_EXIT_CODE
+	retried = [row for row in rows if row['weather'] == '1' and row['attempt'] == '1']
+	assert len(retried) == 1 and retried[0]['exit_code'] == '0' and int(retried[0]['frames']) == args.frames
+	# data of the failed attempt are moved out of the data directory
+	assert os.path.dirname(failed[0]['out_directory']) == args.failed_directory
+	assert os.path.exists(failed[0]['out_directory'])
+	assert sorted(os.listdir(args.out_directory)) == sorted(os.path.basename(row['out_directory'])
+	                                                        for row in rows if row['exit_code'] == '0')
+	# the server is started again after the failure
+	with open(str(tmp_path / 'servers.log')) as f:
+		assert len(f.readlines()) == 2
+
+
+def test_failed_job_is_given_up_after_retries(tmp_path):
+	args = make_args(tmp_path, servers=1, job_retries=0, gather_args='--fail-first Town03-0')
+	args.failed_directory = ''
+
+	results = GatheringOrchestrator(args, [GatheringJob('/Game/Maps/Town03', 0, -1)]).run()
+
+	assert [result['exit_code'] for result in results] == [CONNECTION_ERROR_EXIT_CODE]
+	assert read_jobs_log(args.jobs_log)[0]['out_directory'] == ''
+	assert os.listdir(args.out_directory) == []
@@ -0,0 +1,236 @@
+import argparse
+import csv
+import os
+from datetime import datetime
+
+from config import MEASUREMENTS_CSV_FILENAME
+from dataset_index import load_dataset, get_index_path
+from train_all import TrainingJob, TrainingScheduler, JobQueue, JOBS_LOG_COLUMNS, DATA_DIRECTORIES, \
+	get_checkpoints_owner_file
+
+# run: python -m pytest tests/test_train_all.py
+
+REPOSITORY_DIRECTORY = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# stand-in of train.py: saves a checkpoint after every epoch and writes throughput stats at the end, every training
+# is logged with its model, visible device, resumed checkpoint and start and end time; a job started with
+# --fail-model fails after --fail-epoch epochs once
+DUMMY_TRAIN = '''
+import argparse
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, {repository!r})
+from neural_networks.neural_networks_common import get_checkpoint_path
+
+parser = argparse.ArgumentParser()
+parser.add_argument('-m', dest='model')
+parser.add_argument('-n', dest='nb_epoch', type=int)
+parser.add_argument('-b', dest='batch_size', type=int)
+parser.add_argument('-l', dest='learning_rate', type=float)
+parser.add_argument('-o', dest='save_best_only')
+parser.add_argument('-r', '--resume', default='false')
+parser.add_argument('-c', '--checkpoint', type=int, default=0)
+parser.add_argument('--stats-file')
+parser.add_argument('--epoch-seconds', type=float, default=0.1)
+parser.add_argument('--fail-model', default=None)
+parser.add_argument('--fail-epoch', type=int, default=1)
+parser.add_argument('--not-improved', type=int, nargs='*', default=[], help='epochs without checkpoint (save best only)')
+args = parser.parse_args()
+
+start = time.time()
+marker = 'failed-{{}}'.format(args.model)
+for epoch in range(args.checkpoint + 1, args.checkpoint + args.nb_epoch + 1):
+	time.sleep(args.epoch_seconds)
+	if epoch not in args.not_improved:
+		open(get_checkpoint_path(args.model, epoch), 'w').close()
+	if args.fail_model == args.model and epoch == args.fail_epoch and not os.path.exists(marker):
+		open(marker, 'w').close()
+		sys.exit(1)
+with open('trainings.log', 'a') as f:
+	f.write('{{}} {{}} {{}} {{}} {{}} {{}}\\n'.format(args.model, args.batch_size, os.environ['CUDA_VISIBLE_DEVICES'] or 'cpu',
+	                                      args.checkpoint if args.resume == 'true' else 0, start, time.time()))
+with open(args.stats_file, 'w') as f:
+	json.dump({{'epochs': args.nb_epoch, 'samples': args.nb_epoch * 100, 'seconds': 1.0,
+	           'samples_per_second': 100.0}}, f)
+'''.format(repository=REPOSITORY_DIRECTORY)
+
+
+class FixedDatetime(datetime):
+	@classmethod
+	def now(cls, tz=None):
+		return cls(2019, 1, 1)
+
+
+def make_args(tmp_path, monkeypatch, devices=('cpu',), jobs_per_device=1, job_retries=1, resume=True, train_args=''):
+	# checkpoints of models are relative to the working directory
+	monkeypatch.chdir(tmp_path)
+	train_script = tmp_path / 'dummy_train.py'
+	train_script.write_text(DUMMY_TRAIN)
+	logs_directory = tmp_path / 'training_logs'
+	logs_directory.mkdir(exist_ok=True)
+	return argparse.Namespace(devices=list(devices), jobs_per_device=jobs_per_device, threads_per_job=0, resume=resume,
+	                          job_retries=job_retries, save_best_only=True, train_script=str(train_script),
+	                          train_args=train_args, warm_up=True, logs_directory=str(logs_directory),
+	                          jobs_log=str(tmp_path / 'training_jobs.csv'))
+
+
+def read_trainings(tmp_path):
+	if not (tmp_path / 'trainings.log').exists():
+		return []
+	with open(str(tmp_path / 'trainings.log')) as f:
+		return [(model, int(batch_size), device, int(resumed), float(start), float(end))
+		        for model, batch_size, device, resumed, start, end in (line.split() for line in f)]
+
+
+def read_jobs_log(filename):
+	with open(filename) as f:
+		reader = csv.DictReader(f)
+		assert reader.fieldnames == JOBS_LOG_COLUMNS
+		return list(reader)
+
+
+def max_concurrent(trainings):
+	events = sorted([(start, 1) for _, _, _, _, start, _ in trainings] +
+	                [(end, -1) for _, _, _, _, _, end in trainings])
+	running, result = 0, 0
+	for _, change in events:
+		running += change
+		result = max(result, running)
+	return result
+
+
+def test_queue_never_gives_jobs_of_running_model():
+	jobs = [TrainingJob('vgg', 90, 1e-4, 2), TrainingJob('vgg', 30, 1e-4, 2), TrainingJob('resnet', 30, 1e-4, 2)]
+	queue = JobQueue(jobs)
+
+	assert queue.take() == jobs[0]
+	assert queue.take() == jobs[2]
+	queue.done(jobs[0])
+	assert queue.take() == jobs[1]
+	queue.done(jobs[1], retry=True)
+	queue.done(jobs[2])
+	assert queue.take() == jobs[1]
+	queue.done(jobs[1])
+	assert queue.take() is None
+
+
+def test_jobs_run_concurrently_on_every_device(tmp_path, monkeypatch):
+	args = make_args(tmp_path, monkeypatch, devices=('cpu', '1'), jobs_per_device=2, train_args='--epoch-seconds 0.5')
+	jobs = [TrainingJob(model, 10, 1e-4, 2) for model in ['vgg', 'nvidia', 'resnet', 'densenet']]
+
+	results = TrainingScheduler(args, jobs).run()
+
+	assert all(result['exit_code'] == 0 for result in results)
+	trainings = read_trainings(tmp_path)
+	assert len(trainings) == len(jobs)
+	for device in ['cpu', '1']:
+		on_device = [training for training in trainings if training[2] == device]
+		assert len(on_device) == 2
+		assert max_concurrent(on_device) == 2
+	assert sorted(result['device'] for result in results) == ['1', '1', 'cpu', 'cpu']
+
+
+def test_jobs_of_model_never_run_at_once(tmp_path, monkeypatch):
+	args = make_args(tmp_path, monkeypatch, jobs_per_device=3, resume=False)
+	jobs = [TrainingJob('vgg', batch_size, 1e-4, 2) for batch_size in [30, 60, 90]]
+
+	TrainingScheduler(args, jobs).run()
+
+	trainings = read_trainings(tmp_path)
+	assert sorted(training[1] for training in trainings) == [30, 60, 90]
+	assert max_concurrent(trainings) == 1
+
+
+def test_failed_job_is_resumed_from_its_last_checkpoint(tmp_path, monkeypatch):
+	args = make_args(tmp_path, monkeypatch, train_args='--fail-model vgg --fail-epoch 2')
+	job = TrainingJob('vgg', 90, 1e-4, 4)
+
+	results = TrainingScheduler(args, [job]).run()
+
+	assert [(result['attempt'], result['from_epoch'], result['exit_code'] != 0) for result in results] == \
+	       [(0, 0, True), (1, 2, False)]
+	assert results[1]['trained_epochs'] == 2
+	assert [training[3] for training in read_trainings(tmp_path)] == [2]
+
+
+def test_job_is_not_resumed_from_checkpoints_of_other_job(tmp_path, monkeypatch):
+	args = make_args(tmp_path, monkeypatch, job_retries=0, train_args='--fail-model vgg --fail-epoch 2')
+	TrainingScheduler(args, [TrainingJob('vgg', 90, 1e-4, 4)]).run()
+
+	other_job = TrainingJob('vgg', 30, 1e-4, 4)
+	results = TrainingScheduler(args, [other_job]).run()
+
+	assert results[0]['from_epoch'] == 0 and results[0]['exit_code'] == 0
+	assert os.path.exists(get_checkpoints_owner_file(args.logs_directory, 'vgg'))
+
+
+def test_finished_job_is_skipped(tmp_path, monkeypatch):
+	args = make_args(tmp_path, monkeypatch)
+	job = TrainingJob('nvidia', 150, 1e-4, 2)
+	TrainingScheduler(args, [job]).run()
+
+	results = TrainingScheduler(args, [job]).run()
+
+	assert len(read_trainings(tmp_path)) == 1
+	assert results[0]['from_epoch'] == job.epochs and results[0]['exit_code'] == 0
+	assert results[0]['trained_epochs'] == 0
+
+
+def test_finished_job_without_last_checkpoint_is_skipped(tmp_path, monkeypatch):
+	args = make_args(tmp_path, monkeypatch, train_args='--not-improved 3')
+	job = TrainingJob('vgg', 90, 1e-4, 3)
+	TrainingScheduler(args, [job]).run()
+
+	results = TrainingScheduler(args, [job]).run()
+
+	assert len(read_trainings(tmp_path)) == 1
+	assert results[0]['from_epoch'] == job.epochs
+
+
+def test_slot_goes_on_after_job_error(tmp_path, monkeypatch):
+	args = make_args(tmp_path, monkeypatch)
+	jobs = [TrainingJob('resnet', 30, 1e-4, 1), TrainingJob('nvidia', 150, 1e-4, 1)]
+	# output of the first job cannot be written (its log file is a directory)
+	monkeypatch.setattr('train_all.datetime', FixedDatetime)
+	os.makedirs(os.path.join(args.logs_directory, '20190101000000-resnet-b30-0.log'))
+
+	results = TrainingScheduler(args, jobs).run()
+
+	assert sorted((result['model'], result['attempt'], result['exit_code']) for result in results) == \
+	       [('nvidia', 0, 0), ('resnet', 0, -1), ('resnet', 1, 0)]
+	assert len(read_jobs_log(args.jobs_log)) == 3
+
+
+def test_results_are_written_to_jobs_log(tmp_path, monkeypatch):
+	args = make_args(tmp_path, monkeypatch, train_args='--fail-model resnet --fail-epoch 1')
+	jobs = [TrainingJob('resnet', 30, 1e-4, 2), TrainingJob('densenet', 50, 2e-4, 3)]
+
+	TrainingScheduler(args, jobs).run()
+
+	rows = read_jobs_log(args.jobs_log)
+	assert len(rows) == 3
+	densenet = [row for row in rows if row['model'] == 'densenet'][0]
+	assert (densenet['batch_size'], float(densenet['learning_rate']), densenet['epochs']) == ('50', 2e-4, '3')
+	assert (densenet['device'], densenet['cpus'], densenet['exit_code']) == ('cpu', '', '0')
+	assert (densenet['trained_epochs'], densenet['samples'], float(densenet['samples_per_second'])) == \
+	       ('3', '300', 100.0)
+	assert os.path.exists(densenet['output_file'])
+	resnet = [(row['attempt'], row['from_epoch'], row['exit_code'], row['trained_epochs'])
+	          for row in rows if row['model'] == 'resnet']
+	assert resnet == [('0', '0', '1', '0'), ('1', '1', '0', '1')]
+
+
+def test_dataset_index_is_updated_before_jobs(tmp_path, monkeypatch):
+	args = make_args(tmp_path, monkeypatch)
+	run_directory = os.path.join(DATA_DIRECTORIES[0], 'run')
+	os.makedirs(run_directory)
+	with open(os.path.join(run_directory, MEASUREMENTS_CSV_FILENAME), 'w') as f:
+		f.write('0,0.1,0.5,0.0\n10,-0.2,0.5,0.0\n')
+
+	TrainingScheduler(args, [TrainingJob('nvidia', 150, 1e-4, 1)]).run()
+
+	assert os.path.exists(get_index_path(DATA_DIRECTORIES[0]))
+	assert len(load_dataset(DATA_DIRECTORIES[0])) == 2
@@ -1,15 +1,20 @@
 import argparse
 import logging
-import math
-import os
-
-import pandas as pd
-import tensorflow as tf
-
-from config import MEASUREMENTS_CSV_FILENAME
-from data_augmentation import balanced_data_batch_generator
-from neural_networks.neural_networks_common import get_empty_model, add_model_cmd_arg, load_model
+import multiprocessing
+import queue
+
+from batch_sampler import bucket_edges_for_count, parse_bucket_edges, DEFAULT_BUCKET_EDGES
+from batch_sequence import BalancedBatchSequence, FeatureBatchSequence
+from data_augmentation import load_validation_data
+from dataset_index import load_dataset
+from feature_cache import get_frozen_split, get_feature_key, warm_up_features, fill_feature_batch, build_head_model, \
+	FullModelCheckpoint
+from frame_cache import warm_up
+from neural_networks.neural_networks_common import get_empty_model, add_model_cmd_arg, load_model, \
+	get_training_mode, configure_training_session, get_training_optimizer, PRECISIONS
 from neural_networks import TrainValTensorBoardCallback
+from neural_networks.ThroughputCallback import Throughput
+from neural_networks.StageTimingsCallback import StageTimings, INPUT_BOUND_PERCENT
 
 FORMAT = '%(asctime)-15s : %(message)s'
 
@@ -30,11 +35,13 @@ def train_model(model, args, train_data, valid_data, model_name, from_epoch=0):
 	model_trained_out_dir = 'trained_models\\{}'.format(model_name)
 	model_path_base = 'trained_models\\{}\\{}-model-'.format(model_name, model_name)
 	checkpoint_name = model_path_base + '{epoch:03d}.h5'
-	checkpoint = tf.keras.callbacks.ModelCheckpoint(
+	checkpoint = FullModelCheckpoint(
+		model,
 		checkpoint_name,
 		monitor='val_loss',
 		verbose=0,
 		save_best_only=args.save_best_only,
+		save_weights_only=False,
 		mode='auto')
 
 	tensorboard_callback = TrainValTensorBoardCallback.TrainValTensorBoard(
@@ -42,7 +49,45 @@ def train_model(model, args, train_data, valid_data, model_name, from_epoch=0):
 		update_freq='epoch'
 	)
 
-	model.compile(loss='mean_squared_error', optimizer=tf.keras.optimizers.Adam(lr=args.learning_rate))
+	callbacks = [Throughput(args.stats_file)]
+	timings_queue = None
+	if args.timings:
+		# with workers > 0 batches are produced by other processes, they send timings through a managed queue
+		manager = multiprocessing.Manager() if args.workers > 0 else None
+		timings_queue = manager.Queue() if manager is not None else queue.Queue()
+		callbacks.append(StageTimings(model_trained_out_dir + '\\stage_timings.csv', timings_queue,
+		                              args.input_bound_percent))
+	callbacks += [checkpoint, tensorboard_callback]
+
+	if args.buckets:
+		bucket_edges = bucket_edges_for_count(train_data['steering'], args.buckets)
+	else:
+		bucket_edges = args.bucket_edges
+	logging.info("Steering bucket edges: {}".format(bucket_edges))
+
+	split = get_feature_split(model, args)
+	if split is not None:
+		# frozen layers are run once over all frames, only the head is trained (on cached features)
+		feature_key = get_feature_key(model_name, model, split, args.precision)
+		logging.info("Training head of the model ({} layers) on cached features ({})".format(
+			len(model.layers) - split, feature_key))
+		warm_up_features(sorted(set(train_data['data_dir']) | set(valid_data['data_dir'])), feature_key, model, split)
+		trained_model = build_head_model(model, split)
+		train_sequence = FeatureBatchSequence(train_data, args.batch_size, True, feature_key, bucket_edges, args.seed,
+		                                      timings_queue)
+		validation_inputs, validation_steers = fill_feature_batch(valid_data.values, False, feature_key)
+	else:
+		trained_model = model
+		train_sequence = BalancedBatchSequence(train_data, args.batch_size, True, args.packed, bucket_edges,
+		                                       args.seed, args.augment, args.cache, timings_queue)
+		# validation set is loaded once and evaluated in one ordered pass per epoch, so val_loss is comparable
+		# between epochs
+		logging.info("Loading validation images...")
+		validation_inputs, validation_steers = load_validation_data(valid_data, args.packed, args.cache)
+	logging.info("Batches seed: {}, workers: {}".format(train_sequence.seed, args.workers))
+
+	trained_model.compile(loss='mean_squared_error',
+	                      optimizer=get_training_optimizer(args.learning_rate, args.precision))
 
 	# Fits the model on data generated batch-by-batch by a Python generator.
 
@@ -50,19 +95,39 @@ def train_model(model, args, train_data, valid_data, model_name, from_epoch=0):
 	# For instance, this allows you to do real-time data augmentation on images on CPU in
 	# parallel to training your model on GPU.
 	# so we reshape our data into their appropriate batches and train our model simulatenously
-	model.fit_generator(
-		generator=balanced_data_batch_generator(train_data, args.batch_size, True),
-		steps_per_epoch=math.ceil(len(train_data) / (args.batch_size)),
+	# With workers > 0 batches are produced by separate processes, with 0 in the main thread.
+	trained_model.fit_generator(
+		generator=train_sequence,
+		steps_per_epoch=len(train_sequence),
 		epochs=args.nb_epoch + from_epoch,
-		max_queue_size=1,
-		validation_data=balanced_data_batch_generator(valid_data, args.batch_size, False),
-		validation_steps=len(valid_data),
-		callbacks=[checkpoint, tensorboard_callback],
+		max_queue_size=max(1, 2 * args.workers),
+		workers=args.workers,
+		use_multiprocessing=args.workers > 0,
+		# batches are not shuffled (their content is random already), so step i of the epoch trains on batch i
+		shuffle=False,
+		validation_data=(validation_inputs, validation_steers),
+		callbacks=callbacks,
 		verbose=2,
 		initial_epoch=from_epoch
 	)
 
 
+def get_feature_split(model, args):
+	"""
+	Returns index of the first trainable layer when the head of the model can be trained on cached features,
+	None for full training
+	"""
+	if not args.feature_cache:
+		return None
+	split = get_frozen_split(model)
+	if split is None:
+		logging.info("Model has no frozen backbone (trainable layers are not cached), full training")
+	elif args.augment:
+		logging.info("Augmented batches need images, full training")
+		split = None
+	return split
+
+
 # for command line args
 def s2b(s):
 	"""
@@ -72,10 +137,15 @@ def s2b(s):
 	return s == 'true' or s == 'yes' or s == 'y' or s == '1'
 
 
-def load_training_data():
+def load_training_data(use_packed=False, use_pruned=True, use_cache=False, prune_validation=False):
 	logging.info("Start loading data")
-	train_data = get_data_frame(".\\out\\data")
-	valid_data = get_data_frame(".\\out\\validation_data")
+	if use_cache:
+		# only runs without fresh cache (new, changed or cached with other preprocessing) are cached
+		warm_up(".\\out\\data")
+		warm_up(".\\out\\validation_data")
+	train_data = get_data_frame(".\\out\\data", use_packed, use_pruned)
+	# validation keeps all frames unless asked for, so validation loss is comparable with runs trained on all frames
+	valid_data = get_data_frame(".\\out\\validation_data", use_packed, prune_validation)
 
 	# train_data, valid_data = train_test_split(frame, test_size=test_size, random_state=None)
 	logging.info("Train data loaded (count: {})".format(len(train_data)))
@@ -83,19 +153,8 @@ def load_training_data():
 	return train_data, valid_data
 
 
-def get_data_frame(directory):
-	data = []
-	for dir in os.walk(directory):
-		if dir[0] == directory:
-			continue
-
-		measurements_file = os.path.join(dir[0], MEASUREMENTS_CSV_FILENAME)
-		loaded_data = pd.read_csv(measurements_file, sep=',', decimal='.', usecols=[0, 1, 2, 3], header=None,
-		                          names=['frame', 'steering', 'throttle', 'brake'])
-		loaded_data['data_dir'] = dir[0]
-		data.append(loaded_data)
-	frame = pd.concat(data, axis=0, ignore_index=True)
-	return frame
+def get_data_frame(directory, use_packed=False, use_pruned=True):
+	return load_dataset(directory, use_packed, use_pruned)
 
 
 def main():
@@ -107,8 +166,38 @@ def main():
 	parser.add_argument('-r', '--resume', help='resume training from checkpoint', type=s2b, default='false')
 	parser.add_argument('-c', '--checkpoint', help='checkpoint number to resume training from', type=int, default=0)
 	parser.add_argument('-f', '--fine-tuning', help='train networks with fine tuning', type=s2b, default='false')
+	parser.add_argument('-k', '--packed', help='read frames from packed data (run packed_data.py first)', type=s2b,
+	                    default='false')
+	parser.add_argument('-p', '--pruned', help='skip training frames dropped by prune_duplicates.py', type=s2b,
+	                    default='true')
+	parser.add_argument('--prune-validation', help='skip also validation frames dropped by prune_duplicates.py',
+	                    type=s2b, default='false')
+	parser.add_argument('-e', '--cache', help='read preprocessed frames from frame cache (see frame_cache.py)',
+	                    type=s2b, default='false')
+	parser.add_argument('--feature-cache', help='train only the head of a model with frozen backbone on cached features '
+	                                            '(see feature_cache.py)', type=s2b, default='false')
+	parser.add_argument('-a', '--augment', help='augment training batches (translation, brightness, shadow, noise)',
+	                    type=s2b, default='false')
+	parser.add_argument('--buckets', help='number of equally wide steering buckets balanced in every batch', type=int,
+	                    default=0)
+	parser.add_argument('--bucket-edges', help='comma separated steering bucket edges (e.g. --bucket-edges=-0.05,0.05)',
+	                    type=parse_bucket_edges, default=DEFAULT_BUCKET_EDGES)
+	parser.add_argument('-j', '--workers', help='number of processes producing batches (0 - main thread)', type=int,
+	                    default=1)
+	parser.add_argument('--precision', help='compute precision (default of the architecture if not given)',
+	                    choices=PRECISIONS, default=None)
+	parser.add_argument('--xla', help='compile training step by XLA (default of the architecture if not given)',
+	                    type=s2b, default=None)
+	parser.add_argument('-t', '--timings', help='record times of stages of every batch (stage_timings.csv, TensorBoard)',
+	                    type=s2b, default='false')
+	parser.add_argument('--input-bound-percent', help='percent of step time waiting for input reported as input-bound',
+	                    type=float, default=INPUT_BOUND_PERCENT)
+	parser.add_argument('--stats-file', help='json file with training throughput written at the end', default=None)
+	parser.add_argument('-s', '--seed', help='seed of batches sampling (random if not given)', type=int, default=None)
 	add_model_cmd_arg(parser)
 	args = parser.parse_args()
+	mode = get_training_mode(args.model, args.precision, args.xla)
+	args.precision, args.xla = mode['precision'], mode['xla']
 
 	# print parameters
 	print('-' * 30)
@@ -119,14 +208,16 @@ def main():
 	print('-' * 30)
 
 	# load data
-	data = load_training_data()
+	data = load_training_data(args.packed, args.pruned, args.cache, args.prune_validation)
 	# build model
-	logging.info("Loading neural network model: {}".format(args.model))
+	logging.info("Loading neural network model: {} (precision: {}, xla: {})".format(args.model, args.precision,
+	                                                                                args.xla))
+	configure_training_session(args.xla)
 
 	if not args.resume:
 		model = get_empty_model(args.model, args.fine_tuning)
 	else:
-		model = load_model(args.model, args.checkpoint, args.fine_tuning)
+		model = load_model(args.model, args.checkpoint, args.fine_tuning, rebuild=True)
 
 	# train model on data, it saves as model.h5
 	train_model(model, args, *data, args.model, args.checkpoint)
@@ -1,6 +1,22 @@
-import subprocess
+# Script is designed to train many models at once (queue of jobs run on every device with given concurrency)
+import argparse
+import csv
+import json
 import logging
+import os
+import shlex
+import subprocess
+import sys
+import threading
 import time
+from collections import namedtuple
+from datetime import datetime
+
+import psutil
+
+from dataset_index import load_dataset
+from frame_cache import warm_up
+from neural_networks.neural_networks_common import get_checkpoint_path
 
 FORMAT = '%(asctime)-15s : %(message)s'
 nets = ["vgg", "resnet", "densenet"]
@@ -10,29 +26,355 @@ batches = {
 	"resnet": 30,
 	"vgg": 90
 }
+LEARNING_RATE = 1.0e-4
+EPOCHS_COUNT = 10
+
+TRAIN_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'train.py')
+# training and validation data of train.py
+DATA_DIRECTORIES = [".\\out\\data", ".\\out\\validation_data"]
+# device of jobs run on the processor (no GPU is visible to them)
+CPU_DEVICE = 'cpu'
+JOBS_LOG_COLUMNS = ['model', 'batch_size', 'learning_rate', 'epochs', 'device', 'cpus', 'attempt', 'from_epoch',
+                    'exit_code', 'trained_epochs', 'samples', 'seconds', 'samples_per_second', 'output_file']
+
+TrainingJob = namedtuple('TrainingJob', ['model', 'batch_size', 'learning_rate', 'epochs'])
+# job which saved checkpoints of a model last, start time of its first attempt, number of epochs it has trained and
+# whether it has finished (with save_best_only the checkpoint of the last epoch may not exist)
+CheckpointsOwner = namedtuple('CheckpointsOwner', ['job', 'started', 'epoch', 'finished'])
+
+
+# run: python train_all.py --devices 0 1 --jobs-per-device 1 --threads-per-job 4
+
+def read_jobs(filename):
+	"""
+	Reads jobs from csv file with columns: model, batch_size, learning_rate, epochs
+	"""
+	with open(filename) as f:
+		return [TrainingJob(row['model'], int(row['batch_size']), float(row['learning_rate']), int(row['epochs']))
+		        for row in csv.DictReader(f)]
+
+
+def get_last_checkpoint(model_name, epochs, since=0.0):
+	"""
+	Returns number of the last checkpoint of the model saved after since (0 when there is none)
+	"""
+	for checkpoint in range(epochs, 0, -1):
+		filename = get_checkpoint_path(model_name, checkpoint)
+		if os.path.exists(filename) and os.path.getmtime(filename) >= since:
+			return checkpoint
+	return 0
+
+
+def get_checkpoints_owner_file(logs_directory, model_name):
+	return os.path.join(logs_directory, '{}-checkpoints.json'.format(model_name))
+
+
+def read_checkpoints_owner(logs_directory, model_name):
+	"""
+	Returns owner of checkpoints of the model (None if unknown)
+	"""
+	owner_file = get_checkpoints_owner_file(logs_directory, model_name)
+	if not os.path.exists(owner_file):
+		return None
+	with open(owner_file) as f:
+		owner = json.load(f)
+	if 'job' not in owner:
+		# owner file of older train_all.py keeps just the job and is written when the job starts
+		return CheckpointsOwner(TrainingJob(**owner), os.path.getmtime(owner_file), 0, False)
+	return CheckpointsOwner(TrainingJob(**owner['job']), owner['started'], owner['epoch'], owner['finished'])
+
+
+def write_checkpoints_owner(logs_directory, owner):
+	with open(get_checkpoints_owner_file(logs_directory, owner.job.model), 'w') as f:
+		json.dump(dict(owner._asdict(), job=owner.job._asdict()), f)
+
+
+def split_args(args):
+	return shlex.split(args, posix=(os.name != 'nt'))
+
+
+def parse_data_args(train_args):
+	"""
+	Returns data options of train.py given in its arguments (packed data and frame cache)
+	"""
+	parser = argparse.ArgumentParser(add_help=False, allow_abbrev=False)
+	parser.add_argument('-k', '--packed', type=s2b, default='false')
+	parser.add_argument('-e', '--cache', type=s2b, default='false')
+	return parser.parse_known_args(split_args(train_args))[0]
+
+
+def warm_up_data(train_args):
+	"""
+	Updates dataset indexes and frame caches used by jobs, so jobs run at once only read them
+	"""
+	data_args = parse_data_args(train_args)
+	for directory in DATA_DIRECTORIES:
+		if not os.path.isdir(directory):
+			continue
+		if data_args.cache:
+			warm_up(directory)
+		load_dataset(directory, data_args.packed)
+
+
+def get_cpu_sets(slots, threads_per_job):
+	"""
+	Returns disjoint sets of cpus of every slot (sets wrap around when there are not enough cpus), empty without pinning
+	"""
+	if threads_per_job <= 0:
+		return [[] for _ in range(slots)]
+	cpus = psutil.cpu_count()
+	return [[(slot * threads_per_job + i) % cpus for i in range(threads_per_job)] for slot in range(slots)]
+
+
+def pin_process(process, cpus):
+	# cpu affinity is not supported on every system (e.g. macOS)
+	if not cpus or not hasattr(psutil.Process, 'cpu_affinity'):
+		return
+	try:
+		psutil.Process(process.pid).cpu_affinity(cpus)
+	except psutil.NoSuchProcess:
+		pass
+
+
+class JobQueue(object):
+	"""
+	Jobs waiting for a slot, jobs of a model are never run at once (they share checkpoints of the model)
+	"""
+
+	def __init__(self, jobs):
+		self._jobs = list(jobs)
+		self._running_models = set()
+		self._lock = threading.Condition()
+
+	def take(self):
+		with self._lock:
+			while True:
+				if len(self._jobs) == 0 and len(self._running_models) == 0:
+					return None
+				ready = [i for i, job in enumerate(self._jobs) if job.model not in self._running_models]
+				if ready:
+					job = self._jobs.pop(ready[0])
+					self._running_models.add(job.model)
+					return job
+				self._lock.wait()
+
+	def done(self, job, retry=False):
+		with self._lock:
+			self._running_models.discard(job.model)
+			if retry:
+				self._jobs.append(job)
+			self._lock.notify_all()
+
+
+class TrainingScheduler(object):
+	"""
+	Runs train.py jobs in slots (jobs_per_device slots of every device), every job is pinned to cpus of its slot.
+	Interrupted or failed jobs are resumed from the last checkpoint of the model (when it was saved by the same job).
+	"""
+
+	def __init__(self, args, jobs):
+		self._args = args
+		self._queue = JobQueue(jobs)
+		self._attempts = {}
+		self._lock = threading.Lock()
+		self.results = []
+
+	def run(self):
+		if self._args.warm_up:
+			warm_up_data(self._args.train_args)
+		slots = [device for device in self._args.devices for _ in range(self._args.jobs_per_device)]
+		cpu_sets = get_cpu_sets(len(slots), self._args.threads_per_job)
+		threads = [threading.Thread(target=self._serve, args=(device, cpus), name='slot-{}'.format(i))
+		           for i, (device, cpus) in enumerate(zip(slots, cpu_sets))]
+		for thread in threads:
+			thread.start()
+		for thread in threads:
+			thread.join()
+		return self.results
+
+	def _serve(self, device, cpus):
+		while True:
+			job = self._queue.take()
+			if job is None:
+				return
+			retry = False
+			try:
+				result = self._run_job(job, device, cpus)
+				retry = result['exit_code'] != 0 and result['attempt'] < self._args.job_retries
+			except Exception:
+				# e.g. the output file could not be opened or stats of a crashed job are broken, the slot goes on
+				logging.exception("Job failed: {}; device: {}".format(job, device))
+				with self._lock:
+					attempt = self._attempts.get(job, 1) - 1
+				try:
+					self._finish(self._make_result(job, device, cpus, attempt, exit_code=-1))
+				except Exception:
+					logging.exception("Result of the job could not be written: {}".format(job))
+				retry = attempt < self._args.job_retries
+			finally:
+				self._queue.done(job, retry)
+
+	def _run_job(self, job, device, cpus):
+		with self._lock:
+			attempt = self._attempts.get(job, 0)
+			self._attempts[job] = attempt + 1
+
+		owner = self._get_owner(job)
+		from_epoch = self._get_resume_epoch(job, owner)
+		name = '{}-{}-b{}-{}'.format(datetime.now().strftime("%Y%m%d%H%M%S"), job.model, job.batch_size, attempt)
+		output_file = os.path.join(self._args.logs_directory, name + '.log')
+		stats_file = os.path.join(self._args.logs_directory, name + '.json')
+		result = self._make_result(job, device, cpus, attempt, from_epoch=from_epoch, output_file=output_file)
+		if from_epoch >= job.epochs:
+			logging.info("Job already finished: {}".format(job))
+			return self._finish(result)
+
+		command = [sys.executable, self._args.train_script,
+		           '-m', job.model,
+		           '-n', str(job.epochs - from_epoch),
+		           '-b', str(job.batch_size),
+		           '-l', str(job.learning_rate),
+		           '-o', str(self._args.save_best_only).lower(),
+		           '--stats-file', stats_file] + split_args(self._args.train_args)
+		if from_epoch > 0:
+			command += ['-r', 'true', '-c', str(from_epoch)]
+
+		if from_epoch == 0:
+			owner = CheckpointsOwner(job, time.time(), 0, False)
+			write_checkpoints_owner(self._args.logs_directory, owner)
+		environment = dict(os.environ)
+		environment['CUDA_VISIBLE_DEVICES'] = '' if device == CPU_DEVICE else device
+		if cpus:
+			environment['OMP_NUM_THREADS'] = str(len(cpus))
+
+		logging.info("Start job: {}; device: {}; cpus: {}; from epoch: {}; attempt: {}".format(
+			job, device, cpus or 'all', from_epoch, attempt))
+		start = time.time()
+		with open(output_file, 'w') as output:
+			process = subprocess.Popen(command, stdout=output, stderr=subprocess.STDOUT, env=environment)
+			pin_process(process, cpus)
+			result['exit_code'] = process.wait()
+		result['seconds'] = round(time.time() - start, 2)
+
+		if os.path.exists(stats_file):
+			with open(stats_file) as f:
+				stats = json.load(f)
+			result['trained_epochs'] = stats['epochs']
+			result['samples'] = stats['samples']
+			result['samples_per_second'] = stats['samples_per_second']
+		if result['exit_code'] == 0:
+			# completion is recorded, so the job is not trained again from its best checkpoint
+			epoch = from_epoch + result['trained_epochs']
+			write_checkpoints_owner(self._args.logs_directory, owner._replace(epoch=epoch, finished=epoch >= job.epochs))
+		logging.info("Finished job: {}".format(result))
+		return self._finish(result)
+
+	def _make_result(self, job, device, cpus, attempt, from_epoch=0, exit_code=0, output_file=''):
+		return {
+			'model': job.model,
+			'batch_size': job.batch_size,
+			'learning_rate': job.learning_rate,
+			'epochs': job.epochs,
+			'device': device,
+			'cpus': ' '.join(str(cpu) for cpu in cpus),
+			'attempt': attempt,
+			'from_epoch': from_epoch,
+			'exit_code': exit_code,
+			'trained_epochs': 0,
+			'samples': 0,
+			'seconds': 0.0,
+			'samples_per_second': 0.0,
+			'output_file': output_file
+		}
+
+	def _get_owner(self, job):
+		# checkpoints of the model could be saved by a job with other parameters
+		owner = read_checkpoints_owner(self._args.logs_directory, job.model)
+		return owner if owner is not None and owner.job == job else None
+
+	def _get_resume_epoch(self, job, owner):
+		if not self._args.resume or owner is None:
+			return 0
+		if owner.finished:
+			return job.epochs
+		# interrupted job continues from its last checkpoint, checkpoints of the job are not older than its start
+		return get_last_checkpoint(job.model, job.epochs, owner.started)
+
+	def _finish(self, result):
+		with self._lock:
+			self.results.append(result)
+			write_job_result(self._args.jobs_log, result)
+		return result
+
+
+def write_job_result(filename, result):
+	write_header = not os.path.exists(filename)
+	with open(filename, 'a', newline='') as f:
+		writer = csv.DictWriter(f, fieldnames=JOBS_LOG_COLUMNS)
+		if write_header:
+			writer.writeheader()
+		writer.writerow(result)
+
+
+def print_summary(results):
+	print('-' * 80)
+	print('{:<10} {:>6} {:>10} {:>8} {:>10} {:>12}  {}'.format('model', 'batch', 'lr', 'epochs', 'exit code',
+	                                                            'samples/s', 'device'))
+	print('-' * 80)
+	for result in results:
+		print('{:<10} {:>6} {:>10} {:>8} {:>10} {:>12}  {}'.format(
+			result['model'], result['batch_size'], result['learning_rate'],
+			'{}-{}'.format(result['from_epoch'], result['from_epoch'] + result['trained_epochs']), result['exit_code'],
+			result['samples_per_second'], result['device']))
+	print('-' * 80)
+
+
+def s2b(s):
+	s = s.lower()
+	return s == 'true' or s == 'yes' or s == 'y' or s == '1'
+
+
+def main():
+	parser = argparse.ArgumentParser(description='Trains queue of models on many devices at once')
+	parser.add_argument('--models', nargs='+', default=nets, help='models trained with default parameters')
+	parser.add_argument('-f', '--jobs-file', default=None,
+	                    help='csv file with jobs (columns: model, batch_size, learning_rate, epochs) instead of --models')
+	parser.add_argument('-n', '--epochs', type=int, default=EPOCHS_COUNT, help='epochs of --models jobs')
+	parser.add_argument('--devices', nargs='+', default=['0'], help='GPU numbers or cpu')
+	parser.add_argument('--jobs-per-device', type=int, default=1, help='number of jobs run at once on every device')
+	parser.add_argument('--threads-per-job', type=int, default=0, help='number of cpus every job is pinned to (0 - all)')
+	parser.add_argument('--resume', type=s2b, default='true', help='resume jobs from the last checkpoint of the model')
+	parser.add_argument('--job-retries', type=int, default=1, help='number of retries of a failed job')
+	parser.add_argument('-o', '--save-best-only', type=s2b, default='true')
+	parser.add_argument('--train-script', default=TRAIN_FILE)
+	parser.add_argument('--train-args', default='', help='additional arguments of train.py')
+	parser.add_argument('--warm-up', type=s2b, default='true',
+	                    help='update dataset indexes (and frame caches with -e true in --train-args) before training')
+	parser.add_argument('--logs-directory', default='training_logs', help='directory with output of every job')
+	parser.add_argument('--jobs-log', default='training_jobs.csv', help='csv file with results of every job')
+	parser.add_argument('--shutdown', action='store_true', help='shut the computer down after training')
+	args = parser.parse_args()
 
-if __name__ == '__main__':
 	logging.basicConfig(filename="training.log", format=FORMAT)
 	logging.getLogger().setLevel(logging.DEBUG)
+	os.makedirs(args.logs_directory, exist_ok=True)
+
+	if args.jobs_file:
+		jobs = read_jobs(args.jobs_file)
+	else:
+		jobs = [TrainingJob(net, batches[net], LEARNING_RATE, args.epochs) for net in args.models]
+	logging.info("Start training {} jobs (devices: {}, jobs per device: {})...".format(len(jobs), args.devices,
+	                                                                                args.jobs_per_device))
+	results = TrainingScheduler(args, jobs).run()
+	print_summary(results)
+	logging.info("Finished all training")
 
-	logging.info("Start training...")
-	train_script = "train.py"
-	epochs_count = 10
-	for net in nets:
-		logging.info("Start training {} net (epochs: {})".format(net, epochs_count))
-		pid = subprocess.Popen(
-			[
-				"python",
-				train_script,
-				"-m", net,
-				"-n", str(epochs_count),
-				"-b", str(batches[net]),
-				"-o", "true"]
-		)
-		pid.wait()
-		logging.info("Finished training {}".format(net))
-
-	logging.info("Finished all training, wait 30 seconds to computer shutdown")
-	time.sleep(30)
-	logging.info("Computer shutdown")
-	subprocess.call(["shutdown", "-f", "-s", "-t", "60"])
\ No newline at end of file
+	if args.shutdown:
+		logging.info("Wait 30 seconds to computer shutdown")
+		time.sleep(30)
+		logging.info("Computer shutdown")
+		subprocess.call(["shutdown", "-f", "-s", "-t", "60"])
+
+
+if __name__ == '__main__':
+	main()